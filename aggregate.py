@@ -0,0 +1,103 @@
+import itertools
+import numpy as np
+import pandas as pd
+
+# Aggregations shared by the collectors. A streamed payload, the
+# {column: [value per record]} of fluxapi.fetch_columns(), is turned into
+# NumPy arrays once by columnar() and every metric below is a vectorized
+# reduction over those arrays, so a new metric needs no extra pass over the
+# payload. Missing leaves are NaN in numeric columns and count as zero in the
+# totals, like a node that reports nothing.
+
+
+# float64 array with NaN for missing (None) values, in one C-level pass
+def numeric(values):
+    if isinstance(values, np.ndarray) and values.dtype.kind == 'f':
+        return values
+    return np.array(values, dtype='float64')
+
+
+# Convert the numeric columns of a payload to float arrays and the others
+# (node keys, addresses) to object arrays. Columns holding a list per record
+# (e.g. the running images of every node) are left alone.
+def columnar(columns, numeric_fields=()):
+    arrays = {}
+    for column, values in columns.items():
+        if column in numeric_fields:
+            arrays[column] = numeric(values)
+        elif values and isinstance(values[0], list):
+            arrays[column] = values
+        else:
+            arrays[column] = np.array(values, dtype=object)
+    return arrays
+
+
+# Sum of a column; an int when every value is a whole number, as the counts
+# and sizes of the payloads are, so totals such as totalbenchmarkcores keep
+# being written as integers like the sum over the JSON values was
+def total(values):
+    values = numeric(values)
+    summed = np.nansum(values)
+    present = values[~np.isnan(values)]
+    if np.array_equal(present, np.trunc(present)) and abs(summed) < 2 ** 53:
+        return int(summed)
+    return float(summed)
+
+
+def unique_count(values):
+    values = pd.Series(values, dtype=object)
+    return int(values[values.notna()].nunique())
+
+
+# {item: count} over the lists of every record, in order of first appearance,
+# without the items in exclude; plus the total of the counts
+def histogram(lists, exclude=()):
+    items = pd.Series(list(itertools.chain.from_iterable(lists)), dtype=object)
+    counts = items.value_counts(sort=False)
+    if exclude:
+        counts = counts[~counts.index.isin(list(exclude))]
+    return {item: int(count) for item, count in counts.items()}, int(counts.sum())
+
+
+def bench_metrics(bench_data):
+    return {
+        'totalbenchmarkcores': total(bench_data['cores']),
+        'totalbenchmarkram': total(bench_data['ram']),
+        'totalbenchmarkssd': total(bench_data['ssd']),
+    }
+
+
+def util_metrics(util_data):
+    ram = numeric(util_data['ram'])
+    return {
+        'totalutilcores': total(util_data['cpus']),
+        'totalutilram': float(np.nansum(ram)) / 1000,
+        'totalutilssd': total(util_data['hdd']),
+        'notutilizednodes': int(np.count_nonzero(ram == 0)),
+    }
+
+
+# Node and tier counts come aggregated from getzelnodecount
+def node_metrics(total_nodes_data):
+    return {
+        'totalnodes': total_nodes_data['data']['total'],
+        'total_cumulus': total_nodes_data['data']['cumulus-enabled'],
+        'total_nimbus': total_nodes_data['data']['nimbus-enabled'],
+        'total_stratus': total_nodes_data['data']['stratus-enabled'],
+    }
+
+
+def wallet_metrics(wallet_data):
+    return {'unique_wallet_count': unique_count(wallet_data['payment_address'])}
+
+
+# Percentages need both sides, they are left out when one endpoint failed
+def ratio_metrics(metrics):
+    ratios = {}
+    if 'totalbenchmarkcores' in metrics and 'totalutilcores' in metrics:
+        ratios['utilization_percentage_cores'] = (metrics['totalutilcores'] / metrics['totalbenchmarkcores']) * 100
+        ratios['utilization_percentage_ram'] = (metrics['totalutilram'] / metrics['totalbenchmarkram']) * 100
+        ratios['utilization_percentage_ssd'] = (metrics['totalutilssd'] / metrics['totalbenchmarkssd']) * 100
+    if 'totalnodes' in metrics and 'notutilizednodes' in metrics:
+        ratios['utilization_nodes'] = (metrics['totalnodes'] - metrics['notutilizednodes']) / metrics['totalnodes'] * 100
+    return ratios
@@ -3,157 +3,251 @@ import asyncio
 import json
 import os
 import datetime
+import logging
+import sys
+import tempfile
+import history_store
+import rollups
+import node_store
+import aggregate
+import ijson
+import metrics
+from fluxapi import create_session, fetch_json, fetch_columns, FluxApiError, NOT_MODIFIED
+from response_cache import ResponseCache
 
-benchurl = "https://stats.runonflux.io/fluxinfo?projection=benchmark"
-utilurl = "https://stats.runonflux.io/fluxinfo?projection=apps.resources"
+benchurl = "https://stats.runonflux.io/fluxinfo?projection=benchmark,ip"
+utilurl = "https://stats.runonflux.io/fluxinfo?projection=apps.resources,ip"
 totalnodeurl = "https://api.runonflux.io/daemon/getzelnodecount"
 walleturl = "https://api.runonflux.io/daemon/viewdeterministiczelnodelist"
 
-async def fetch_bench_data(url):
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    return data
-                else:
-                    raise Exception(f"Request failed with status code: {response.status}")
-    except aiohttp.ClientError as e:
-        # Handle any other request-related errors
-        print(f"An error occurred: {str(e)}")
-        return None
-        
+# Labels used when printing a snapshot
+SUMMARY_LABELS = {
+    'totalbenchmarkcores': 'Total benchmark Threads: {}',
+    'totalbenchmarkram': 'Total benchmark Ram: {}',
+    'totalbenchmarkssd': 'Total benchmark SSD: {}',
+    'totalutilcores': 'Total Util Threads: {}',
+    'totalutilram': 'Total Util Ram: {}',
+    'totalutilssd': 'Total Util SSD: {}',
+    'notutilizednodes': 'Number unutilized Nodes: {}',
+    'totalnodes': 'Total amount of Nodes = {}',
+    'total_cumulus': 'Total amount of Cumulus = {}',
+    'total_nimbus': 'Total amount of Nimbus = {}',
+    'total_stratus': 'Total amount of Stratus = {}',
+    'utilization_percentage_cores': 'Utilization Percentage (Cores): {:.2f}%',
+    'utilization_percentage_ram': 'Utilization Percentage (Ram): {:.2f}%',
+    'utilization_percentage_ssd': 'Utilization Percentage (SSD): {:.2f}%',
+    'utilization_nodes': 'Utilization Nodes: {:.2f}%',
+    'unique_wallet_count': 'Unique Wallet IDs: {}',
+}
 
-async def fetch_wallet_data(url):
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    return data
-                else:
-                    raise Exception(f"Request failed with status code: {response.status}")
-    except aiohttp.ClientError as e:
-        # Handle any other request-related errors
-        print(f"An error occurred: {str(e)}")
-        return None
-        
-async def fetch_util_data(url):
+
+# Set FLUXUTILMON_CAPTURE_NODES=1 (or run apidata.py --nodes) to also keep
+# every node's benchmark and locked resources in data/nodes/
+CAPTURE_NODES = os.environ.get('FLUXUTILMON_CAPTURE_NODES') == '1'
+
+# Set FLUXUTILMON_ARCHIVE=1 (or run apidata.py --archive) to keep the raw
+# payloads in data/archive/, see payload_archive.py
+ARCHIVE = os.environ.get('FLUXUTILMON_ARCHIVE') == '1'
+
+# Archive name and node key field per endpoint
+ARCHIVE_NAMES = {
+    'bench': ('benchmark', 'ip'),
+    'util': ('resources', 'ip'),
+    'totalnodes': ('nodecount', None),
+    'wallet': ('nodelist', 'ip'),
+}
+
+# Per-node leaves streamed out of the large fluxinfo and node list payloads.
+# node keys the per-node capture; the projections above ask for ip so every
+# record carries it, records that still lack it are left out of the capture.
+BENCH_FIELDS = {
+    'node': 'ip',
+    'cores': 'benchmark.bench.cores',
+    'ram': 'benchmark.bench.ram',
+    'ssd': 'benchmark.bench.ssd',
+}
+UTIL_FIELDS = {
+    'node': 'ip',
+    'cpus': 'apps.resources.appsCpusLocked',
+    'ram': 'apps.resources.appsRamLocked',
+    'hdd': 'apps.resources.appsHddLocked',
+}
+WALLET_FIELDS = {'payment_address': 'payment_address'}
+
+# Leaves converted to float arrays on arrival, the others become object arrays
+NUMERIC_FIELDS = ('cores', 'ram', 'ssd', 'cpus', 'hdd')
+
+# The benchmark projection and the node list barely change between runs.
+# Their parsed columns are reused for this many seconds and revalidated with
+# ETag/Last-Modified afterwards; 0 always revalidates. WALLET_CACHE_TTL alone
+# decides how often the wallet list behind the wallet count is downloaded.
+BENCH_CACHE_TTL = int(os.environ.get('FLUXUTILMON_BENCH_CACHE_TTL', 60 * 60))
+WALLET_CACHE_TTL = int(os.environ.get('FLUXUTILMON_WALLET_CACHE_TTL', 60 * 60))
+
+response_cache = ResponseCache()
+
+
+# Run one endpoint fetch, returning None when it still fails after the
+# retries so the other endpoints of the snapshot can be used on their own
+async def fetch_endpoint(url, fetch):
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    if data.get('status') == 'error' and data.get('data', {}).get('message') == 'Internal error. Try again later':
-                        raise Exception('Internal error. Try again later')
-                    return data
-                else:
-                    raise Exception(f"Request failed with status code: {response.status}")
-                
-    except aiohttp.ClientError as e:
+        return await fetch
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, ijson.JSONError, FluxApiError) as e:
         # Handle any other request-related errors
-        print(f"An error occurred: {str(e)}")
+        print(f"An error occurred fetching {url}: {str(e) or type(e).__name__}")
+        logging.info(f"An error occurred fetching {url}: {str(e) or type(e).__name__}")
         return None
-        
-async def fetch_totalnodes(url):
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as response:
-            data = await response.json()
-            return data
 
+# fetch_columns plus the one conversion of the payload to arrays
+# (aggregate.columnar), so a cached response keeps the arrays
+async def fetch_arrays(session, url, fields, headers=None, validators=None, raw=None):
+    columns = await fetch_columns(session, url, fields, headers=headers, validators=validators, raw=raw)
+    if columns is NOT_MODIFIED:
+        return columns
+    return aggregate.columnar(columns, NUMERIC_FIELDS)
+
+# fetch_arrays through the response cache
+def fetch_cached_arrays(session, url, fields, ttl, raw=None):
+    return response_cache.get(
+        url, lambda headers, validators: fetch_arrays(session, url, fields, headers, validators, raw), ttl)
+
+# raw, a binary file, receives the downloaded body for the archive; it stays
+# empty when the response cache answered
+async def fetch_bench_data(session, url, raw=None):
+    return await fetch_endpoint(url, fetch_cached_arrays(session, url, BENCH_FIELDS, BENCH_CACHE_TTL, raw))
+
+async def fetch_wallet_data(session, url, raw=None):
+    return await fetch_endpoint(url, fetch_cached_arrays(session, url, WALLET_FIELDS, WALLET_CACHE_TTL, raw))
+
+async def fetch_util_data(session, url, raw=None):
+    return await fetch_endpoint(url, fetch_arrays(session, url, UTIL_FIELDS, raw=raw))
+
+async def fetch_totalnodes(session, url, raw=None):
+    return await fetch_endpoint(url, fetch_json(session, url, raw=raw))
 
-async def main():
-    bench_data = await fetch_bench_data(benchurl)
-    util_data = await fetch_util_data(utilurl)
-    total_nodes_data = await fetch_totalnodes(totalnodeurl)
-    wallet_data = await fetch_wallet_data(walleturl)
 
+# Work out the snapshot metrics from whichever endpoints answered, every
+# section is a set of vectorized reductions in aggregate.py
+def compute_metrics(bench_data, util_data, total_nodes_data, wallet_data):
+    metrics = {}
+    sections = [
+        ('bench_data', bench_data, aggregate.bench_metrics),
+        ('util_data', util_data, aggregate.util_metrics),
+        ('total_nodes_data', total_nodes_data, aggregate.node_metrics),
+        ('wallet_data', wallet_data, aggregate.wallet_metrics),
+    ]
+    for name, data, compute in sections:
+        if data is None:
+            continue
+        try:
+            metrics.update(compute(data))
+        except (KeyError, TypeError, ValueError) as e:
+            print(f"Error processing {name}: {str(e)}")
+            logging.info(f"Error processing {name}: {str(e)}")
+
+    metrics.update(aggregate.ratio_metrics(metrics))
+    return metrics
+
+
+# Take a utilization snapshot using the shared session from fluxapi.create_session().
+# All endpoints are requested at once, so the snapshot takes as long as the
+# slowest endpoint rather than the sum of all four. capture_nodes also writes
+# the per-node columns, defaulting to FLUXUTILMON_CAPTURE_NODES. archive
+# keeps the raw payloads, defaulting to FLUXUTILMON_ARCHIVE.
+async def collect_utilization(session, capture_nodes=None, archive=None):
+    if capture_nodes is None:
+        capture_nodes = CAPTURE_NODES
+    if archive is None:
+        archive = ARCHIVE
+    # Raw bodies for the archive are spooled to temporary files as they stream in
+    raws = {endpoint: tempfile.TemporaryFile() for endpoint in ARCHIVE_NAMES} if archive else {}
     try:
-        totalbenchmarkcores = sum(record['benchmark']['bench']['cores'] for record in bench_data['data'])
-        totalbenchmarkram = sum(record['benchmark']['bench']['ram'] for record in bench_data['data'])
-        totalbenchmarkssd = sum(record['benchmark']['bench']['ssd'] for record in bench_data['data'])
-        
-        totalutilcores = sum(record['apps']['resources']['appsCpusLocked'] for record in util_data['data'])
-        totalutilram = ((sum(record['apps']['resources']['appsRamLocked'] for record in util_data['data']))) / 1000
-        totalutilssd = sum(record['apps']['resources']['appsHddLocked'] for record in util_data['data'])
-    
-        notutilizednodes = sum(1 for record in util_data['data'] if record['apps']['resources']['appsRamLocked'] == 0)
-    
-        totalnodes = total_nodes_data['data']['total']
-        total_cumulus = total_nodes_data['data']['cumulus-enabled']
-        total_nimbus = total_nodes_data['data']['nimbus-enabled']
-        total_stratus = total_nodes_data['data']['stratus-enabled']
-    
-        utilization_percentage_cores = (totalutilcores / totalbenchmarkcores) * 100
-        utilization_percentage_ram = (totalutilram / totalbenchmarkram) * 100
-        utilization_percentage_ssd = (totalutilssd / totalbenchmarkssd) * 100
-        utilization_nodes = (totalnodes - notutilizednodes) / totalnodes * 100
-        snapshot_date = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-
-
-     # Unique wallet ids
-        unique_wallet_ids = set(record['payment_address'] for record in wallet_data['data'])
-        unique_wallet_count = len(unique_wallet_ids)  # Calculate the count of unique wallet ids
-        print(f'Unique Wallet IDs: {unique_wallet_count}')
-    except (KeyError, TypeError) as e:
-        print(f"Error processing bench_data: {str(e)}")
-        # Handle the error gracefully, e.g., retry later or continue without creating the JSON file
-
-    
-
-    jsondata = {
-        'Snapshot': snapshot_date,
-        'totalbenchmarkcores': totalbenchmarkcores,
-        'totalbenchmarkram': totalbenchmarkram,
-        'totalbenchmarkssd': totalbenchmarkssd,
-        'totalutilcores': totalutilcores,
-        'totalutilram': totalutilram,
-        'totalutilssd': totalutilssd,
-        'notutilizednodes': notutilizednodes,
-        'totalnodes': totalnodes,
-        'utilization_percentage_cores': utilization_percentage_cores,
-        'utilization_percentage_ram': utilization_percentage_ram,
-        'utilization_percentage_ssd': utilization_percentage_ssd,
-        'utilization_nodes': utilization_nodes,
-        'total_cumulus': total_cumulus,
-        'total_nimbus': total_nimbus,
-        'total_stratus': total_stratus,
-        'unique_wallet_count': unique_wallet_count
-
-    }
+        return await take_snapshot(session, capture_nodes, raws)
+    finally:
+        for raw in raws.values():
+            raw.close()
+
+
+# collect_utilization with the raw bodies to archive per endpoint in raws,
+# none when the payloads are not archived
+async def take_snapshot(session, capture_nodes, raws):
+    bench_data, util_data, total_nodes_data, wallet_data = await asyncio.gather(
+        fetch_bench_data(session, benchurl, raws.get('bench')),
+        fetch_util_data(session, utilurl, raws.get('util')),
+        fetch_totalnodes(session, totalnodeurl, raws.get('totalnodes')),
+        fetch_wallet_data(session, walleturl, raws.get('wallet')),
+    )
+
+    snapshot_date = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+    with metrics.timed('aggregate', collector='utilization'):
+        snapshot_metrics = compute_metrics(bench_data, util_data, total_nodes_data, wallet_data)
+    if not snapshot_metrics:
+        # Continue without creating the JSON file, the next run will retry
+        print("No endpoint returned usable data, no snapshot written")
+        logging.info("No endpoint returned usable data, no snapshot written")
+        return None
+
+    jsondata = {'Snapshot': snapshot_date}
+    jsondata.update(snapshot_metrics)
+
     filename = f'utilization_{snapshot_date}.json'
     filepath = os.path.join('data', filename)
     os.makedirs(os.path.dirname(filepath), exist_ok=True)
 
-    with open(filepath, 'w') as f:
+    with metrics.timed('write', collector='utilization', target='snapshot'), open(filepath, 'w') as f:
         json.dump(jsondata, f, indent=4)
 
     print(f'Data written to {filepath}')
-    
-    print(f'Total benchmark Threads: {totalbenchmarkcores}')
-    print(f'Total benchmark Ram: {totalbenchmarkram}')
-    print(f'Total benchmark SSD: {totalbenchmarkssd}')
-    
-    print(f'Total Util Threads: {totalutilcores}')
-    print(f'Total Util Ram: {totalutilram}')
-    print(f'Total Util SSD: {totalutilssd}')
-    
-    print(f'Number unutilized Nodes: {notutilizednodes}')
-    print(f'Total amount of Nodes = {totalnodes}')
-    print(f'Total amount of Cumulus = {total_cumulus}')
-    print(f'Total amount of Nimbus = {total_nimbus}')
-    print(f'Total amount of Stratus = {total_stratus}')
-    
-    print(f'Utilization Percentage (Cores): {utilization_percentage_cores:.2f}%')
-    print(f'Utilization Percentage (Ram): {utilization_percentage_ram:.2f}%')
-    print(f'Utilization Percentage (SSD): {utilization_percentage_ssd:.2f}%')
-    print(f'Utilization Nodes: {utilization_nodes:.2f}%')
-    print(f'Unique Wallet IDs: {unique_wallet_count}')
-
-# Create and run the event loop
-loop = asyncio.new_event_loop()
-asyncio.set_event_loop(loop)
-try:
-    loop.run_until_complete(main())
-finally:
-    loop.close()
\ No newline at end of file
+
+    # Keep the history store in step once it has been created (python3 history_store.py)
+    if history_store.exists():
+        with metrics.timed('write', collector='utilization', target='history_store'):
+            history_store.append_utilization(jsondata)
+        print(f'Data appended to {history_store.STORE_FILE}')
+
+    # Same for the rollups once they have been built (python3 rollups.py)
+    if rollups.exists():
+        with metrics.timed('write', collector='utilization', target='rollups'):
+            rollups.update_utilization(jsondata)
+        print(f'Data rolled up in {rollups.ROLLUP_FILE}')
+
+    if capture_nodes:
+        with metrics.timed('write', collector='utilization', target='nodes'):
+            node_file = node_store.write_node_snapshot(snapshot_date, node_store.join_nodes(bench_data, util_data))
+        print(f'Per-node data written to {node_file}')
+
+    if raws:
+        # Imported on first use, zstandard is only needed for the archive
+        import payload_archive
+        answered = {'bench': bench_data, 'util': util_data, 'totalnodes': total_nodes_data, 'wallet': wallet_data}
+        downloads = [(ARCHIVE_NAMES[endpoint][0], raws[endpoint], ARCHIVE_NAMES[endpoint][1])
+                     for endpoint, data in answered.items() if data is not None]
+        with metrics.timed('write', collector='utilization', target='archive'):
+            payload_archive.archive_downloads(snapshot_date, downloads)
+        print(f'Raw payloads archived in {payload_archive.ARCHIVE_DIR}')
+
+    for key, label in SUMMARY_LABELS.items():
+        if key in jsondata:
+            print(label.format(jsondata[key]))
+    missing = [key for key in SUMMARY_LABELS if key not in jsondata]
+    if missing:
+        print(f'Partial snapshot, missing: {", ".join(missing)}')
+        logging.info(f'Partial snapshot {snapshot_date}, missing: {", ".join(missing)}')
+
+    return jsondata
+
+
+async def main():
+    async with create_session() as session:
+        await collect_utilization(session, capture_nodes=CAPTURE_NODES or '--nodes' in sys.argv,
+                                  archive=ARCHIVE or '--archive' in sys.argv)
+
+
+if __name__ == "__main__":
+    # Create and run the event loop
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(main())
+    finally:
+        loop.close()
@@ -1,365 +1,575 @@
-import json, glob, os
+import os
 import time
-import subprocess
-import pandas as pd
-import plotly.express as px
+import asyncio
 import dash_bootstrap_components as dbc
-from dash import Dash, html, dcc, callback, Output, Input
-from dash_bootstrap_templates import load_figure_template
+from dash import Dash, html, dcc, Output, Input, State, no_update
+from flask import jsonify, Response, request
 import logging
 import datetime
 import threading
-import schedule
-from concurrent.futures import ThreadPoolExecutor
+from figure_cache import FigureCache
+from collector_lock import CollectorLock
+from scheduler import Job, Scheduler
+import data_snapshot
+import metrics
 
-load_figure_template(["cyborg", "darkly"])
+# pandas, plotly and the modules built on them (dataframes, resample,
+# rollups, shared_history, query_api) as well as aiohttp are imported where
+# they are first used, so importing app.py and binding the port does not
+# wait for them. The history loading thread pulls most of them in right after.
 
-# Clear the log file
-if os.path.exists('app.log'):
-    os.remove('app.log')
-
-# Configure logging 
-logging.basicConfig(filename='app.log', level=logging.DEBUG)
+# Configure logging, replacing the root handlers gunicorn installs
+logging.basicConfig(filename='app.log', level=logging.DEBUG, force=True)
 
 # Dash app
 app = Dash(__name__, external_stylesheets = [dbc.themes.BOOTSTRAP, dbc.themes.DARKLY])
 
-# Generate Docker count data
-def generate_docker_dataframe():
-    # Get all cleaned_data.json files in the data directory
-    print("Generating dataframes process started...")
-    logging.info("Generating Docker count dataframes process started...")
-    docker_files = glob.glob(os.path.join('data', 'docker*.json'))
-
-    # Print the cleaned data files
-    print(f"Cleaned data files read into report: {docker_files}")
-    logging.info(f"Cleaned data files read into report: {docker_files}")
-
-    # Initialize empty dataframes
-    df = pd.DataFrame()
-
-    for file in docker_files:
-        # Load the JSON data from the file
-        with open(file) as f:
-            print('Json file loaded...{file}')
-            data = json.load(f)
-            snapshot_date = data["Snapshot"]
-            image_counts = data["ImageCounts"]
-            data_list = []
-            for image, count in image_counts.items():
-                data_list.append({"Snapshot": snapshot_date, "Docker Name": image, "Quantity": count})
-            
-        # Append the data to the existing DataFrame
-        df = df._append(data_list, ignore_index=True)
-
-    # Print the DataFrame
-    print(df)
-    logging.info("Docker count dataframes process completed...")
-    return df
-
-# Generate Utilization Dataframe
-def generate_utilization_dataframe():
-    # Get all docker*.json files in the data directory
-    logging.info("Generating Utilization dataframes process started...")
-    docker_files = glob.glob(os.path.join('data', 'utilization*.json'))
-
-    # Initialize empty dataframes
-    df = pd.DataFrame()
-
-    for file in docker_files:
-        # Load the JSON data from the file
-        with open(file) as f:
-            data = json.load(f)
-            snapshot_date = data["Snapshot"]
-            metric_values = {key: value for key, value in data.items() if key not in ["Snapshot"]}
-            data_list = []
-            for metric, value in metric_values.items():
-                data_list.append({"Snapshot": snapshot_date, "Metric": metric, "Value": value})
-            
-            # Append the data to the existing DataFrame
-            df = df._append(data_list, ignore_index=True)
-
-    logging.info("Utilization dataframes process completed...")
-    return df
-
-
-def create_dataframe_and_figure():
-    # Get all cleaned_data.json files in the data directory
-    print("Generating dataframes process started...")
-    logging.info("Generating dataframes process started...")
-    docker_files = glob.glob(os.path.join('data', 'docker*.json'))
-
-    # Print the cleaned data files
-    print(f"Cleaned data files read into report: {docker_files}")
-    logging.info(f"Cleaned data files read into report: {docker_files}")
-
-    # Initialize empty dataframes
-    df = pd.DataFrame(columns=['Snapshot Date', 'Total Docker Count'])
-
-    for file in docker_files:
-        # Load the JSON data from the file
-        with open(file) as f:
-            print(f'Json file loaded: {file}')
-            data = json.load(f)
-            snapshot_date = data["Snapshot"]
-            total_docker_count = data["Total Docker Count"]
-
-        # Append the data to the existing DataFrame
-        df = df._append({'Snapshot Date': snapshot_date, 'Total Docker Count': total_docker_count}, ignore_index=True)
-
-    # Sort the DataFrame by 'Snapshot Date' in ascending order
-    df = df.sort_values('Snapshot Date')
-
-    # Print the DataFrame
-    print(df)
-    logging.info("The docker dataframes process completed...")
-
-    #Convert Snapshot Date to date time
-    df['Snapshot Date'] = pd.to_datetime(df['Snapshot Date'], format='%Y-%m-%d_%H-%M-%S')
-
-    # Create the line graph using px.line
-    fig = px.line(df, x='Snapshot Date', y='Total Docker Count', title='Total Docker Count Over Time', markers=True, template='plotly_dark')
-
-    return df, fig
-
-
-def find_latest_util_json_file():
-    # Find the latest JSON file starting with "utilization"
-    logging.info("Checking latest utilization file....")
-    latest_util_file = None
-    latest_time = 0
-    for filename in os.listdir('data'):
-        if filename.startswith("utilization") and filename.endswith(".json"):
-            file_path = os.path.join('data', filename)
-            file_time = os.path.getmtime(file_path)
-            if file_time > latest_time:
-                latest_util_file = filename
-                latest_time = file_time
-    logging.info(f"Latest utilization file: {latest_util_file}")
-    return latest_util_file
-
-def find_latest_docker_json_file():
-    logging.info("Checking latest docker file....")
-    # Find the latest JSON file starting with "utilization"
-    latest_docker_file = None
-    latest_time = 0
-    for filename in os.listdir('data'):
-        if filename.startswith("docker") and filename.endswith(".json"):
-            file_path = os.path.join('data', filename)
-            file_time = os.path.getmtime(file_path)
-            if file_time > latest_time:
-                latest_docker_file = filename
-                latest_time = file_time
-    logging.info(f"Latest docker file: {latest_docker_file}")
-    return latest_docker_file
-
-def check_snapshot_age(json_file):
-    # Read the JSON file
-    logging.info(f"Checking snapshot age: {json_file}")
-    file_path = os.path.join('data', json_file)
-    with open(file_path, "r") as f:
-        data = json.load(f)
-
-    # Check if the snapshot date is older than 5 minutes from the current time
-    snapshot_date = data.get("Snapshot")
-    
-    if snapshot_date:
-        snapshot_datetime = datetime.datetime.strptime(snapshot_date, "%Y-%m-%d_%H-%M-%S")
-        current_datetime = datetime.datetime.now()
-        print("Checking snapshot age...")
-        logging.info("Checking snapshot age...")
-        print("Snapshot date:", snapshot_datetime.strftime("%Y-%m-%d %H:%M:%S"), ", Current time:", current_datetime.strftime("%Y-%m-%d %H:%M:%S"))
-        time_difference = current_datetime - snapshot_datetime
-        if time_difference.total_seconds() > 23 * 60 * 60:
-            print("Snapshot is older than 24 hours")
-            logging.info("Snapshot is older than 24 hours")
-            return True
-        else:
-            print("Last snapshot is still current no need to take snapshot")
-            logging.info("Last snapshot is still current no need to take snapshot")
-    return False
 
-def run_apidata():
-    # Run apidata.py to create a new snapshot
+# Collection intervals in seconds, e.g. FLUXUTILMON_UTILIZATION_INTERVAL=300
+# for a utilization snapshot every 5 minutes. The wallet count is part of the
+# utilization snapshot; how often the (large) wallet list behind it is
+# downloaded is up to the response cache, see FLUXUTILMON_WALLET_CACHE_TTL.
+UTILIZATION_INTERVAL = int(os.environ.get('FLUXUTILMON_UTILIZATION_INTERVAL', 23 * 60 * 60))
+DOCKER_INTERVAL = int(os.environ.get('FLUXUTILMON_DOCKER_INTERVAL', 23 * 60 * 60))
+
+async def run_apidata(session):
+    # Run the apidata.py collector in-process to create a new snapshot
     logging.info("Running apidata.py....")
     print("Running apidata.py....")
-    subprocess.run(["python3", "apidata.py"])
+    # Imported on first use, the collectors are not needed to serve the page
+    import apidata
+    try:
+        jsondata = await apidata.collect_utilization(session)
+    except Exception as e:
+        # A failed collection must not take the scheduler down with it
+        print(f"apidata.py failed: {str(e)}")
+        logging.exception("apidata.py failed")
+        return False
     logging.info("apidata.py completed")
+    return jsondata is not None
 
-def run_dockerdata():
-    # Run apidata.py to create a new snapshot
+async def run_dockerdata(session):
+    # Run the count_docker.py collector in-process to create a new snapshot
     print("Running count_docker.py....")
     logging.info("Running count_docker.py....")
-    subprocess.run(["python3", "count_docker.py"])
+    import count_docker
+    try:
+        data = await count_docker.get_running_apps(session)
+    except Exception as e:
+        # A failed collection must not take the scheduler down with it
+        print(f"count_docker.py failed: {str(e)}")
+        logging.exception("count_docker.py failed")
+        return False
     logging.info("count_docker.py completed")
-
-
-def check_snapshots():
-    print("Checking snapshots....", flush=True)
-    logging.info("Checking snapshots....")
-    latest_util_file = find_latest_util_json_file()
-    latest_docker_file = find_latest_docker_json_file()
-
-    if latest_util_file:
-        if check_snapshot_age(latest_util_file):
-            print("Snapshot is older than 5 minutes, running apidata.py")
-            logging.info("Snapshot is older than 5 minutes, running apidata.py")
-            run_apidata()
-            logging.info("Run_APIData.py completed, generating new utilization dataframe")
-            generate_utilization_dataframe()  # Reload the utilization dataframe
-            logging.info("Utilization dataframe reloaded")
-        else:
-            print("Snapshot is not old enough, no new snapshot will be taken")
-            logging.info("Snapshot is not old enough, no new snapshot will be taken")
-    else:
-        print("No latest file found, sleeping for 1 hour...")
-        logging.info("No latest file found, sleeping for 1 hour...")
-        print("Scheduler will check again in 1 hour")
-        logging.info("Scheduler will check again in 1 hour")
-
-    if latest_docker_file:
-        if check_snapshot_age(latest_docker_file):
-            print("Snapshot is older than 5 minutes, running count_docker.py")
-            logging.info("Snapshot is older than 5 minutes, running count_docker.py")
-            run_dockerdata()
-            logging.info("Run_DockerData.py completed, generating new docker dataframe")
-            generate_docker_dataframe()  # Reload the docker dataframe
-            logging.info("Docker dataframe reloaded")
-            create_dataframe_and_figure()
-            logging.info("Total Docker Count and Figure reloaded")
-        else:
-            print("Snapshot is not old enough, no new snapshot will be taken")
-            logging.info("Snapshot is not old enough, no new snapshot will be taken")
-    else:
-        print("No latest file found, sleeping for 1 hour...")
-        logging.info("No latest file found, sleeping for 1 hour...")
-        print("Scheduler will check again in 1 hour")
-
-
-# Check snapshots immediately
-check_snapshots()
-
-
-
-def run_scheduler():
-    global docker_df, dockertotal_df, utilization_df, fig
-    while True:
+    return data is not None
+
+
+# Newest snapshot time in a dataframe column, None without data
+def latest_snapshot(df, column):
+    if df is None or df.empty:
+        return None
+    return df[column].max().to_pydatetime()
+
+# One job per collector. The last run times start at the newest snapshots of
+# the published data, no need to look at data/ for them.
+def collection_jobs(session, shared=False):
+    data = data_snapshot.current()
+
+    # False when nothing was collected, the scheduler then tries again soon
+    async def collect(run):
+        collected = await run(session)
+        if collected:
+            # Publish (and export) what was just collected
+            await asyncio.to_thread(refresh_data, shared)
+        if shared:
+            # Timings for the /metrics of the other workers
+            metrics.export_state()
+        return collected
+
+    return [
+        Job('utilization', UTILIZATION_INTERVAL, lambda: collect(run_apidata),
+            last_run=latest_snapshot(data and data.utilization_df, 'Snapshot')),
+        Job('docker', DOCKER_INTERVAL, lambda: collect(run_dockerdata),
+            last_run=latest_snapshot(data and data.dockertotal_df, 'Snapshot Date')),
+    ]
+
+def refresh_data(shared=False):
+    # The jobs refresh concurrently, each from what the last one published
+    with metrics.timed('reload', source='incremental'):
+        snapshot = data_snapshot.refresh_snapshot(publish_data)
+    if shared:
+        export_data(snapshot)
+
+# Export snapshot for the workers that are not the collector
+def export_data(snapshot):
+    import shared_history
+    with metrics.timed('write', target='shared_export'):
+        shared_history.export_snapshot(snapshot)
+
+
+# Seconds a worker that is not the collector waits between looks at the
+# shared history
+SHARED_POLL_SECONDS = 60
+
+collector_lock = CollectorLock()
+
+
+async def scheduler_loop(shared=False):
+    from fluxapi import create_session
+    # Another worker collects, pick up what it exports until it goes away
+    while shared and not collector_lock.acquire():
+        await asyncio.to_thread(load_shared_history)
+        await asyncio.sleep(SHARED_POLL_SECONDS)
+
+    # One pooled session for the lifetime of the scheduler, so every
+    # collection reuses the keep-alive connections of the last one
+    async with create_session() as session:
         print("Running scheduler...")
         logging.info("Running scheduler...")
-        check_snapshots()
-        docker_df = generate_docker_dataframe()
-        dockertotal_df, fig = create_dataframe_and_figure()
-        utilization_df = generate_utilization_dataframe()
-        time.sleep(60 * 60)  # Sleep for 1 hour
-
-scheduler_thread = ThreadPoolExecutor().submit(run_scheduler)
+        await Scheduler(collection_jobs(session, shared)).run()
+
+# Swap in a new data snapshot; figures of the previous version are stale now
+def publish_data(snapshot):
+    data_snapshot.publish(snapshot)
+    figure_cache.bump(snapshot.version)
+
+# Publish the collector's latest export if this worker does not have it yet
+shared_export_id = None
+
+def load_shared_history():
+    global shared_export_id
+    import shared_history
+    export_id = shared_history.latest_export_id()
+    if export_id is None or export_id == shared_export_id:
+        return False
+    try:
+        with metrics.timed('reload', source='shared_export'):
+            frames = shared_history.load_export(export_id)
+    except OSError:
+        # Pruned by the collector in the meantime, the next poll gets the new one
+        logging.exception(f"Shared history export {export_id} could not be loaded")
+        return False
+    publish_data(data_snapshot.snapshot_from_frames(*frames))
+    shared_export_id = export_id
+    return True
+
+# History loaded first, so the charts have something to show early on
+RECENT_HISTORY = datetime.timedelta(days=7)
+
+# Set once the whole history is in the published snapshot
+history_complete = False
+
+# Seconds a worker that is not the collector waits between looks for the
+# collector's first export
+EXPORT_POLL_SECONDS = 1
+
+# Wait for the collector's export instead of parsing data/ alongside it.
+# True once an export is published, False when this worker is the collector
+# and has to load data/ itself.
+def wait_for_export():
+    if collector_lock.acquire():
+        return False
+    while not load_shared_history():
+        if collector_lock.acquire():
+            # The collector went away before it exported anything
+            return False
+        time.sleep(EXPORT_POLL_SECONDS)
+    return True
+
+# Load the history in the background while the server already answers:
+# first the recent snapshots, then everything. With shared=True only the
+# collector reads data/, the other workers wait for its export.
+def load_history(shared=False):
+    global history_complete
+    # Templates only matter once there is data to draw
+    from dash_bootstrap_templates import load_figure_template
+    import rollups
+    load_figure_template(["cyborg", "darkly"])
+
+    if shared and wait_for_export():
+        history_complete = True
+        return
+    with metrics.timed('reload', source='recent_history'):
+        recent = data_snapshot.build_snapshot(since=datetime.datetime.now() - RECENT_HISTORY)
+    if not recent.docker_df.empty and not recent.utilization_df.empty:
+        publish_data(recent)
+    with metrics.timed('reload', source='full_history'):
+        snapshot = data_snapshot.build_snapshot()
+    if (not shared or collector_lock.held) and not rollups.exists():
+        # First start with rollups, the collectors keep them up to date from here on
+        rollups.build(snapshot.docker_df, snapshot.dockertotal_df, snapshot.utilization_df)
+    publish_data(snapshot)
+    if shared and collector_lock.held:
+        # The other workers map this export instead of parsing data/ too
+        export_data(snapshot)
+    history_complete = True
+    print("History loaded")
+    logging.info("History loaded")
+
+def run_scheduler(shared=False):
+    try:
+        load_history(shared)
+    except Exception:
+        # Nothing published, the first collection builds the snapshot from scratch
+        logging.exception("Loading the history failed")
+    asyncio.run(scheduler_loop(shared))
+
+# Figures built by the callbacks, shared by every viewer until the next load
+figure_cache = FigureCache()
+
+# Set by start(shared=True), when the collector may be another worker
+shared_workers = False
+
+# Start loading the history and collecting in the background and return at
+# once, so the server can bind its port while the data comes in. With
+# shared=True (several gunicorn workers) only the worker holding the
+# collector lock collects; the others map its exports. The thread is a
+# daemon, so a worker told to exit does not wait for the next collection.
+def start(shared=False):
+    global shared_workers
+    shared_workers = shared
+    thread = threading.Thread(target=run_scheduler, args=(shared,), name='scheduler', daemon=True)
+    thread.start()
+    return thread
 
 def main():
+    # With debug the reloader serves from a child process, only that one
+    # loads the history and collects
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start()
     # Start the Dash app
-    app.run_server(host='0.0.0.0', port=8049, debug=True)
+    app.run(host='0.0.0.0', port=8049, debug=True)
     print("App started...")
     logging.info("App started...")
 
 
-docker_df = generate_docker_dataframe()
-dockertotal_df, fig = create_dataframe_and_figure()
-utilization_df = generate_utilization_dataframe()
-
-
-# Define the layout of the app
-app.layout = html.Div([
-    dbc.CardGroup([
-        dbc.Card(
-            dbc.CardBody([
-                dbc.Label("Docker Name"),
-                dbc.Select(
-                    id='docker-dropdown',
-                    options=[{'label': name, 'value': name} for name in docker_df['Docker Name'].unique()],
-                    value=docker_df['Docker Name'].unique()
-                )
-            ]),
-        ),
-        dbc.Card(
-            dbc.CardBody([
-                dbc.Label("Utilization Metric"),
-                dbc.Select(
-                    id='util-dropdown',
-                    options=[{'label': metric, 'value': metric} for metric in utilization_df['Metric'].unique()],
-                    value=utilization_df['Metric'].unique()
-                )
-            ]),
-        )
-    ]),
-    dcc.Graph(id='line-chart'),
-    dcc.Graph(id='DockerTotalGraph', figure=fig),
-    dcc.Interval(id='interval', interval=60 * 60 * 1000, n_intervals=0),
-    dcc.Graph(id='UtilGraph')
-])
+# How often the page polls for a new data snapshot, in ms. While the history
+# is still loading it polls more often so the charts appear soon after.
+VERSION_POLL_INTERVAL = 60 * 1000
+LOADING_POLL_INTERVAL = 2 * 1000
+
+# Options of the history range control, see resample.HISTORY_RANGES
+HISTORY_RANGE_LABELS = {'7d': '7 days', '30d': '30 days', '90d': '90 days', '1y': '1 year', 'all': 'All'}
+
+# Define the layout of the app, rebuilt on every page load so the dropdowns
+# list what the latest published data snapshot holds. Until the first
+# snapshot is published the page shows a loading notice and empty charts.
+def serve_layout():
+    data = data_snapshot.current()
+    docker_names = data.docker_names if data else ()
+    metrics = data.metrics if data else ()
+    return html.Div([
+        dbc.Alert("Loading the snapshot history, the charts will appear shortly...", id='loading-alert',
+                  color='info', is_open=data is None),
+        dbc.CardGroup([
+            dbc.Card(
+                dbc.CardBody([
+                    dbc.Label("Docker Name"),
+                    dbc.Select(
+                        id='docker-dropdown',
+                        options=[{'label': name, 'value': name} for name in docker_names],
+                        value=list(docker_names)
+                    )
+                ]),
+            ),
+            dbc.Card(
+                dbc.CardBody([
+                    dbc.Label("Utilization Metric"),
+                    dbc.Select(
+                        id='util-dropdown',
+                        options=[{'label': metric, 'value': metric} for metric in metrics],
+                        value=list(metrics)
+                    )
+                ]),
+            ),
+            dbc.Card(
+                dbc.CardBody([
+                    dbc.Label("History Range"),
+                    dbc.RadioItems(
+                        id='history-range',
+                        options=[{'label': label, 'value': value} for value, label in HISTORY_RANGE_LABELS.items()],
+                        value='all',
+                        inline=True
+                    )
+                ]),
+            )
+        ]),
+        dcc.Graph(id='line-chart'),
+        dcc.Graph(id='DockerTotalGraph'),
+        dcc.Interval(id='interval', interval=60 * 60 * 1000, n_intervals=0),
+        dcc.Graph(id='UtilGraph'),
+        dbc.CardGroup([
+            dbc.Card(
+                dbc.CardBody([
+                    dbc.Label("Top Docker Images"),
+                    html.Div(id='top-images')
+                ]),
+            ),
+            dbc.Card(
+                dbc.CardBody([
+                    dcc.Graph(id='ChurnGraph')
+                ]),
+            )
+        ]),
+        # Polls for a newly published data snapshot
+        dcc.Interval(id='data-version-interval', interval=VERSION_POLL_INTERVAL if data else LOADING_POLL_INTERVAL, n_intervals=0),
+        dcc.Store(id='data-version', data=data.version if data else None)
+    ])
+
+app.layout = serve_layout
+
+
+# Readiness probe: 503 until the first data snapshot is published
+@app.server.route('/ready')
+def ready():
+    data = data_snapshot.current()
+    if data is None:
+        return jsonify(ready=False, history_complete=False), 503
+    return jsonify(ready=True, history_complete=history_complete, version=data.version,
+                   loaded_at=data.loaded_at.isoformat())
+
+
+# Phase timings in the Prometheus text format. Under gunicorn a worker that
+# is not the collector adds the collector's timings from its last export; a
+# single process collects itself and never reads one left behind.
+@app.server.route('/metrics')
+def metrics_endpoint():
+    states = [metrics.registry.state()]
+    if shared_workers and not collector_lock.held:
+        states.append(metrics.read_state())
+    return Response(metrics.render(*states), mimetype='text/plain; version=0.0.4')
+
+
+# JSON/CSV query API over the published data snapshot, see query_api.py
+def query(name):
+    import query_api
+    return query_api.handle(getattr(query_api, name), request.args)
+
+@app.server.route('/api/utilization')
+def api_utilization():
+    return query('query_utilization')
+
+@app.server.route('/api/utilization/metrics')
+def api_utilization_metrics():
+    return query('list_metrics')
+
+@app.server.route('/api/docker')
+def api_docker():
+    return query('query_docker')
+
+@app.server.route('/api/docker/total')
+def api_docker_total():
+    return query('query_docker_total')
+
+@app.server.route('/api/docker/top')
+def api_docker_top():
+    return query('query_top_images')
+
+@app.server.route('/api/docker/images')
+def api_docker_images():
+    return query('list_images')
+
+
+# Tell the page when the scheduler published a new data snapshot
+@app.callback(
+    [Output('data-version', 'data'), Output('data-version-interval', 'interval')],
+    [Input('data-version-interval', 'n_intervals')],
+    [State('data-version', 'data')]
+)
+@metrics.timed_callback
+def check_data_version(n, shown_version):
+    data = data_snapshot.current()
+    if data is None or data.version == shown_version:
+        return no_update, no_update
+    return data.version, VERSION_POLL_INTERVAL
+
+
+# Refresh the dropdown options from a newly published data snapshot. A page
+# opened while loading gets its first selection and loses the notice here.
+@app.callback(
+    [Output('docker-dropdown', 'options'), Output('util-dropdown', 'options'),
+     Output('docker-dropdown', 'value'), Output('util-dropdown', 'value'), Output('loading-alert', 'is_open')],
+    [Input('data-version', 'data')],
+    [State('docker-dropdown', 'value'), State('util-dropdown', 'value')],
+    prevent_initial_call=True
+)
+@metrics.timed_callback
+def update_dropdown_options(version, docker_value, util_value):
+    data = data_snapshot.current()
+    return ([{'label': name, 'value': name} for name in data.docker_names],
+            [{'label': metric, 'value': metric} for metric in data.metrics],
+            docker_value or list(data.docker_names),
+            util_value or list(data.metrics),
+            False)
+
  
+# Cache key part for a graph's zoom, so every zoom window is re-queried once
+def zoom_key(relayout_data):
+    import resample
+    zoomed = resample.zoom_range(relayout_data)
+    return None if zoomed is None else (str(zoomed[0]), str(zoomed[1]))
+
+
+# Every callback reads one data snapshot once and builds its figure from that
+# version only, while the scheduler may publish the next one at any moment
 @app.callback(
     Output('UtilGraph', 'figure'),
-    [Input('util-dropdown', 'value')]
+    [Input('util-dropdown', 'value'), Input('history-range', 'value'), Input('UtilGraph', 'relayoutData'), Input('data-version', 'data')]
 )
-def update_util_chart(selected_metric):
-    if selected_metric is None:
-        selected_metric = utilization_df['Metric'].unique()[0]
+@metrics.timed_callback
+def update_util_chart(selected_metric, history_range, relayout_data, version):
+    data = data_snapshot.current()
+    if data is None or not data.metrics:
+        return no_update
+    if not selected_metric:
+        selected_metric = data.metrics[0]
     if isinstance(selected_metric, list):
         selected_metric = selected_metric[0]
-    filtered_df = utilization_df[utilization_df['Metric'] == selected_metric]
-    filtered_df = filtered_df.sort_values('Snapshot') # sort by Snapshot in ascending order
-    # Convert 'Snapshot' column to datetime and format it
-    filtered_df['Snapshot'] = pd.to_datetime(filtered_df['Snapshot'], format='%Y-%m-%d_%H-%M-%S')
-
-    Utilfig = px.line(filtered_df, x='Snapshot', y='Value', markers=True, template='plotly_dark')
-    Utilfig.update_layout(title=selected_metric, xaxis_title='Snapshot', yaxis_title=selected_metric, yaxis=dict(tickformat='.f'))
+    selection = (selected_metric, history_range, zoom_key(relayout_data))
+    return figure_cache.get('UtilGraph', selection, lambda: build_util_chart(data, selected_metric, history_range, relayout_data), data.version)
+
+def build_util_chart(data, selected_metric, history_range, relayout_data):
+    import resample, rollups
+    utilization_df = data.utilization_df
+
+    # Long ranges come from the rollups, only short ones need the raw rows
+    start, end = resample.visible_range(history_range, relayout_data, utilization_df['Snapshot'].max())
+    aggregated = resample.resample_rollups(lambda period, start, end: rollups.read_rollup('utilization', selected_metric, period, start, end),
+                                           'Snapshot', 'Value', start, end)
+    if aggregated is None:
+        filtered_df = utilization_df[utilization_df['Metric'] == selected_metric]
+        filtered_df = filtered_df.sort_values('Snapshot') # sort by Snapshot in ascending order
+
+        # Aggregate server-side when the visible range holds too many points
+        filtered_df, bucket = resample.resample(filtered_df, 'Snapshot', 'Value', start, end)
+    else:
+        filtered_df, bucket = aggregated
+    Utilfig = resample.line_figure(filtered_df, 'Snapshot', 'Value', bucket, title=selected_metric, xaxis_title='Snapshot', yaxis_title=selected_metric, yaxis=dict(tickformat='.f'))
     logging.info("Utilization chart updated")
     return Utilfig
 
 
 @app.callback(
     Output('line-chart', 'figure'),
-    [Input('docker-dropdown', 'value')]
+    [Input('docker-dropdown', 'value'), Input('history-range', 'value'), Input('line-chart', 'relayoutData'), Input('data-version', 'data')]
 )
-def update_line_chart(selected_docker_name):
+@metrics.timed_callback
+def update_line_chart(selected_docker_name, history_range, relayout_data, version):
+    data = data_snapshot.current()
+    if data is None:
+        return no_update
     if len(selected_docker_name) == 0:
         raise ValueError("No Docker Name selected")
     
     # Convert the selected_docker_name to a list
-    selected_docker_name = [selected_docker_name] if isinstance(selected_docker_name, str) else selected_docker_name
-    
-    # Filter the docker_df based on the selected Docker Name
-    filtered_df = docker_df[docker_df['Docker Name'].isin(selected_docker_name)]
-    
-    # Sort the filtered_df by 'Snapshot' in ascending order
-    filtered_df = filtered_df.sort_values('Snapshot')
+    selected_docker_name = [selected_docker_name] if isinstance(selected_docker_name, str) else list(selected_docker_name)
+    selection = (tuple(selected_docker_name), history_range, zoom_key(relayout_data))
+    return figure_cache.get('line-chart', selection, lambda: build_line_chart(data, selected_docker_name, history_range, relayout_data), data.version)
+
+def build_line_chart(data, selected_docker_name, history_range, relayout_data):
+    import pandas as pd
+    import resample, rollups
+    # Long ranges come from the rollups, only short ones need the raw rows
+    start, end = resample.visible_range(history_range, relayout_data, data.dockertotal_df['Snapshot Date'].max())
+    aggregated = resample.resample_rollups(lambda period, start, end: rollups.read_rollup('docker', selected_docker_name, period, start, end),
+                                           'Snapshot', 'Quantity', start, end)
+    if aggregated is not None:
+        filtered_df, bucket = aggregated
+    else:
+        # Look up the pre-sorted series of the selected Docker Name(s)
+        if len(selected_docker_name) == 1:
+            filtered_df = data.image_series.get(selected_docker_name[0])
+        else:
+            filtered_df = pd.concat([data.image_series.get(name) for name in selected_docker_name], ignore_index=True)
+            filtered_df = filtered_df.sort_values('Snapshot')
+
+        # Aggregate server-side when the visible range holds too many points
+        filtered_df, bucket = resample.resample(filtered_df, 'Snapshot', 'Quantity', start, end)
 
-    #Converrting Snapshot to date time
-    filtered_df['Snapshot'] = pd.to_datetime(filtered_df['Snapshot'], format='%Y-%m-%d_%H-%M-%S')
-    
     # Create the line graph using Plotly
-    fig = px.line(filtered_df, x='Snapshot', y='Quantity', markers=True, template='plotly_dark')
-    fig.update_layout(title='Docker Container Count', xaxis_title='Snapshot', yaxis_title='Quantity', yaxis=dict(tickformat='.0f'))
+    fig = resample.line_figure(filtered_df, 'Snapshot', 'Quantity', bucket, title='Docker Container Count', xaxis_title='Snapshot', yaxis_title='Quantity', yaxis=dict(tickformat='.0f'))
     logging.info("Line chart updated")
     return fig
 
-# Callback function to update the line chart
+# Callback function to update the total docker count chart
 @app.callback(
     Output('DockerTotalGraph', 'figure'),
-    [Input('interval', 'n_intervals')]
+    [Input('interval', 'n_intervals'), Input('history-range', 'value'), Input('DockerTotalGraph', 'relayoutData'), Input('data-version', 'data')]
 )
-def update_line_chart(n):
-    # Update the docker_df with new data (e.g., docker_df = generate_docker_dataframe())
-    # Replace this with your actual data update logic
-
-     # Convert the Snapshot Date column to a datetime object
-    dockertotal_df['Snapshot Date'] = pd.to_datetime(dockertotal_df['Snapshot Date'], format='%Y-%m-%d_%H-%M-%S')
+@metrics.timed_callback
+def update_total_chart(n, history_range, relayout_data, version):
+    # Only a new data snapshot makes the interval rebuild the figure
+    data = data_snapshot.current()
+    if data is None:
+        return no_update
+    selection = (history_range, zoom_key(relayout_data))
+    return figure_cache.get('DockerTotalGraph', selection, lambda: build_total_chart(data, history_range, relayout_data), data.version)
+
+def build_total_chart(data, history_range, relayout_data):
+    import resample, rollups
+    dockertotal_df = data.dockertotal_df
+
+    # Long ranges come from the rollups, otherwise aggregate the raw rows
+    # server-side when the visible range holds too many points
+    start, end = resample.visible_range(history_range, relayout_data, dockertotal_df['Snapshot Date'].max())
+    aggregated = resample.resample_rollups(lambda period, start, end: rollups.read_rollup('docker_total', rollups.TOTAL_KEY, period, start, end),
+                                           'Snapshot Date', 'Total Docker Count', start, end)
+    if aggregated is None:
+        total_df, bucket = resample.resample(dockertotal_df, 'Snapshot Date', 'Total Docker Count', start, end)
+    else:
+        total_df, bucket = aggregated
 
     # Create the line chart figure
-    fig = px.line(dockertotal_df, x='Snapshot Date', y='Total Docker Count', title='Total Docker Count Over Time', markers=True, template='plotly_dark')
-    fig.update_layout(title='Docker Container Count', xaxis_title='Snapshot', yaxis_title='Total Docker Count', yaxis=dict(tickformat='.0f'))
+    fig = resample.line_figure(total_df, 'Snapshot Date', 'Total Docker Count', bucket, title='Docker Container Count', xaxis_title='Snapshot', yaxis_title='Total Docker Count', yaxis=dict(tickformat='.0f'))
     
     return fig
 
+# Churn bucket per history range, so the bars stay readable
+CHURN_PERIODS = {'7d': 'daily', '30d': 'daily', '90d': 'weekly', '1y': 'weekly', 'all': 'monthly'}
+
+# Top images and image churn, both read from the rollups
+@app.callback(
+    Output('top-images', 'children'),
+    [Input('data-version', 'data')]
+)
+@metrics.timed_callback
+def update_top_images(version):
+    data = data_snapshot.current()
+    if data is None:
+        return no_update
+    return figure_cache.get('top-images', None, build_top_images, data.version)
+
+def build_top_images():
+    import rollups
+    top_df = rollups.read_top_images()
+    if top_df.empty:
+        return html.P("No rollups yet")
+    return dbc.Table.from_dataframe(top_df, striped=True, size='sm')
+
+@app.callback(
+    Output('ChurnGraph', 'figure'),
+    [Input('history-range', 'value'), Input('data-version', 'data')]
+)
+@metrics.timed_callback
+def update_churn_chart(history_range, version):
+    data = data_snapshot.current()
+    if data is None:
+        return no_update
+    return figure_cache.get('ChurnGraph', history_range, lambda: build_churn_chart(data, history_range), data.version)
+
+def build_churn_chart(data, history_range):
+    import plotly.graph_objects as go
+    import resample, rollups
+    start, _ = resample.visible_range(history_range, None, data.dockertotal_df['Snapshot Date'].max())
+    period = CHURN_PERIODS.get(history_range, 'monthly')
+    churn_df = rollups.read_churn(period, start)
+    fig = go.Figure([
+        go.Bar(x=churn_df['Bucket'], y=churn_df['Appeared'], name='Appeared'),
+        go.Bar(x=churn_df['Bucket'], y=-churn_df['Disappeared'], name='Disappeared'),
+    ])
+    fig.update_layout(title=f'Docker Image Churn ({period})', barmode='relative', template='plotly_dark',
+                      xaxis_title='Snapshot', yaxis_title='Images')
+    return fig
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
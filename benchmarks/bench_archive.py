@@ -0,0 +1,87 @@
+import argparse
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Benchmark the raw payload archive with hourly captures of a synthetic network.
+#
+#   python3 benchmarks/bench_archive.py --nodes 12000 --hours 48
+#
+# Archives the benchmark and apps.resources payloads of --nodes nodes every
+# hour, with a few percent of the nodes changing between hours, and reports
+# bytes on disk per day against the raw size, plus the time to read one
+# snapshot back and one node's records over every snapshot.
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fixtures
+
+
+def timed(report, label, func):
+    started = time.perf_counter()
+    result = func()
+    report.append(f"{label:<45} {(time.perf_counter() - started) * 1000:10.1f} ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the raw payload archive")
+    parser.add_argument('--nodes', type=int, default=12000)
+    parser.add_argument('--hours', type=int, default=24)
+    parser.add_argument('--churn', type=float, default=0.05)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        import payload_archive
+
+        rng = random.Random(0)
+        nodes = fixtures.make_nodes(args.nodes)
+        start = datetime.datetime(2024, 1, 1)
+        raw_bytes = 0
+        report = []
+        started = time.perf_counter()
+        for hour in range(args.hours):
+            # Locked resources move on a few nodes every hour
+            for node in rng.sample(nodes, int(len(nodes) * args.churn)):
+                node['locked']['appsRamLocked'] = rng.randint(0, 64000)
+            payloads = fixtures.network_payloads(nodes)
+            snapshot_date = (start + datetime.timedelta(hours=hour)).strftime('%Y-%m-%d_%H-%M-%S')
+            body = payloads['/fluxinfo?projection=apps.resources,ip']
+            payload_archive.archive_payload('resources', snapshot_date, body, 'ip')
+            raw_bytes += len(body)
+            if hour == 0:
+                body = payloads['/fluxinfo?projection=benchmark,ip']
+                payload_archive.archive_payload('benchmark', snapshot_date, body, 'ip')
+                raw_bytes += len(body)
+            else:
+                # The benchmark projection answered 304
+                payload_archive.archive_unchanged('benchmark', snapshot_date)
+        elapsed = time.perf_counter() - started
+        archive_bytes = sum(os.path.getsize(os.path.join(payload_archive.ARCHIVE_DIR, file))
+                            for file in os.listdir(payload_archive.ARCHIVE_DIR))
+        print(f"{args.nodes} nodes, {args.hours} hourly snapshots, {elapsed / args.hours * 1000:.1f} ms per snapshot to archive")
+        print(f"raw      {raw_bytes / 1024 / 1024:10.1f} MiB")
+        print(f"archive  {archive_bytes / 1024 / 1024:10.1f} MiB  ({raw_bytes / archive_bytes:.1f}x smaller, "
+              f"{archive_bytes / args.hours * 24 / 1024 / 1024:.1f} MiB per day)")
+
+        reader = payload_archive.ArchiveReader('resources')
+        middle = reader.snapshots()[args.hours // 2]
+        payload = timed(report, "read_snapshot(middle)", lambda: reader.read_snapshot(middle))
+        node = nodes[len(nodes) // 2]['ip']
+        history = timed(report, "read_node(one node) over every snapshot", lambda: reader.read_node(node))
+        benchmark = payload_archive.ArchiveReader('benchmark')
+        timed(report, "benchmark read_snapshot(last, deduplicated)", lambda: benchmark.read_snapshot(benchmark.snapshots()[-1]))
+        print("\n".join(report))
+        print(f"{len(payload['data'])} records in the snapshot, {len(history)} snapshots of {node}")
+        assert len(payload['data']) == args.nodes and len(history) == args.hours
+        reader.close()
+        benchmark.close()
+
+
+if __name__ == "__main__":
+    main()
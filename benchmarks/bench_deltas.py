@@ -0,0 +1,95 @@
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Compare the docker_count_*.json files with the delta-encoded store.
+#
+#   python3 benchmarks/bench_deltas.py --snapshots 2000 --images 3000 --churn 0.02
+#
+# Generates snapshots where only --churn of the image counts move between
+# two runs, imports them with docker_deltas.import_json_files() and reports
+# bytes on disk plus the time to read everything, one snapshot and one
+# image series from either format.
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def generate_counts(data_dir, snapshots, image_count, churn, seed=0):
+    rng = random.Random(seed)
+    images = {f'example{i % 97}/image-{i}:latest': rng.randint(1, 5000) for i in range(image_count)}
+    next_image = image_count
+    start = datetime.datetime(2024, 1, 1)
+    for i in range(snapshots):
+        for image in rng.sample(sorted(images), int(len(images) * churn)):
+            images[image] = max(1, images[image] + rng.randint(-20, 20))
+        # A few images come and go
+        for image in rng.sample(sorted(images), 2):
+            del images[image]
+        for _ in range(2):
+            images[f'example{next_image % 97}/image-{next_image}:latest'] = rng.randint(1, 50)
+            next_image += 1
+        snapshot_date = (start + datetime.timedelta(hours=i)).strftime('%Y-%m-%d_%H-%M-%S')
+        with open(os.path.join(data_dir, f'docker_count_{snapshot_date}.json'), 'w') as f:
+            json.dump({"Snapshot": snapshot_date, "Total Docker Count": sum(images.values()),
+                       "ImageCounts": images}, f, indent=4)
+    return snapshot_date
+
+
+def disk_usage(paths):
+    return sum(os.path.getsize(path) for path in paths)
+
+
+def timed(report, label, func):
+    started = time.perf_counter()
+    result = func()
+    report.append(f"{label:<40} {(time.perf_counter() - started) * 1000:10.1f} ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the delta-encoded docker counts")
+    parser.add_argument('--snapshots', type=int, default=1000)
+    parser.add_argument('--images', type=int, default=3000)
+    parser.add_argument('--churn', type=float, default=0.02)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        os.makedirs('data')
+        last_snapshot = generate_counts('data', args.snapshots, args.images, args.churn)
+        json_files = sorted(os.path.join('data', name) for name in os.listdir('data'))
+        middle = json.load(open(json_files[len(json_files) // 2]))
+
+        import docker_deltas
+        report = []
+        timed(report, "import_json_files", docker_deltas.import_json_files)
+        print(f"{args.snapshots} snapshots, {args.images} images, {args.churn:.0%} of the counts change per run")
+        json_bytes = disk_usage(json_files)
+        delta_bytes = disk_usage(docker_deltas.segments())
+        print(f"docker_count_*.json {json_bytes / 1024 / 1024:10.1f} MiB")
+        print(f"docker_deltas       {delta_bytes / 1024 / 1024:10.1f} MiB  ({json_bytes / delta_bytes:.1f}x smaller)")
+
+        def read_json_files():
+            for file in json_files:
+                with open(file) as f:
+                    json.load(f)
+
+        timed(report, "read every docker_count_*.json", read_json_files)
+        timed(report, "docker_deltas.read_docker_counts()", docker_deltas.read_docker_counts)
+        timed(report, "docker_deltas.read_docker_totals()", docker_deltas.read_docker_totals)
+        total, image_counts = timed(report, "docker_deltas.read_snapshot(middle)",
+                                    lambda: docker_deltas.read_snapshot(middle["Snapshot"]))
+        assert image_counts == middle["ImageCounts"] and total == middle["Total Docker Count"]
+        name = next(iter(middle["ImageCounts"]))
+        series = timed(report, "docker_deltas.read_image_series(name)", lambda: docker_deltas.read_image_series(name))
+        print("\n".join(report))
+        print(f"latest snapshot {docker_deltas.latest_snapshot()} (expected {last_snapshot}), {len(series)} points for {name}")
+
+
+if __name__ == "__main__":
+    main()
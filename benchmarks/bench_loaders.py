@@ -0,0 +1,99 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Benchmark the dataframe loaders against N synthetic snapshot files.
+#
+#   python3 benchmarks/bench_loaders.py --snapshots 1000 --images 2000
+#
+# Reports load time and peak traced memory for a cold load (no snapshot
+# index yet), a warm load (index on disk, fresh process state) and an
+# incremental reload after one new snapshot arrives.
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+UTILIZATION_METRICS = [
+    'totalbenchmarkcores', 'totalbenchmarkram', 'totalbenchmarkssd', 'totalutilcores', 'totalutilram',
+    'totalutilssd', 'notutilizednodes', 'totalnodes', 'utilization_percentage_cores',
+    'utilization_percentage_ram', 'utilization_percentage_ssd', 'utilization_nodes', 'total_cumulus',
+    'total_nimbus', 'total_stratus', 'unique_wallet_count',
+]
+
+
+def write_snapshot(data_dir, snapshot_datetime, images, rng):
+    snapshot_date = snapshot_datetime.strftime('%Y-%m-%d_%H-%M-%S')
+    image_counts = {image: rng.randint(1, 5000) for image in images if rng.random() < 0.9}
+    with open(os.path.join(data_dir, f'docker_count_{snapshot_date}.json'), 'w') as f:
+        json.dump({"Snapshot": snapshot_date, "Total Docker Count": sum(image_counts.values()),
+                   "ImageCounts": image_counts}, f, indent=4)
+    utilization = {"Snapshot": snapshot_date}
+    utilization.update({metric: rng.random() * 100000 for metric in UTILIZATION_METRICS})
+    with open(os.path.join(data_dir, f'utilization_{snapshot_date}.json'), 'w') as f:
+        json.dump(utilization, f, indent=4)
+
+
+def generate_history(data_dir, snapshots, image_count, seed=0, start=datetime.datetime(2024, 1, 1)):
+    rng = random.Random(seed)
+    images = [f'example{i % 97}/image-{i}:latest' for i in range(image_count)]
+    for i in range(snapshots):
+        write_snapshot(data_dir, start + datetime.timedelta(hours=i), images, rng)
+    return images, start + datetime.timedelta(hours=snapshots)
+
+
+def measure(report, label, func):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    report.append(f"{label:<45} {elapsed * 1000:10.1f} ms {peak / 1024 / 1024:10.1f} MiB peak")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the snapshot dataframe loaders")
+    parser.add_argument('--snapshots', type=int, default=500)
+    parser.add_argument('--images', type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        os.makedirs('data')
+        images, next_snapshot = generate_history('data', args.snapshots, args.images)
+        print(f"{args.snapshots} snapshots, {args.images} images per docker snapshot")
+
+        import dataframes
+        from snapshot_index import SnapshotIndex
+
+        # stdout from the loaders would swamp the report
+        report = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            docker_df = measure(report, "cold generate_docker_dataframe", dataframes.generate_docker_dataframe)
+            dockertotal_df = measure(report, "cold generate_dockertotal_dataframe", dataframes.generate_dockertotal_dataframe)
+            utilization_df = measure(report, "cold generate_utilization_dataframe", dataframes.generate_utilization_dataframe)
+
+            dataframes.snapshot_index = SnapshotIndex()
+            measure(report, "warm generate_docker_dataframe", dataframes.generate_docker_dataframe)
+            measure(report, "warm generate_dockertotal_dataframe", dataframes.generate_dockertotal_dataframe)
+            measure(report, "warm generate_utilization_dataframe", dataframes.generate_utilization_dataframe)
+
+            write_snapshot('data', next_snapshot, images, random.Random(1))
+            measure(report, "incremental generate_docker_dataframe", lambda: dataframes.generate_docker_dataframe(docker_df))
+            measure(report, "incremental generate_dockertotal_dataframe", lambda: dataframes.generate_dockertotal_dataframe(dockertotal_df))
+            measure(report, "incremental generate_utilization_dataframe", lambda: dataframes.generate_utilization_dataframe(utilization_df))
+
+        print("\n".join(report))
+        print(f"docker_df: {len(docker_df)} rows, {docker_df.memory_usage(deep=True).sum() / 1024 / 1024:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+# Benchmark how fast a freshly started dashboard becomes usable.
+#
+#   python3 benchmarks/bench_startup.py --snapshots 2000 --images 1000
+#
+# Starts app.py against N synthetic hourly snapshots ending now (so no
+# collection is due) and reports the time until the server answers /,
+# until /ready reports the first data snapshot and until the whole
+# history is loaded.
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_loaders import generate_history
+
+
+def get(url):
+    try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+    except OSError:
+        return None, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard startup")
+    parser.add_argument('--snapshots', type=int, default=1000)
+    parser.add_argument('--images', type=int, default=1000)
+    parser.add_argument('--timeout', type=float, default=600)
+    args = parser.parse_args()
+
+    # app.py always serves on port 8049
+    url = 'http://127.0.0.1:8049'
+    with tempfile.TemporaryDirectory() as workdir:
+        os.makedirs(os.path.join(workdir, 'data'))
+        start = datetime.datetime.now() - datetime.timedelta(hours=args.snapshots)
+        generate_history(os.path.join(workdir, 'data'), args.snapshots, args.images, start=start)
+        print(f"{args.snapshots} snapshots, {args.images} images per docker snapshot")
+
+        server = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, 'app.py')], cwd=workdir,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        started = time.perf_counter()
+        timings = {}
+        try:
+            while len(timings) < 3 and time.perf_counter() - started < args.timeout:
+                elapsed = time.perf_counter() - started
+                if 'serving' not in timings:
+                    if get(url + '/')[0] == 200:
+                        timings['serving'] = elapsed
+                else:
+                    status, body = get(url + '/ready')
+                    if status == 200:
+                        timings.setdefault('ready', elapsed)
+                        if json.loads(body)['history_complete']:
+                            timings['complete'] = elapsed
+                time.sleep(0.05)
+        finally:
+            server.terminate()
+            server.wait()
+
+    for label, key in (("serving /", 'serving'), ("first data snapshot (/ready)", 'ready'), ("whole history loaded", 'complete')):
+        value = f"{timings[key]:8.2f} s" if key in timings else "  not reached"
+        print(f"{label:<30} {value}")
+
+
+if __name__ == "__main__":
+    main()
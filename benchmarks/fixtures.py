@@ -0,0 +1,112 @@
+import json
+import random
+
+# Synthetic Flux network payloads shaped like the endpoints the collectors
+# read: the benchmark, apps.resources and apps.runningapps.Image projections
+# of fluxinfo, getzelnodecount and viewdeterministiczelnodelist.
+#
+#   nodes = make_nodes(12000, images_per_node=3, tiers={'cumulus': 0.6, 'nimbus': 0.25, 'stratus': 0.15})
+#   payloads = network_payloads(nodes)
+
+# Benchmarked cores, ram (GB) and ssd (GB) of a node per tier
+TIER_RESOURCES = {
+    'cumulus': (2, 8, 220),
+    'nimbus': (4, 32, 440),
+    'stratus': (8, 64, 880),
+}
+DEFAULT_TIERS = {'cumulus': 0.6, 'nimbus': 0.25, 'stratus': 0.15}
+
+# Part of the nodes that run no apps at all
+IDLE_NODES = 0.2
+
+
+# Parse 'cumulus=0.6,nimbus=0.25,stratus=0.15' into a tier weight map
+def parse_tiers(text):
+    tiers = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in TIER_RESOURCES:
+            raise ValueError(f"Unknown tier {name.strip()!r}, expected one of {', '.join(TIER_RESOURCES)}")
+        tiers[name.strip()] = float(weight)
+    return tiers
+
+
+def make_nodes(node_count, images_per_node=3, tiers=DEFAULT_TIERS, image_pool=2000, wallets=None, seed=0):
+    rng = random.Random(seed)
+    names = list(tiers)
+    weights = [tiers[name] for name in names]
+    # Popular images run on many nodes, most on a few
+    images = [f'example{i % 97}/image-{i}:latest' for i in range(image_pool)]
+    image_weights = [1 / (rank + 1) for rank in range(image_pool)]
+    # Operators run several nodes on the same payment address
+    wallets = wallets or max(1, node_count // 3)
+    nodes = []
+    for i in range(node_count):
+        tier = rng.choices(names, weights)[0]
+        cores, ram, ssd = TIER_RESOURCES[tier]
+        idle = rng.random() < IDLE_NODES
+        running = [] if idle else rng.choices(images, image_weights, k=rng.randint(1, 2 * images_per_node - 1))
+        if rng.random() < 0.3:
+            running.append('containrrr/watchtower:latest')
+        nodes.append({
+            'ip': f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}:16127',
+            'tier': tier,
+            'bench': {'cores': cores, 'ram': ram * 1.0, 'ssd': ssd * 1.0},
+            'locked': {
+                'appsCpusLocked': 0 if idle else round(rng.uniform(0.1, cores), 2),
+                'appsRamLocked': 0 if idle else rng.randint(100, ram * 1000),
+                'appsHddLocked': 0 if idle else rng.randint(1, ssd // 2),
+            },
+            'images': running,
+            'payment_address': f't1wallet{rng.randrange(wallets):08d}',
+        })
+    return nodes
+
+
+def benchmark_payload(nodes):
+    return {'status': 'success', 'data': [
+        {'ip': node['ip'], 'benchmark': {'bench': dict(node['bench'], eps=node_eps(node), thunder=False)}}
+        for node in nodes]}
+
+
+# Some noise the collectors skip, so the payload is not all wanted leaves
+def node_eps(node):
+    return sum(map(ord, node['ip'])) % 500 + 100.5
+
+
+def resources_payload(nodes):
+    return {'status': 'success', 'data': [
+        {'ip': node['ip'], 'apps': {'resources': dict(node['locked'])}} for node in nodes]}
+
+
+def images_payload(nodes):
+    return {'status': 'success', 'data': [
+        {'ip': node['ip'], 'apps': {'runningapps': [{'Image': image} for image in node['images']]}}
+        for node in nodes]}
+
+
+def node_count_payload(nodes):
+    tiers = {name: sum(node['tier'] == name for node in nodes) for name in TIER_RESOURCES}
+    return {'status': 'success', 'data': {
+        'total': len(nodes), 'stable': len(nodes),
+        'cumulus-enabled': tiers['cumulus'], 'nimbus-enabled': tiers['nimbus'], 'stratus-enabled': tiers['stratus'],
+    }}
+
+
+def node_list_payload(nodes):
+    return {'status': 'success', 'data': [
+        {'collateral': f'COutPoint({i:064x}, 0)', 'txhash': f'{i:064x}', 'outidx': '0', 'ip': node['ip'],
+         'tier': node['tier'].upper(), 'payment_address': node['payment_address'], 'activesince': '1700000000'}
+        for i, node in enumerate(nodes)]}
+
+
+# Path (with query) -> encoded body, matching the collector URLs
+def network_payloads(nodes):
+    payloads = {
+        '/fluxinfo?projection=benchmark,ip': benchmark_payload(nodes),
+        '/fluxinfo?projection=apps.resources,ip': resources_payload(nodes),
+        '/fluxinfo?projection=apps.runningapps.Image,ip': images_payload(nodes),
+        '/daemon/getzelnodecount': node_count_payload(nodes),
+        '/daemon/viewdeterministiczelnodelist': node_list_payload(nodes),
+    }
+    return {path: json.dumps(payload).encode() for path, payload in payloads.items()}
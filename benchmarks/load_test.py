@@ -0,0 +1,90 @@
+import argparse
+import asyncio
+import statistics
+import time
+
+import aiohttp
+
+# Load test a running dashboard server with concurrent clients.
+#
+#   python3 benchmarks/load_test.py --url http://localhost:8049 --clients 32 --requests 2000
+#
+# Each client loops over what a browser requests when it opens the page:
+# the index, the layout, the callback graph and one UtilGraph callback.
+# Reports requests/s and latency percentiles per request kind.
+
+UTIL_CALLBACK = {
+    'output': 'UtilGraph.figure',
+    'outputs': {'id': 'UtilGraph', 'property': 'figure'},
+    'inputs': [
+        {'id': 'util-dropdown', 'property': 'value', 'value': 'utilization_percentage_cores'},
+        {'id': 'history-range', 'property': 'value', 'value': '30d'},
+        {'id': 'UtilGraph', 'property': 'relayoutData', 'value': None},
+        {'id': 'data-version', 'property': 'data', 'value': None},
+    ],
+    'changedPropIds': ['util-dropdown.value'],
+}
+
+REQUESTS = [
+    ('index', 'GET', '/', None),
+    ('layout', 'GET', '/_dash-layout', None),
+    ('dependencies', 'GET', '/_dash-dependencies', None),
+    ('util callback', 'POST', '/_dash-update-component', UTIL_CALLBACK),
+]
+
+
+async def client(session, url, remaining, latencies, errors):
+    while remaining:
+        remaining.pop()
+        for name, method, path, payload in REQUESTS:
+            started = time.perf_counter()
+            try:
+                async with session.request(method, url + path, json=payload) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors[name] = errors.get(name, 0) + 1
+                        continue
+            except aiohttp.ClientError:
+                errors[name] = errors.get(name, 0) + 1
+                continue
+            latencies.setdefault(name, []).append(time.perf_counter() - started)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def run(url, clients, requests):
+    # requests counts page loads, each of them is len(REQUESTS) HTTP requests
+    remaining = list(range(requests))
+    latencies, errors = {}, {}
+    connector = aiohttp.TCPConnector(limit=clients)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(client(session, url, remaining, latencies, errors) for _ in range(clients)))
+        elapsed = time.perf_counter() - started
+
+    total = sum(len(values) for values in latencies.values())
+    print(f"{clients} clients, {requests} page loads, {total} requests in {elapsed:.1f} s: {total / elapsed:.1f} req/s")
+    for name, _, _, _ in REQUESTS:
+        values = latencies.get(name, [])
+        if not values:
+            print(f"{name:<15} no successful requests, {errors.get(name, 0)} errors")
+            continue
+        print(f"{name:<15} p50 {percentile(values, 0.5) * 1000:8.1f} ms  p95 {percentile(values, 0.95) * 1000:8.1f} ms  "
+              f"p99 {percentile(values, 0.99) * 1000:8.1f} ms  mean {statistics.mean(values) * 1000:8.1f} ms  "
+              f"errors {errors.get(name, 0)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a running dashboard server")
+    parser.add_argument('--url', default='http://localhost:8049')
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(run(args.url.rstrip('/'), args.clients, args.requests))
+
+
+if __name__ == "__main__":
+    main()
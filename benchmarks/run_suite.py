@@ -0,0 +1,254 @@
+import argparse
+import asyncio
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Benchmark suite against a synthetic Flux network and synthetic histories.
+#
+#   python3 benchmarks/run_suite.py --nodes 12000 --images-per-node 3 --histories 100,1000
+#   python3 benchmarks/run_suite.py --compare benchmarks/results/abc1234.json benchmarks/results/def5678.json
+#
+# Serves fixtures.py payloads from a local stub server and measures:
+#   collect/utilization, collect/docker        apidata.py and count_docker.py end to end,
+#                                              cold and with the response cache revalidating
+#   load/<n>/cold, load/<n>/warm               data_snapshot.build_snapshot() over n snapshots,
+#                                              without and with the snapshot index on disk
+#   rollups/<n>/build                          rollups.build() over the same history
+#   render/<n>/<callback>/<range>              the figure behind every dash callback
+# Every entry has the median and min seconds over --repeat runs and the peak
+# traced memory of one extra run. Results go to benchmarks/results/<commit>.json.
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fixtures
+from stub_server import StubServer
+from bench_loaders import generate_history
+
+RESULTS_DIR = os.path.join(REPO_DIR, 'benchmarks', 'results')
+
+# Callback figures and the history ranges they are rendered for
+RENDER_RANGES = ['7d', '30d', 'all']
+
+# Slower than this ratio is flagged by --compare
+REGRESSION = 1.1
+
+
+def summarize(samples, peak):
+    return {
+        'seconds': statistics.median(samples),
+        'min_seconds': min(samples),
+        'runs': len(samples),
+        'peak_mib': round(peak / 1024 / 1024, 3),
+    }
+
+
+# Time func repeat times, then once more under tracemalloc for the peak, so
+# the tracing overhead stays out of the timings
+def measure(func, repeat, setup=None):
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    if setup:
+        setup()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return summarize(samples, peak)
+
+
+async def measure_async(func, repeat, setup=None):
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        await func()
+        samples.append(time.perf_counter() - started)
+    if setup:
+        setup()
+    tracemalloc.start()
+    await func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return summarize(samples, peak)
+
+
+async def bench_collection(nodes, repeat, results):
+    import apidata
+    import count_docker
+    from fluxapi import create_session
+
+    payloads = fixtures.network_payloads(nodes)
+    results['payload_bytes'] = {path: len(body) for path, body in payloads.items()}
+    async with StubServer(payloads) as server:
+        apidata.benchurl = server.url + '/fluxinfo?projection=benchmark,ip'
+        apidata.utilurl = server.url + '/fluxinfo?projection=apps.resources,ip'
+        apidata.totalnodeurl = server.url + '/daemon/getzelnodecount'
+        apidata.walleturl = server.url + '/daemon/viewdeterministiczelnodelist'
+        count_docker.url = server.url + '/fluxinfo?projection=apps.runningapps.Image,ip'
+        # Always revalidate, so the cached runs measure the 304 path
+        apidata.BENCH_CACHE_TTL = apidata.WALLET_CACHE_TTL = 0
+
+        async with create_session() as session:
+            # The collectors print every snapshot, keep that out of the report
+            with contextlib.redirect_stdout(io.StringIO()):
+                results['collect/utilization/cold'] = await measure_async(
+                    lambda: apidata.collect_utilization(session), repeat, apidata.response_cache.entries.clear)
+                results['collect/utilization/revalidated'] = await measure_async(
+                    lambda: apidata.collect_utilization(session), repeat)
+                results['collect/docker'] = await measure_async(
+                    lambda: count_docker.get_running_apps(session), repeat)
+
+
+def bench_history(snapshots, image_count, repeat, results):
+    import dataframes
+    import data_snapshot
+    import rollups
+    from snapshot_index import SnapshotIndex
+
+    os.makedirs('data')
+    generate_history('data', snapshots, image_count, start=datetime.datetime.now() - datetime.timedelta(hours=snapshots))
+
+    def drop_index():
+        if os.path.exists(dataframes.snapshot_index.path):
+            os.remove(dataframes.snapshot_index.path)
+        shutil.rmtree(dataframes.snapshot_index.rows_dir, ignore_errors=True)
+        dataframes.snapshot_index = SnapshotIndex()
+
+    def reset_index():
+        dataframes.snapshot_index = SnapshotIndex()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        results[f'load/{snapshots}/cold'] = measure(data_snapshot.build_snapshot, repeat, drop_index)
+        results[f'load/{snapshots}/warm'] = measure(data_snapshot.build_snapshot, repeat, reset_index)
+        snapshot = data_snapshot.build_snapshot()
+        results[f'rollups/{snapshots}/build'] = measure(
+            lambda: rollups.build(snapshot.docker_df, snapshot.dockertotal_df, snapshot.utilization_df), repeat)
+
+        # Imported here, app.py logs to the working directory
+        import app
+        app.publish_data(snapshot)
+        metric = snapshot.metrics[0]
+        image = list(snapshot.docker_names)[0]
+        renders = {
+            'update_util_chart': lambda history_range: app.build_util_chart(snapshot, metric, history_range, None),
+            'update_line_chart': lambda history_range: app.build_line_chart(snapshot, [image], history_range, None),
+            'update_total_chart': lambda history_range: app.build_total_chart(snapshot, history_range, None),
+            'update_churn_chart': lambda history_range: app.build_churn_chart(snapshot, history_range),
+        }
+        for callback, render in renders.items():
+            for history_range in RENDER_RANGES:
+                results[f'render/{snapshots}/{callback}/{history_range}'] = measure(lambda: render(history_range), repeat)
+        results[f'render/{snapshots}/update_top_images'] = measure(app.build_top_images, repeat)
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+    return commit, bool(dirty)
+
+
+def run(args):
+    commit, dirty = git_commit()
+    report = {
+        'commit': commit,
+        'dirty': dirty,
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': {
+            'nodes': args.nodes, 'images_per_node': args.images_per_node, 'tiers': args.tiers,
+            'histories': args.histories, 'images': args.images, 'repeat': args.repeat,
+        },
+        'results': {},
+    }
+    results = report['results']
+    # The timings go to the report, not to a metrics.log in the temp dirs
+    os.environ['FLUXUTILMON_METRICS_LOG'] = ''
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        nodes = fixtures.make_nodes(args.nodes, args.images_per_node, fixtures.parse_tiers(args.tiers))
+        asyncio.run(bench_collection(nodes, args.repeat, results))
+        for snapshots in args.histories:
+            history_dir = os.path.join(workdir, f'history-{snapshots}')
+            os.makedirs(history_dir)
+            os.chdir(history_dir)
+            bench_history(snapshots, args.images, args.repeat, results)
+        os.chdir(REPO_DIR)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit}{'-dirty' if dirty else ''}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for name, result in results.items():
+        if 'seconds' in result:
+            print(f"{name:<50} {result['seconds'] * 1000:10.1f} ms {result['peak_mib']:10.1f} MiB peak")
+    print(f"Results written to {output}")
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    if old['params'] != new['params']:
+        print(f"Warning: different parameters, {old['params']} vs {new['params']}")
+    print(f"{'':<50} {old['commit']:>12} {new['commit']:>12}")
+    regressions = 0
+    for name, result in new['results'].items():
+        if 'seconds' not in result or name not in old['results']:
+            continue
+        before, after = old['results'][name]['seconds'], result['seconds']
+        ratio = after / before if before else float('inf')
+        flag = '  slower' if ratio > REGRESSION else ''
+        regressions += ratio > REGRESSION
+        print(f"{name:<50} {before * 1000:10.1f} ms {after * 1000:10.1f} ms {ratio:6.2f}x{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the collectors, loaders and callbacks")
+    parser.add_argument('--nodes', type=int, default=12000)
+    parser.add_argument('--images-per-node', type=int, default=3)
+    parser.add_argument('--tiers', default='cumulus=0.6,nimbus=0.25,stratus=0.15')
+    parser.add_argument('--histories', default='100,1000', help="comma separated snapshot counts")
+    parser.add_argument('--images', type=int, default=1000, help="images per synthetic docker snapshot")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help="results file, benchmarks/results/<commit>.json by default")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="compare two results files")
+    args = parser.parse_args()
+
+    if args.compare:
+        # Non-zero exit status when something got slower, for CI
+        sys.exit(1 if compare(*args.compare) else 0)
+    args.histories = [int(count) for count in args.histories.split(',')]
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import hashlib
+
+from aiohttp import web
+
+# Local stand-in for stats.runonflux.io and api.runonflux.io serving fixed
+# payloads (see fixtures.py), with ETags so conditional requests get a 304
+# like they would from the real servers.
+#
+#   async with StubServer(payloads) as server:
+#       apidata.benchurl = server.url + '/fluxinfo?projection=benchmark,ip'
+#
+# handlers maps a path to an aiohttp handler answering it instead, e.g. one
+# that fails a few times or answers slowly, for the tests in tests/.
+
+
+class StubServer:
+    def __init__(self, payloads=None, handlers=None, host='127.0.0.1', port=0):
+        self.payloads = payloads or {}
+        self.handlers = handlers or {}
+        self.etags = {path: '"' + hashlib.sha1(body).hexdigest() + '"' for path, body in self.payloads.items()}
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self.not_modified = 0
+        # Requests per path
+        self.hits = {}
+        self.runner = None
+        self.url = None
+
+    async def handle(self, request):
+        self.requests += 1
+        path = request.path_qs
+        self.hits[path] = self.hits.get(path, 0) + 1
+        if path in self.handlers:
+            return await self.handlers[path](request)
+        if path not in self.payloads:
+            return web.Response(status=404)
+        etag = self.etags[path]
+        if request.headers.get('If-None-Match') == etag:
+            self.not_modified += 1
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(body=self.payloads[path], content_type='application/json', headers={'ETag': etag})
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_route('GET', '/{tail:.*}', self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.url = f'http://{self.host}:{port}'
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.runner.cleanup()
@@ -0,0 +1,45 @@
+import os
+import fcntl
+import logging
+
+LOCK_FILE = os.path.join('data', 'collector.lock')
+
+
+# Exclusive, non-blocking file lock electing the one process that collects
+# snapshots when several workers serve the dashboard. The lock is held for
+# as long as the process lives and the kernel drops it when the process
+# exits, so another worker takes over on its next try.
+class CollectorLock:
+    def __init__(self, path=LOCK_FILE):
+        self.path = path
+        self.file = None
+
+    @property
+    def held(self):
+        return self.file is not None
+
+    # True when this process is (or just became) the collector
+    def acquire(self):
+        if self.file is not None:
+            return True
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        lock_file = open(self.path, 'a+')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(str(os.getpid()))
+        lock_file.flush()
+        self.file = lock_file
+        print(f"Process {os.getpid()} elected as the snapshot collector")
+        logging.info(f"Process {os.getpid()} elected as the snapshot collector")
+        return True
+
+    def release(self):
+        if self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
@@ -1,50 +1,102 @@
-import requests
+import aiohttp
+import asyncio
 import json
 import os
+import sys
+import tempfile
 from datetime import datetime
+import history_store
+import docker_deltas
+import rollups
+import ijson
+import metrics
+import aggregate
+from fluxapi import create_session, fetch_columns, FluxApiError
 
-def get_running_apps():
-    url = "https://stats.runonflux.io/fluxinfo?projection=apps.runningapps.Image"
+url = "https://stats.runonflux.io/fluxinfo?projection=apps.runningapps.Image,ip"
+
+# Set FLUXUTILMON_ARCHIVE=1 (or run count_docker.py --archive) to keep the
+# raw payloads in data/archive/, see payload_archive.py
+ARCHIVE = os.environ.get('FLUXUTILMON_ARCHIVE') == '1'
+
+# Runs next to the apps on many nodes, not an app itself
+IGNORED_IMAGES = ["containrrr/watchtower:latest", "containrrr/watchtower"]
+
+# Take a docker image count snapshot using the shared session from fluxapi.create_session()
+async def get_running_apps(session, archive=None):
+    if archive is None:
+        archive = ARCHIVE
+    # The raw body for the archive is spooled to a temporary file as it streams in
+    raw = tempfile.TemporaryFile() if archive else None
     try:
-        response = requests.get(url)
-        response.raise_for_status()  # Raise an exception if the request was unsuccessful
-        data = response.json()
-        dataset = data['data']
-
-        image_counts = {}
-        total_count = 0
-        for item in dataset:
-            if "apps" in item and "runningapps" in item["apps"]:
-                for app in item["apps"]["runningapps"]:
-                    image = app["Image"]
-                    if image not in ["containrrr/watchtower:latest", "containrrr/watchtower"]:
-                        if image in image_counts:
-                            image_counts[image] += 1
-                        else:
-                            image_counts[image] = 1
-                        total_count += 1
+        # Only the image names are kept from the streamed payload, one list per node
+        # Raises once the retries are used up
+        data = await fetch_columns(session, url, {'images': 'apps.runningapps.item.Image'}, raw=raw)
+
+        with metrics.timed('aggregate', collector='docker'):
+            image_counts, total_count = aggregate.histogram(data['images'], exclude=IGNORED_IMAGES)
 
         if total_count > 0:
             current_time = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-            file_name = f'data/docker_count_{current_time}.json'
-            os.makedirs(os.path.dirname(file_name), exist_ok=True)
-            existing_data = {}
-
-            if os.path.exists(file_name):
-                with open(file_name, 'r') as f:
-                    existing_data = json.load(f)
-            existing_data["Snapshot"] = current_time
-            existing_data["Total Docker Count"] = total_count
-            existing_data["ImageCounts"] = image_counts
-            with open(file_name, 'w') as f:
-                json.dump(existing_data, f, indent=4)
-
-            print(f'Data written to {file_name}')
+
+            # Once the delta store has been created (python3 docker_deltas.py)
+            # only the changed counts are written, no docker_count file
+            with metrics.timed('write', collector='docker', target='snapshot'):
+                if docker_deltas.exists():
+                    docker_deltas.append(current_time, total_count, image_counts)
+                    print(f'Data appended to {docker_deltas.DELTA_DIR}')
+                    existing_data = {"Snapshot": current_time, "Total Docker Count": total_count, "ImageCounts": image_counts}
+                else:
+                    file_name = f'data/docker_count_{current_time}.json'
+                    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+                    existing_data = {}
+
+                    if os.path.exists(file_name):
+                        with open(file_name, 'r') as f:
+                            existing_data = json.load(f)
+                    existing_data["Snapshot"] = current_time
+                    existing_data["Total Docker Count"] = total_count
+                    existing_data["ImageCounts"] = image_counts
+                    with open(file_name, 'w') as f:
+                        json.dump(existing_data, f, indent=4)
+
+                    print(f'Data written to {file_name}')
+
+            # Keep the history store in step once it has been created (python3 history_store.py)
+            if history_store.exists():
+                with metrics.timed('write', collector='docker', target='history_store'):
+                    history_store.append_docker_count(current_time, total_count, image_counts)
+                print(f'Data appended to {history_store.STORE_FILE}')
+
+            # Same for the rollups once they have been built (python3 rollups.py)
+            if rollups.exists():
+                with metrics.timed('write', collector='docker', target='rollups'):
+                    rollups.update_docker_count(current_time, total_count, image_counts)
+                print(f'Data rolled up in {rollups.ROLLUP_FILE}')
+
+            if archive:
+                # Imported on first use, zstandard is only needed for the archive
+                import payload_archive
+                with metrics.timed('write', collector='docker', target='archive'):
+                    payload_archive.archive_downloads(current_time, [('runningapps', raw, 'ip')])
+                print(f'Raw payload archived in {payload_archive.ARCHIVE_DIR}')
+
             print(f"Total running apps: {total_count}")
             for i, (image, count) in enumerate(sorted(image_counts.items(), key=lambda x: x[1], reverse=True), start=1):
                 print(f"{i}. {image}: {count}")
+            return existing_data
 
-    except requests.exceptions.RequestException as e:
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, ijson.JSONError, FluxApiError) as e:
         print(f"An error occurred while making the request: {str(e)}")
-        
-get_running_apps()
\ No newline at end of file
+    finally:
+        if raw is not None:
+            raw.close()
+
+
+async def main():
+    async with create_session() as session:
+        await get_running_apps(session, archive=ARCHIVE or '--archive' in sys.argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,104 @@
+import logging
+import threading
+import datetime
+import itertools
+from dataclasses import dataclass
+from typing import Any, Tuple
+
+
+# One consistent version of everything the dashboard shows. A snapshot is
+# never changed after it is published: the scheduler builds the next one off
+# to the side and swaps it in with a single assignment, so a callback that
+# grabbed a snapshot reads all of its frames from the same version without
+# taking a lock.
+@dataclass(frozen=True)
+class DataSnapshot:
+    version: int
+    docker_df: Any
+    image_series: Any
+    dockertotal_df: Any
+    utilization_df: Any
+    docker_names: Tuple[str, ...]
+    metrics: Tuple[str, ...]
+    loaded_at: datetime.datetime
+
+
+current_snapshot = None
+
+# Only one builder at a time; readers never touch this lock
+build_lock = threading.Lock()
+
+# Versions count up across every snapshot this process builds, also when a
+# snapshot is built from scratch after a partial one
+versions = itertools.count(1)
+
+
+# The published snapshot, None until the first load completed
+def current():
+    return current_snapshot
+
+
+def publish(snapshot):
+    global current_snapshot
+    current_snapshot = snapshot
+    logging.info(f"Data snapshot version {snapshot.version} published")
+
+
+# Build the next snapshot from previous (or from scratch), loading only the
+# snapshots previous does not hold yet. previous itself is left untouched.
+# A snapshot built from scratch can be limited to the snapshots after since.
+def build_snapshot(previous=None, since=None):
+    with build_lock:
+        return build_from(previous, since)
+
+
+# Build the snapshot following the published one and hand it to publish
+# before build_lock is released. Refreshes of several jobs running at once
+# then each start from the version the one before published; reading the
+# published snapshot outside the lock could build two versions from the
+# same one and drop the rows the first of them added.
+def refresh_snapshot(publish=publish):
+    with build_lock:
+        snapshot = build_from(current_snapshot)
+        publish(snapshot)
+        return snapshot
+
+
+def build_from(previous, since=None):
+    # Imported on first use, pandas is not needed to serve the page
+    from dataframes import load_docker_rows, generate_utilization_dataframe, generate_dockertotal_dataframe, ImageSeriesIndex
+    if previous is None:
+        docker_df, new_rows, rebuilt = load_docker_rows(None, since)
+        image_series = ImageSeriesIndex(docker_df)
+        dockertotal_df = generate_dockertotal_dataframe(None, since)
+        utilization_df = generate_utilization_dataframe(None, since)
+    else:
+        docker_df, new_rows, rebuilt = load_docker_rows(previous.docker_df)
+        if rebuilt:
+            image_series = ImageSeriesIndex(docker_df)
+        else:
+            image_series = previous.image_series.extended(new_rows)
+        dockertotal_df = generate_dockertotal_dataframe(previous.dockertotal_df)
+        utilization_df = generate_utilization_dataframe(previous.utilization_df)
+
+    return make_snapshot(docker_df, image_series, dockertotal_df, utilization_df)
+
+
+def make_snapshot(docker_df, image_series, dockertotal_df, utilization_df):
+    return DataSnapshot(
+        version=next(versions),
+        docker_df=docker_df,
+        image_series=image_series,
+        dockertotal_df=dockertotal_df,
+        utilization_df=utilization_df,
+        docker_names=tuple(docker_df['Docker Name'].unique()) if not docker_df.empty else (),
+        metrics=tuple(utilization_df['Metric'].unique()) if not utilization_df.empty else (),
+        loaded_at=datetime.datetime.now(),
+    )
+
+
+# Snapshot from frames loaded elsewhere, e.g. the shared history of another worker
+def snapshot_from_frames(docker_df, dockertotal_df, utilization_df):
+    from dataframes import ImageSeriesIndex
+    return make_snapshot(docker_df, ImageSeriesIndex(docker_df), dockertotal_df, utilization_df)
+
@@ -0,0 +1,261 @@
+import os
+import re
+import logging
+import numpy as np
+import pandas as pd
+from snapshot_index import SnapshotIndex
+import history_store
+import docker_deltas
+
+SNAPSHOT_FORMAT = '%Y-%m-%d_%H-%M-%S'
+SNAPSHOT_DATE = re.compile(r'\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}')
+
+# Parsed snapshot files, so a reload only reads files that are new or changed
+snapshot_index = SnapshotIndex()
+
+
+# Append new_rows to df (or start from new_rows) and keep the categorical columns
+def append_rows(df, new_rows):
+    if df is None or df.empty:
+        return new_rows
+    if new_rows.empty:
+        return df
+    df = pd.concat([df, new_rows], ignore_index=True)
+    # concat falls back to object when the categories differ
+    for column in new_rows.select_dtypes('category').columns:
+        df[column] = df[column].astype('category')
+    return df
+
+
+# Snapshot column for the collected rows, parsing each snapshot date only once
+def snapshot_column(snapshot_dates, lengths):
+    snapshots = pd.to_datetime(pd.Series(snapshot_dates, dtype='object'), format=SNAPSHOT_FORMAT)
+    return snapshots.repeat(lengths).reset_index(drop=True)
+
+
+# Read the snapshots newer than the ones already in df from the history store,
+# starting after since when df is empty
+def load_from_store(df, reader, snapshot_column, since=None):
+    if df is None or df.empty:
+        df = reader(since=since)
+    else:
+        df = append_rows(df, reader(since=pd.to_datetime(df[snapshot_column], format=SNAPSHOT_FORMAT).max()))
+    logging.info(f"Loaded {len(df)} rows from the history store")
+    return df
+
+
+# Accepts the snapshot files named after a date after since, and the ones
+# without a date in their name, which have to be parsed to tell
+def named_after(since):
+    def accept(file):
+        match = SNAPSHOT_DATE.search(os.path.basename(file))
+        return match is None or match.group() > since
+    return accept
+
+
+# Documents of the snapshot files df does not hold yet, or of all files
+# when df has to be rebuilt because old files changed underneath us.
+# With since only the snapshots taken after it are parsed and returned.
+# snapshot_column is df's snapshot time column.
+def documents_to_load(df, pattern, consumer, snapshot_column, since=None):
+    if since is not None:
+        # Snapshot dates sort as strings in SNAPSHOT_FORMAT
+        since = since.strftime(SNAPSHOT_FORMAT)
+    new_files, changed_files, removed_files = snapshot_index.refresh(pattern, consumer, since and named_after(since))
+
+    # Print the cleaned data files
+    print(f"Cleaned data files read into report: {new_files}")
+    logging.info(f"Cleaned data files read into report: {new_files}")
+
+    if df is None or changed_files or removed_files:
+        df, documents = None, snapshot_index.documents(pattern)
+    else:
+        documents = snapshot_index.documents(pattern, new_files)
+        if not df.empty:
+            # df may not come from this index (e.g. a shared history export),
+            # then every file is new to the consumer. Only the snapshots after
+            # the newest in df are appended, like the store and deltas do.
+            latest = df[snapshot_column].max().strftime(SNAPSHOT_FORMAT)
+            documents = [data for data in documents if data["Snapshot"] > latest]
+    if since is not None:
+        documents = [data for data in documents if data["Snapshot"] > since]
+    return df, documents
+
+
+# Load the docker count rows not in df yet. Returns (df, new_rows, rebuilt),
+# rebuilt meaning df was replaced rather than extended by new_rows. since
+# limits the snapshots read into an empty df to the ones taken after it.
+def load_docker_rows(df=None, since=None):
+    print("Generating dataframes process started...")
+    logging.info("Generating Docker count dataframes process started...")
+    if history_store.exists():
+        if df is None or df.empty:
+            new_rows = history_store.read_docker_counts(since=since)
+            return new_rows, new_rows, True
+        new_rows = history_store.read_docker_counts(since=df['Snapshot'].max())
+        logging.info(f"Loaded {len(new_rows)} rows from the history store")
+        return append_rows(df, new_rows), new_rows, False
+    if docker_deltas.exists():
+        if df is None or df.empty:
+            new_rows = docker_deltas.read_docker_counts(since=since)
+            return new_rows, new_rows, True
+        new_rows = docker_deltas.read_docker_counts(since=df['Snapshot'].max())
+        logging.info(f"Loaded {len(new_rows)} rows from the docker count deltas")
+        return append_rows(df, new_rows), new_rows, False
+    df, documents = documents_to_load(df, os.path.join('data', 'docker*.json'), 'docker', 'Snapshot', since)
+
+    # Collect the columns in a single pass and build one frame at the end
+    snapshot_dates, lengths, names, quantities = [], [], [], []
+    for data in documents:
+        image_counts = data["ImageCounts"]
+        snapshot_dates.append(data["Snapshot"])
+        lengths.append(len(image_counts))
+        names.extend(image_counts.keys())
+        quantities.extend(image_counts.values())
+
+    new_rows = pd.DataFrame({
+        "Snapshot": snapshot_column(snapshot_dates, lengths),
+        "Docker Name": pd.Categorical(names),
+        "Quantity": pd.Series(quantities, dtype='int64'),
+    })
+    rebuilt = df is None
+    df = append_rows(df, new_rows)
+
+    # Print the DataFrame
+    print(df)
+    logging.info("Docker count dataframes process completed...")
+    return df, new_rows, rebuilt
+
+
+# Generate Docker count data
+def generate_docker_dataframe(df=None):
+    return load_docker_rows(df)[0]
+
+
+EMPTY_SERIES = pd.DataFrame({'Snapshot': pd.Series(dtype='datetime64[ns]'), 'Quantity': pd.Series(dtype='int64')})
+
+
+def categorical(values):
+    return values.array if isinstance(values.dtype, pd.CategoricalDtype) else pd.Categorical(values)
+
+
+# Row order of docker_df by image and, within an image, by Snapshot
+def image_order(docker_df):
+    return np.lexsort((docker_df['Snapshot'].to_numpy(), categorical(docker_df['Docker Name']).codes))
+
+
+# Per-image time series behind the Docker Name dropdown and /api/docker.
+# The rows are kept in image order once, and an image's series is the slice
+# between its bounds, a view. A shared history export is written in that
+# order (see shared_history.py), so a worker indexes the mapped columns
+# without copying them. The rows a refresh adds are merged into the series
+# of their images by extended() while the next snapshot is built; get() is
+# a plain lookup and an index never changes once built.
+class ImageSeriesIndex:
+    def __init__(self, rows=None):
+        self.frame = EMPTY_SERIES
+        self.bounds = {}
+        # Series of the images that got rows after the index was built
+        self.merged = {}
+        if rows is not None and not rows.empty:
+            self.build(rows)
+
+    def build(self, rows):
+        names = categorical(rows['Docker Name'])
+        codes = names.codes
+        snapshots = rows['Snapshot'].to_numpy()
+        code_steps = np.diff(codes)
+        if (code_steps >= 0).all() and ((snapshots[1:] >= snapshots[:-1]) | (code_steps > 0)).all():
+            self.frame = pd.DataFrame({'Snapshot': rows['Snapshot'], 'Quantity': rows['Quantity']}, copy=False)
+        else:
+            order = np.lexsort((snapshots, codes))
+            codes = codes[order]
+            self.frame = pd.DataFrame({'Snapshot': snapshots[order], 'Quantity': rows['Quantity'].to_numpy()[order]})
+        category_codes = np.arange(len(names.categories))
+        firsts = codes.searchsorted(category_codes, side='left')
+        lasts = codes.searchsorted(category_codes, side='right')
+        self.bounds = {name: (int(first), int(last)) for name, first, last in zip(names.categories, firsts, lasts)
+                       if last > first}
+        logging.info(f"Image series index built over {len(rows)} rows")
+
+    # A new index holding this one's rows plus rows, leaving this one as it is.
+    # The frame is shared, only the series of the images in rows are merged.
+    def extended(self, rows):
+        index = ImageSeriesIndex()
+        index.frame, index.bounds, index.merged = self.frame, self.bounds, dict(self.merged)
+        for name, group in rows.groupby('Docker Name', observed=True, sort=False):
+            group = group[['Snapshot', 'Quantity']]
+            if name in self.bounds or name in self.merged:
+                series = pd.concat([self.get(name), group], ignore_index=True)
+            else:
+                series = group.reset_index(drop=True)
+            if not series['Snapshot'].is_monotonic_increasing:
+                series = series.sort_values('Snapshot', kind='stable', ignore_index=True)
+            index.merged[name] = series
+        logging.info(f"Image series index extended with {len(rows)} rows")
+        return index
+
+    # Snapshot/Quantity series of one image, sorted by Snapshot
+    def get(self, name):
+        series = self.merged.get(name)
+        if series is not None:
+            return series
+        bounds = self.bounds.get(name)
+        if bounds is None:
+            return EMPTY_SERIES
+        return self.frame.iloc[bounds[0]:bounds[1]]
+
+
+# Generate Utilization Dataframe
+def generate_utilization_dataframe(df=None, since=None):
+    logging.info("Generating Utilization dataframes process started...")
+    if history_store.exists():
+        return load_from_store(df, history_store.read_utilization, 'Snapshot', since)
+    df, documents = documents_to_load(df, os.path.join('data', 'utilization*.json'), 'utilization', 'Snapshot', since)
+
+    # Collect the columns in a single pass and build one frame at the end
+    snapshot_dates, lengths, metrics, values = [], [], [], []
+    for data in documents:
+        metric_values = {key: value for key, value in data.items() if key not in ["Snapshot"]}
+        snapshot_dates.append(data["Snapshot"])
+        lengths.append(len(metric_values))
+        metrics.extend(metric_values.keys())
+        values.extend(metric_values.values())
+
+    new_rows = pd.DataFrame({
+        "Snapshot": snapshot_column(snapshot_dates, lengths),
+        "Metric": pd.Categorical(metrics),
+        "Value": pd.Series(values, dtype='float64'),
+    })
+    df = append_rows(df, new_rows)
+
+    logging.info("Utilization dataframes process completed...")
+    return df
+
+
+# Generate the Docker total count dataframe, sorted by Snapshot Date. The
+# chart is drawn by the callbacks from it, see build_total_chart in app.py.
+def generate_dockertotal_dataframe(df=None, since=None):
+    print("Generating dataframes process started...")
+    logging.info("Generating dataframes process started...")
+    if history_store.exists():
+        df = load_from_store(df, history_store.read_docker_totals, 'Snapshot Date', since)
+    elif docker_deltas.exists():
+        df = load_from_store(df, docker_deltas.read_docker_totals, 'Snapshot Date', since)
+    else:
+        df, documents = documents_to_load(df, os.path.join('data', 'docker*.json'), 'dockertotal', 'Snapshot Date', since)
+        snapshot_dates = [data["Snapshot"] for data in documents]
+        new_rows = pd.DataFrame({
+            'Snapshot Date': snapshot_column(snapshot_dates, 1),
+            'Total Docker Count': pd.Series([data["Total Docker Count"] for data in documents], dtype='int64'),
+        })
+        df = append_rows(df, new_rows)
+
+    # Sort the DataFrame by 'Snapshot Date' in ascending order
+    df = df.sort_values('Snapshot Date', ignore_index=True)
+
+    # Print the DataFrame
+    print(df)
+    logging.info("The docker dataframes process completed...")
+
+    return df
@@ -0,0 +1,213 @@
+import json, glob, os
+import logging
+import pandas as pd
+
+# Delta-encoded docker image count snapshots. Most image counts barely move
+# between two runs, so instead of the whole ImageCounts map per snapshot the
+# counts are kept in segments of JSON lines under data/docker_deltas/. Each
+# segment starts with a full keyframe and holds up to KEYFRAME_EVERY - 1
+# deltas after it, with only the images whose count changed or that
+# appeared ("Changed") and the ones that disappeared ("Removed"):
+#
+#   {"Snapshot": ..., "Total Docker Count": ..., "ImageCounts": {...}}
+#   {"Snapshot": ..., "Total Docker Count": ..., "Changed": {...}, "Removed": [...]}
+#
+# Any snapshot is rebuilt from the keyframe of its segment plus at most
+# KEYFRAME_EVERY - 1 deltas. Segments are named after their keyframe.
+DELTA_DIR = os.path.join('data', 'docker_deltas')
+KEYFRAME_EVERY = 24
+
+SNAPSHOT_FORMAT = '%Y-%m-%d_%H-%M-%S'
+
+
+def exists(delta_dir=DELTA_DIR):
+    return os.path.isdir(delta_dir)
+
+
+# Segment files, oldest first; the snapshot format sorts as a string
+def segments(delta_dir=DELTA_DIR):
+    return sorted(glob.glob(os.path.join(delta_dir, 'docker_deltas_*.jsonl')))
+
+
+def segment_snapshot(segment):
+    return os.path.basename(segment)[len('docker_deltas_'):-len('.jsonl')]
+
+
+def read_records(segment):
+    with open(segment) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# Replay records onto image_counts, yielding (snapshot, total, image_counts)
+# after each one. image_counts is updated in place.
+def replay(records, image_counts):
+    for record in records:
+        if 'ImageCounts' in record:
+            image_counts.clear()
+            image_counts.update(record['ImageCounts'])
+        else:
+            image_counts.update(record['Changed'])
+            for image in record['Removed']:
+                image_counts.pop(image, None)
+        yield record['Snapshot'], record['Total Docker Count'], image_counts
+
+
+# Records of every segment that can hold snapshots after since (a snapshot
+# date string), the segment holding since included for its keyframe
+def records_since(since=None, delta_dir=DELTA_DIR):
+    files = segments(delta_dir)
+    if since is not None:
+        starts = [segment_snapshot(segment) for segment in files]
+        first = max([i for i, start in enumerate(starts) if start <= since], default=0)
+        files = files[first:]
+    for segment in files:
+        yield from read_records(segment)
+
+
+# The record for image_counts: a keyframe, or the changes against previous
+def make_record(snapshot_date, total_count, image_counts, previous, keyframe):
+    if keyframe:
+        return {'Snapshot': snapshot_date, 'Total Docker Count': total_count, 'ImageCounts': image_counts}
+    return {
+        'Snapshot': snapshot_date,
+        'Total Docker Count': total_count,
+        'Changed': {image: count for image, count in image_counts.items() if previous.get(image) != count},
+        'Removed': [image for image in previous if image not in image_counts],
+    }
+
+
+def write_record(segment, record):
+    with open(segment, 'a') as f:
+        f.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+
+# Tail of the store: (newest segment, its record count, newest snapshot, its image counts)
+def tail(delta_dir=DELTA_DIR):
+    files = segments(delta_dir)
+    if not files:
+        return None, 0, None, {}
+    records = read_records(files[-1])
+    image_counts = {}
+    for snapshot, _, _ in replay(records, image_counts):
+        pass
+    return files[-1], len(records), snapshot, image_counts
+
+
+# Append one snapshot; tail_state is tail() and is updated in place when
+# given, so an import does not reread the segment for every snapshot
+def append(snapshot_date, total_count, image_counts, delta_dir=DELTA_DIR, tail_state=None):
+    os.makedirs(delta_dir, exist_ok=True)
+    if tail_state is None:
+        tail_state = list(tail(delta_dir))
+    segment, count, previous_snapshot, previous = tail_state
+    if previous_snapshot is not None and snapshot_date <= previous_snapshot:
+        # Deltas only go forward, older snapshots cannot be inserted
+        logging.info(f"Docker count snapshot {snapshot_date} is not newer than {previous_snapshot}, not appended")
+        return False
+
+    keyframe = segment is None or count >= KEYFRAME_EVERY
+    if keyframe:
+        segment, count = os.path.join(delta_dir, f'docker_deltas_{snapshot_date}.jsonl'), 0
+    write_record(segment, make_record(snapshot_date, total_count, image_counts, previous, keyframe))
+    tail_state[:] = [segment, count + 1, snapshot_date, dict(image_counts)]
+    logging.info(f"Docker count snapshot {snapshot_date} appended to {segment}")
+    return True
+
+
+# One-shot migration of the docker_count_*.json files
+def import_json_files(data_dir='data', delta_dir=DELTA_DIR):
+    imported = 0
+    documents = []
+    for file in glob.glob(os.path.join(data_dir, 'docker*.json')):
+        with open(file) as f:
+            documents.append(json.load(f))
+    os.makedirs(delta_dir, exist_ok=True)
+    tail_state = list(tail(delta_dir))
+    for data in sorted(documents, key=lambda data: data["Snapshot"]):
+        if append(data["Snapshot"], data["Total Docker Count"], data["ImageCounts"], delta_dir, tail_state):
+            imported += 1
+    print(f"Imported {imported} docker count files into {delta_dir}")
+    logging.info(f"Imported {imported} docker count files into {delta_dir}")
+    return imported
+
+
+def latest_snapshot(delta_dir=DELTA_DIR):
+    files = segments(delta_dir)
+    if not files:
+        return None
+    records = read_records(files[-1])
+    return records[-1]['Snapshot'] if records else None
+
+
+# (total, image_counts) of one snapshot (the newest by default), None if unknown
+def read_snapshot(snapshot_date=None, delta_dir=DELTA_DIR):
+    files = segments(delta_dir)
+    if snapshot_date is not None:
+        files = [segment for segment in files if segment_snapshot(segment) <= snapshot_date]
+    if not files:
+        return None
+    image_counts = {}
+    for snapshot, total, _ in replay(read_records(files[-1]), image_counts):
+        if snapshot == snapshot_date:
+            return total, dict(image_counts)
+    if snapshot_date is None:
+        return total, image_counts
+    return None
+
+
+# Snapshot/Quantity series of one image, replaying only its own changes
+def read_image_series(name, delta_dir=DELTA_DIR):
+    snapshots, quantities = [], []
+    quantity = None
+    for record in records_since(None, delta_dir):
+        if 'ImageCounts' in record:
+            quantity = record['ImageCounts'].get(name)
+        elif name in record['Changed']:
+            quantity = record['Changed'][name]
+        elif name in record['Removed']:
+            quantity = None
+        if quantity is not None:
+            snapshots.append(record['Snapshot'])
+            quantities.append(quantity)
+    return pd.DataFrame({
+        'Snapshot': pd.to_datetime(pd.Series(snapshots, dtype='object'), format=SNAPSHOT_FORMAT),
+        'Quantity': pd.Series(quantities, dtype='int64'),
+    })
+
+
+def since_string(since):
+    return None if since is None else pd.Timestamp(since).strftime(SNAPSHOT_FORMAT)
+
+
+# Readers returning the same columns as the JSON loaders in dataframes.py.
+# Pass since (a datetime) to only read the snapshots taken after it.
+def read_docker_counts(since=None, delta_dir=DELTA_DIR):
+    since = since_string(since)
+    snapshot_dates, lengths, names, quantities = [], [], [], []
+    for snapshot, _, image_counts in replay(records_since(since, delta_dir), {}):
+        if since is not None and snapshot <= since:
+            continue
+        snapshot_dates.append(snapshot)
+        lengths.append(len(image_counts))
+        names.extend(image_counts.keys())
+        quantities.extend(image_counts.values())
+    snapshots = pd.to_datetime(pd.Series(snapshot_dates, dtype='object'), format=SNAPSHOT_FORMAT)
+    return pd.DataFrame({
+        'Snapshot': snapshots.repeat(lengths).reset_index(drop=True),
+        'Docker Name': pd.Categorical(names),
+        'Quantity': pd.Series(quantities, dtype='int64'),
+    })
+
+
+def read_docker_totals(since=None, delta_dir=DELTA_DIR):
+    since = since_string(since)
+    records = [record for record in records_since(since, delta_dir) if since is None or record['Snapshot'] > since]
+    return pd.DataFrame({
+        'Snapshot Date': pd.to_datetime(pd.Series([record['Snapshot'] for record in records], dtype='object'), format=SNAPSHOT_FORMAT),
+        'Total Docker Count': pd.Series([record['Total Docker Count'] for record in records], dtype='int64'),
+    })
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    import_json_files()
@@ -0,0 +1,50 @@
+import logging
+import threading
+from collections import OrderedDict
+
+MAX_FIGURES = 256
+
+
+# Bounded LRU of built Plotly figures keyed by (chart, selection, generation).
+# The generation is the version of the data snapshot a figure was built from;
+# publishing a new snapshot bumps it, so figures of older data are never
+# served again and are dropped.
+class FigureCache:
+    def __init__(self, max_entries=MAX_FIGURES):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.generation = 0
+        self.hits = self.misses = 0
+
+    def bump(self, generation=None):
+        with self.lock:
+            self.generation = self.generation + 1 if generation is None else generation
+            self.entries.clear()
+            generation = self.generation
+        logging.info(f"Figure cache generation bumped to {generation}")
+
+    # Return the cached figure for chart/selection, building it with build()
+    # on a miss. Lists in selection are turned into tuples for the key.
+    # generation defaults to the current one; pass the version of the data
+    # the figure is built from so a figure of old data is never stored as new.
+    def get(self, chart, selection, build, generation=None):
+        if isinstance(selection, list):
+            selection = tuple(selection)
+        with self.lock:
+            key = (chart, selection, self.generation if generation is None else generation)
+            figure = self.entries.get(key)
+            if figure is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return figure
+            self.misses += 1
+
+        # Build outside the lock, two viewers racing on a miss just build twice
+        figure = build()
+        with self.lock:
+            if key[2] == self.generation:
+                self.entries[key] = figure
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return figure
@@ -0,0 +1,168 @@
+import aiohttp
+import asyncio
+import logging
+import ijson
+import time
+import metrics
+
+# Connection pool shared by the collectors. stats.runonflux.io and
+# api.runonflux.io each get a few keep-alive connections, so a collection
+# cycle reuses the TLS connections of the previous one.
+TOTAL_CONNECTIONS = 16
+CONNECTIONS_PER_HOST = 4
+KEEPALIVE_SECONDS = 5 * 60
+
+
+def create_session():
+    connector = aiohttp.TCPConnector(
+        limit=TOTAL_CONNECTIONS,
+        limit_per_host=CONNECTIONS_PER_HOST,
+        keepalive_timeout=KEEPALIVE_SECONDS,
+        ttl_dns_cache=KEEPALIVE_SECONDS,
+    )
+    return aiohttp.ClientSession(connector=connector)
+
+
+# Every request gets its own timeout and a few retries with exponential backoff
+REQUEST_TIMEOUT_SECONDS = 120
+RETRIES = 3
+BACKOFF_SECONDS = 2
+
+
+class FluxApiError(Exception):
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+# The Flux API answers 200 with this payload when it is overloaded
+def is_internal_error(data):
+    return (isinstance(data, dict) and data.get('status') == 'error'
+            and isinstance(data.get('data'), dict)
+            and data['data'].get('message') == 'Internal error. Try again later')
+
+
+# Returned instead of a body when a conditional request got 304 Not Modified
+NOT_MODIFIED = object()
+
+# Response headers a cached body can be revalidated with
+VALIDATORS = ('ETag', 'Last-Modified')
+
+
+# Request url and hand the response to read_body, retrying failed attempts.
+# Any partial result of a failed attempt is thrown away with it. headers go
+# out with the request; validators, when given, receives the ETag and
+# Last-Modified of the response (see response_cache.py). timeout, retries and
+# backoff left at None take the module settings as they are at call time.
+async def request_with_retries(session, url, read_body, timeout=None, retries=None, backoff=None, headers=None, validators=None):
+    timeout = REQUEST_TIMEOUT_SECONDS if timeout is None else timeout
+    retries = RETRIES if retries is None else retries
+    backoff = BACKOFF_SECONDS if backoff is None else backoff
+    for attempt in range(1, retries + 1):
+        try:
+            started = time.perf_counter()
+            async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                # fetch is the time to the response headers, parse the
+                # streamed body on top of it
+                metrics.observe('fetch', time.perf_counter() - started, endpoint=url)
+                if response.status == 304 and headers:
+                    if validators is not None:
+                        validators.update({name: response.headers[name] for name in VALIDATORS if name in response.headers})
+                    return NOT_MODIFIED
+                if response.status != 200:
+                    # Client errors will not get better by asking again
+                    retryable = response.status >= 500 or response.status == 429
+                    raise FluxApiError(f"Request failed with status code: {response.status}", retryable)
+                if validators is not None:
+                    validators.update({name: response.headers[name] for name in VALIDATORS if name in response.headers})
+                with metrics.timed('parse', endpoint=url):
+                    body = await read_body(response)
+                metrics.add('bytes_received', response.content.total_bytes, endpoint=url)
+                return body
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, ijson.JSONError, FluxApiError) as e:
+            if attempt == retries or not getattr(e, 'retryable', True):
+                raise
+            delay = backoff * 2 ** (attempt - 1)
+            print(f"Request to {url} failed ({str(e) or type(e).__name__}), retrying in {delay}s")
+            logging.info(f"Request to {url} failed ({str(e) or type(e).__name__}), retrying in {delay}s")
+            await asyncio.sleep(delay)
+
+
+# Writes the body to raw while a parser reads it, for payload_archive.py
+class RawCopy:
+    def __init__(self, content, raw):
+        self.content = content
+        self.raw = raw
+
+    async def read(self, n=-1):
+        data = await self.content.read(n)
+        self.raw.write(data)
+        return data
+
+
+# Empty raw for the body of a new attempt
+def rewind(raw):
+    raw.seek(0)
+    raw.truncate()
+
+
+# raw, a binary file such as tempfile.TemporaryFile(), receives the body of
+# the successful attempt when given, so the archive reads it back from disk
+# instead of a copy of the body being held in memory
+async def fetch_json(session, url, timeout=None, retries=None, backoff=None,
+                     headers=None, validators=None, raw=None):
+    async def read_json(response):
+        if raw is not None:
+            rewind(raw)
+            raw.write(await response.read())
+        data = await response.json(content_type=None)
+        if is_internal_error(data):
+            raise FluxApiError('Internal error. Try again later')
+        return data
+
+    return await request_with_retries(session, url, read_json, timeout, retries, backoff, headers, validators)
+
+
+# ijson events that carry a leaf value
+SCALAR_EVENTS = ('string', 'number', 'boolean', 'null')
+
+
+# Stream a {"status": ..., "data": [record, ...]} payload, such as the
+# fluxinfo projections, and keep only the wanted leaves of every record
+# instead of building the whole document. fields maps a column name to the
+# path of a leaf inside a record, e.g. {'cores': 'benchmark.bench.cores'}.
+# Returns {column: [value per record]}, with None where a record lacks the
+# leaf. Leaves inside an array ('apps.runningapps.item.Image') give a list
+# per record. raw works as for fetch_json.
+async def fetch_columns(session, url, fields, timeout=None, retries=None, backoff=None,
+                        headers=None, validators=None, raw=None):
+    leaves = {'data.item.' + path: column for column, path in fields.items()}
+    repeated = {column for column, path in fields.items() if '.item' in '.' + path}
+
+    async def read_columns(response):
+        columns = {column: [] for column in fields}
+        status = message = None
+        content = response.content
+        if raw is not None:
+            rewind(raw)
+            content = RawCopy(content, raw)
+        async for prefix, event, value in ijson.parse_async(content, use_float=True):
+            if prefix == 'data.item' and event == 'start_map':
+                for column, values in columns.items():
+                    values.append([] if column in repeated else None)
+            elif prefix in leaves and event in SCALAR_EVENTS:
+                column = leaves[prefix]
+                if column in repeated:
+                    columns[column][-1].append(value)
+                else:
+                    columns[column][-1] = value
+            elif prefix == 'status' and event == 'string':
+                status = value
+            elif prefix == 'data.message' and event == 'string':
+                message = value
+        if is_internal_error({'status': status, 'data': {'message': message}}):
+            raise FluxApiError('Internal error. Try again later')
+        return columns
+
+    return await request_with_retries(session, url, read_columns, timeout, retries, backoff, headers, validators)
+
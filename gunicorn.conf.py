@@ -0,0 +1,12 @@
+import os
+
+# Production serving of the dashboard: several worker processes, each with a
+# few threads for the Dash callbacks. The app is loaded per worker (no
+# preload) so every worker runs its own scheduler thread; the collector lock
+# makes sure only one of them collects.
+bind = '0.0.0.0:8049'
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+timeout = 120
+preload_app = False
+accesslog = '-'
@@ -0,0 +1,179 @@
+import json, glob, os
+import sqlite3
+import logging
+import datetime
+import pandas as pd
+import docker_deltas
+
+# Compacted history of every snapshot, one row per (snapshot, metric) and
+# (snapshot, image). Docker image names are stored once in docker_image and
+# referenced by id, so the file grows with the counts and not with the names.
+STORE_FILE = os.path.join('data', 'history.db')
+
+SNAPSHOT_FORMAT = '%Y-%m-%d_%H-%M-%S'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS utilization (
+    snapshot INTEGER NOT NULL,
+    metric TEXT NOT NULL,
+    value REAL,
+    PRIMARY KEY (snapshot, metric)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS docker_total (
+    snapshot INTEGER PRIMARY KEY,
+    total INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS docker_image (
+    image_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS docker_count (
+    snapshot INTEGER NOT NULL,
+    image_id INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    PRIMARY KEY (snapshot, image_id)
+) WITHOUT ROWID;
+"""
+
+
+# Snapshots are kept as seconds since the epoch of the (naive) snapshot time
+def snapshot_to_epoch(snapshot_date):
+    snapshot_datetime = datetime.datetime.strptime(snapshot_date, SNAPSHOT_FORMAT)
+    return int((snapshot_datetime - datetime.datetime(1970, 1, 1)).total_seconds())
+
+
+def exists(path=STORE_FILE):
+    return os.path.exists(path)
+
+
+def connect(path=STORE_FILE):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def image_ids(conn, names):
+    conn.executemany("INSERT OR IGNORE INTO docker_image (name) VALUES (?)", ((name,) for name in names))
+    ids = {}
+    for name, image_id in conn.execute("SELECT name, image_id FROM docker_image"):
+        ids[name] = image_id
+    return ids
+
+
+def insert_utilization(conn, jsondata):
+    snapshot = snapshot_to_epoch(jsondata['Snapshot'])
+    rows = [(snapshot, metric, value) for metric, value in jsondata.items() if metric != 'Snapshot']
+    conn.executemany("INSERT OR REPLACE INTO utilization VALUES (?, ?, ?)", rows)
+
+
+def insert_docker_count(conn, snapshot_date, total_count, image_counts):
+    snapshot = snapshot_to_epoch(snapshot_date)
+    ids = image_ids(conn, image_counts)
+    conn.execute("INSERT OR REPLACE INTO docker_total VALUES (?, ?)", (snapshot, total_count))
+    conn.executemany("INSERT OR REPLACE INTO docker_count VALUES (?, ?, ?)",
+                     ((snapshot, ids[image], count) for image, count in image_counts.items()))
+
+
+# Writers used by apidata.py and count_docker.py after each snapshot
+def append_utilization(jsondata, path=STORE_FILE):
+    conn = connect(path)
+    try:
+        with conn:
+            insert_utilization(conn, jsondata)
+    finally:
+        conn.close()
+    logging.info(f"Utilization snapshot {jsondata['Snapshot']} appended to {path}")
+
+
+def append_docker_count(snapshot_date, total_count, image_counts, path=STORE_FILE):
+    conn = connect(path)
+    try:
+        with conn:
+            insert_docker_count(conn, snapshot_date, total_count, image_counts)
+    finally:
+        conn.close()
+    logging.info(f"Docker count snapshot {snapshot_date} appended to {path}")
+
+
+# One-shot migration of the utilization_*.json and docker_count_*.json files.
+# Once data/docker_deltas/ exists count_docker.py writes no docker_count files
+# any more, so the snapshots in the deltas are imported as well; a snapshot
+# in both is the same and imported once.
+def import_json_files(data_dir='data', path=STORE_FILE, delta_dir=None):
+    if delta_dir is None:
+        delta_dir = os.path.join(data_dir, 'docker_deltas')
+    conn = connect(path)
+    imported = 0
+    try:
+        with conn:
+            for file in sorted(glob.glob(os.path.join(data_dir, 'utilization*.json'))):
+                with open(file) as f:
+                    insert_utilization(conn, json.load(f))
+                imported += 1
+            for file in sorted(glob.glob(os.path.join(data_dir, 'docker*.json'))):
+                with open(file) as f:
+                    data = json.load(f)
+                insert_docker_count(conn, data["Snapshot"], data["Total Docker Count"], data["ImageCounts"])
+                imported += 1
+            if docker_deltas.exists(delta_dir):
+                for snapshot, total, image_counts in docker_deltas.replay(docker_deltas.records_since(None, delta_dir), {}):
+                    insert_docker_count(conn, snapshot, total, image_counts)
+                    imported += 1
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    print(f"Imported {imported} snapshot files into {path}")
+    logging.info(f"Imported {imported} snapshot files into {path}")
+    return imported
+
+
+# Readers, each returning the same columns as the JSON loaders in app.py.
+# Pass since (a datetime) to only read the snapshots taken after it.
+def read_query(query, since, path):
+    params = () if since is None else (int((pd.Timestamp(since) - pd.Timestamp(0)).total_seconds()),)
+    conn = sqlite3.connect(path)
+    try:
+        return pd.read_sql_query(query, conn, params=params)
+    finally:
+        conn.close()
+
+
+def since_clause(since):
+    return "" if since is None else " WHERE snapshot > ?"
+
+
+def read_utilization(since=None, path=STORE_FILE):
+    df = read_query("SELECT snapshot, metric, value FROM utilization" + since_clause(since)
+                    + " ORDER BY snapshot", since, path)
+    return pd.DataFrame({
+        'Snapshot': pd.to_datetime(df['snapshot'], unit='s'),
+        'Metric': df['metric'].astype('category'),
+        'Value': df['value'].astype('float64'),
+    })
+
+
+def read_docker_counts(since=None, path=STORE_FILE):
+    df = read_query("SELECT snapshot, name, quantity FROM docker_count JOIN docker_image USING (image_id)"
+                    + since_clause(since).replace("snapshot", "docker_count.snapshot")
+                    + " ORDER BY snapshot", since, path)
+    return pd.DataFrame({
+        'Snapshot': pd.to_datetime(df['snapshot'], unit='s'),
+        'Docker Name': df['name'].astype('category'),
+        'Quantity': df['quantity'].astype('int64'),
+    })
+
+
+def read_docker_totals(since=None, path=STORE_FILE):
+    df = read_query("SELECT snapshot, total FROM docker_total" + since_clause(since)
+                    + " ORDER BY snapshot", since, path)
+    return pd.DataFrame({
+        'Snapshot Date': pd.to_datetime(df['snapshot'], unit='s'),
+        'Total Docker Count': df['total'].astype('int64'),
+    })
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    import_json_files()
@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import logging
+import datetime
+import functools
+import threading
+from contextlib import contextmanager
+
+# Timings of the collection phases (fetch, parse, aggregate, write, reload)
+# and of the dash callbacks, kept in memory for GET /metrics in the
+# Prometheus text format and appended one JSON object per line to
+# FLUXUTILMON_METRICS_LOG (metrics.log by default), e.g.
+#
+#   {"time": "2024-01-01T00:00:00.000000", "phase": "fetch", "seconds": 1.92,
+#    "endpoint": "https://stats.runonflux.io/fluxinfo?projection=benchmark,ip"}
+METRICS_LOG = os.environ.get('FLUXUTILMON_METRICS_LOG', 'metrics.log')
+
+PREFIX = 'fluxutilmon'
+
+json_log = logging.getLogger('fluxutilmon.metrics')
+json_log.propagate = False
+if METRICS_LOG and not json_log.handlers:
+    handler = logging.FileHandler(METRICS_LOG)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    json_log.addHandler(handler)
+    json_log.setLevel(logging.INFO)
+
+
+# Count, sum and max per phase and label set, plus the running totals of the
+# counters (bytes received, cache hits)
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = {}
+        self.counters = {}
+
+    def observe(self, phase, seconds, labels):
+        key = (phase, tuple(sorted(labels.items())))
+        with self.lock:
+            count, total, longest, _ = self.timings.get(key, (0, 0.0, 0.0, 0.0))
+            self.timings[key] = (count + 1, total + seconds, max(longest, seconds), seconds)
+
+    def add(self, name, value, labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    # JSON-friendly copy, without the timings of the phases in exclude
+    def state(self, exclude=()):
+        with self.lock:
+            return {
+                'timings': [[phase, dict(labels), list(values)] for (phase, labels), values in self.timings.items()
+                            if phase not in exclude],
+                'counters': [[name, dict(labels), value] for (name, labels), value in self.counters.items()],
+            }
+
+
+registry = Registry()
+
+
+def log_event(event):
+    if json_log.handlers:
+        json_log.info(json.dumps(dict(time=datetime.datetime.now().isoformat(), **event), default=str))
+
+
+def observe(phase, seconds, **labels):
+    registry.observe(phase, seconds, labels)
+    log_event(dict(phase=phase, seconds=round(seconds, 6), **labels))
+
+
+def add(name, value, **labels):
+    registry.add(name, value, labels)
+    log_event(dict(counter=name, value=value, **labels))
+
+
+@contextmanager
+def timed(phase, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(phase, time.perf_counter() - started, **labels)
+
+
+# Decorator timing every call of a dash callback as phase 'render'. Every
+# gunicorn worker renders on its own, hence the worker label.
+def timed_callback(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with timed('render', callback=func.__name__, worker=os.getpid()):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+# The collector's timings for the other gunicorn workers, whose /metrics
+# merge them with their own render timings
+COLLECTOR_STATE = os.path.join('data', 'collector_metrics.json')
+
+
+def export_state(path=COLLECTOR_STATE):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(registry.state(exclude=('render',)), f)
+    os.replace(path + '.tmp', path)
+
+
+def read_state(path=COLLECTOR_STATE):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'timings': [], 'counters': []}
+
+
+def label_text(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+# Prometheus text exposition of one or more registry states, e.g. this
+# process's and the collector's (see app.py)
+def render(*states):
+    timings = [timing for state in states for timing in state['timings']]
+    counters = [counter for state in states for counter in state['counters']]
+    lines = [
+        f'# HELP {PREFIX}_phase_seconds Time spent per collection phase and callback',
+        f'# TYPE {PREFIX}_phase_seconds summary',
+    ]
+    for phase, labels, (count, total, _, _) in timings:
+        labels = dict(phase=phase, **labels)
+        lines.append(f'{PREFIX}_phase_seconds_count{label_text(labels)} {count}')
+        lines.append(f'{PREFIX}_phase_seconds_sum{label_text(labels)} {total:.6f}')
+    for name, help_text, index in [('phase_seconds_max', 'Longest run of a phase', 2),
+                                   ('phase_seconds_last', 'Last run of a phase', 3)]:
+        lines.append(f'# HELP {PREFIX}_{name} {help_text}')
+        lines.append(f'# TYPE {PREFIX}_{name} gauge')
+        for phase, labels, values in timings:
+            lines.append(f'{PREFIX}_{name}{label_text(dict(phase=phase, **labels))} {values[index]:.6f}')
+    for name in sorted({name for name, _, _ in counters}):
+        lines.append(f'# TYPE {PREFIX}_{name}_total counter')
+        for counter_name, labels, value in counters:
+            if counter_name == name:
+                lines.append(f'{PREFIX}_{name}_total{label_text(labels)} {value}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,78 @@
+import glob, os
+import logging
+import numpy as np
+import aggregate
+
+# Per-node snapshots, one compressed .npz per snapshot holding a column per
+# field keyed by the node column. Values are float32, which is plenty for
+# per-node cores/ram/ssd, and savez_compressed squeezes the repetition out.
+NODE_DIR = os.path.join('data', 'nodes')
+
+BENCH_COLUMNS = ['bench_cores', 'bench_ram', 'bench_ssd']
+UTIL_COLUMNS = ['apps_cpus', 'apps_ram', 'apps_hdd']
+
+
+# Turn a streamed column (None for missing leaves) into a float64 array
+def to_array(values):
+    return aggregate.numeric(values)
+
+
+# Node keys for a streamed payload and the mask of the records carrying one.
+# The payloads are ordered independently, so a record without its key cannot
+# be matched to the other payload's records.
+def node_keys(values):
+    present = np.array([value is not None for value in values], dtype=bool)
+    return np.array([str(value) for value in values if value is not None], dtype=str), present
+
+
+# One payload's (keys, {column: values}) for the join, without the records
+# lacking a key
+def keyed_table(name, data, columns):
+    keys, present = node_keys(data['node'])
+    if not present.all():
+        print(f"{len(present) - len(keys)} of {len(present)} {name} records carry no node key, left out of the per-node capture")
+        logging.info(f"{len(present) - len(keys)} of {len(present)} {name} records carry no node key, left out of the per-node capture")
+    return keys, {column: to_array(data[field])[present] for column, field in columns.items()}
+
+
+# Join the per-node columns of the benchmark and apps.resources payloads on the
+# node key. Nodes missing from one payload get NaN for that payload's columns.
+def join_nodes(bench_data, util_data):
+    tables = []
+    if bench_data is not None:
+        tables.append(keyed_table('benchmark', bench_data, {'bench_cores': 'cores', 'bench_ram': 'ram', 'bench_ssd': 'ssd'}))
+    if util_data is not None:
+        tables.append(keyed_table('apps.resources', util_data, {'apps_cpus': 'cpus', 'apps_ram': 'ram', 'apps_hdd': 'hdd'}))
+
+    nodes = np.unique(np.concatenate([keys for keys, _ in tables])) if tables else np.array([], dtype='U1')
+    columns = {'node': nodes}
+    for keys, values in tables:
+        # Duplicate keys keep the last record, like a dict would
+        unique_keys, reversed_index = np.unique(keys[::-1], return_index=True)
+        last = len(keys) - 1 - reversed_index
+        positions = np.searchsorted(nodes, unique_keys)
+        for column, array in values.items():
+            joined = np.full(len(nodes), np.nan)
+            joined[positions] = array[last]
+            columns[column] = joined
+    for column in BENCH_COLUMNS + UTIL_COLUMNS:
+        columns.setdefault(column, np.full(len(nodes), np.nan))
+    return columns
+
+
+def write_node_snapshot(snapshot_date, columns, node_dir=NODE_DIR):
+    os.makedirs(node_dir, exist_ok=True)
+    path = os.path.join(node_dir, f'nodes_{snapshot_date}.npz')
+    arrays = {column: columns[column].astype('float32') for column in BENCH_COLUMNS + UTIL_COLUMNS}
+    np.savez_compressed(path, node=columns['node'], **arrays)
+    logging.info(f"Per-node snapshot of {len(columns['node'])} nodes written to {path}")
+    return path
+
+
+def read_node_snapshot(path):
+    with np.load(path) as npz:
+        return {column: npz[column] for column in npz.files}
+
+
+def list_node_snapshots(node_dir=NODE_DIR):
+    return sorted(glob.glob(os.path.join(node_dir, 'nodes_*.npz')))
@@ -0,0 +1,295 @@
+import json, os
+import bisect
+import heapq
+import itertools
+import operator
+import mmap
+import logging
+import tempfile
+import ijson
+import zstandard
+
+# Archive of the raw API payloads the collectors download, so they can be
+# analyzed again later. Every endpoint (name) gets append-only monthly
+# segments under data/archive/:
+#
+#   <name>_<YYYY-MM>.zst         zstd frames of CHUNK_RECORDS records each,
+#                                one compact JSON record per line
+#   <name>_<YYYY-MM>.idx.jsonl   one line per snapshot:
+#       {"Snapshot": ..., "Meta": {envelope without data},
+#        "Chunks": [[offset, length, first key, records], ...]}
+#
+# Records are sorted by their node key (key_field, e.g. 'ip') as they are
+# streamed into chunks, so one node's record is found by a binary search
+# over the first keys and costs the decompression of a single chunk. A snapshot whose
+# payload did not change (a response cache hit or 304) is an index line
+# {"Snapshot": ..., "Same": <earlier snapshot>} without new frames.
+ARCHIVE_DIR = os.path.join('data', 'archive')
+CHUNK_RECORDS = 500
+COMPRESSION_LEVEL = 10
+
+# A payload is streamed, never parsed as a whole: records are sorted in runs
+# of this many, spilled to temporary files and merged back into frames
+RUN_RECORDS = 10 * CHUNK_RECORDS
+
+# Snapshot holding the frames of the last payload archived per
+# (archive_dir, name), so an unchanged payload needs no scan of the index
+last_archived = {}
+
+
+def segment_paths(name, snapshot_date, archive_dir=ARCHIVE_DIR):
+    base = os.path.join(archive_dir, f'{name}_{snapshot_date[:7]}')
+    return base + '.zst', base + '.idx.jsonl'
+
+
+def record_key(record, key_field):
+    value = record.get(key_field) if key_field and isinstance(record, dict) else None
+    return None if value is None else str(value)
+
+
+def append_index(index_path, entry):
+    with open(index_path, 'a') as f:
+        f.write(json.dumps(entry, separators=(',', ':')) + '\n')
+
+
+# The value starting with (event, value), built from the ijson events
+def build_value(event, value, events):
+    builder = ijson.ObjectBuilder()
+    builder.event(event, value)
+    depth = 1 if event in ('start_map', 'start_array') else 0
+    while depth:
+        _, event, value = next(events)
+        builder.event(event, value)
+        if event in ('start_map', 'start_array'):
+            depth += 1
+        elif event in ('end_map', 'end_array'):
+            depth -= 1
+    return builder.value
+
+
+# Records of a {"data": [record, ...], ...} payload, one at a time; the
+# other top level keys end up in meta. Any other payload is a single record
+# with meta {'Whole': True}.
+def payload_records(body, meta):
+    events = ijson.parse(body, use_float=True)
+    _, event, value = next(events)
+    if event != 'start_map':
+        meta['Whole'] = True
+        yield build_value(event, value, events)
+        return
+    envelope = {}
+    listed = False
+    for _, event, key in events:
+        if event == 'end_map':
+            break
+        _, event, value = next(events)
+        if key == 'data' and event == 'start_array':
+            listed = True
+            for prefix, event, value in events:
+                if event == 'end_array' and prefix == 'data':
+                    break
+                yield build_value(event, value, events)
+        else:
+            envelope[key] = build_value(event, value, events)
+    if listed:
+        meta.update(envelope)
+    else:
+        meta['Whole'] = True
+        yield envelope
+
+
+# A sorted run of (key, line) written to a temporary file
+def spill(run):
+    f = tempfile.TemporaryFile('w+')
+    for key, line in run:
+        f.write(json.dumps(key) + '\t' + line + '\n')
+    f.seek(0)
+    return f
+
+
+def read_run(f):
+    for line in f:
+        key, record = line.rstrip('\n').split('\t', 1)
+        yield json.loads(key), record
+
+
+# (key, compact JSON line) of every record, in key order when key_field is
+# given, with at most RUN_RECORDS records in memory
+def sorted_lines(records, key_field):
+    lines = ((record_key(record, key_field) or '', json.dumps(record, separators=(',', ':'))) for record in records)
+    if not key_field:
+        yield from lines
+        return
+    runs = []
+    try:
+        while True:
+            run = sorted(itertools.islice(lines, RUN_RECORDS), key=operator.itemgetter(0))
+            if len(run) < RUN_RECORDS and not runs:
+                yield from run
+                return
+            runs.append(spill(run))
+            if len(run) < RUN_RECORDS:
+                break
+        # heapq.merge keeps equal keys in run order, as one stable sort would
+        yield from heapq.merge(*(read_run(f) for f in runs), key=operator.itemgetter(0))
+    finally:
+        for f in runs:
+            f.close()
+
+
+# Archive one raw payload of endpoint name, bytes or a binary file positioned
+# at its start. The payload is streamed into frames, and the frames are
+# written before the index line, so the index never points past the data.
+def archive_payload(name, snapshot_date, body, key_field=None, archive_dir=ARCHIVE_DIR):
+    meta = {}
+    lines = sorted_lines(payload_records(body, meta), key_field)
+
+    os.makedirs(archive_dir, exist_ok=True)
+    segment_path, index_path = segment_paths(name, snapshot_date, archive_dir)
+    compressor = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL)
+    chunks = []
+    with open(segment_path, 'ab') as f:
+        while True:
+            chunk = list(itertools.islice(lines, CHUNK_RECORDS))
+            if not chunk:
+                break
+            frame = compressor.compress('\n'.join(line for _, line in chunk).encode())
+            chunks.append([f.tell(), len(frame), chunk[0][0] if key_field else None, len(chunk)])
+            f.write(frame)
+    append_index(index_path, {'Snapshot': snapshot_date, 'Key': key_field, 'Meta': meta, 'Chunks': chunks})
+    last_archived[(archive_dir, name)] = snapshot_date
+    size = len(body) if isinstance(body, (bytes, bytearray)) else body.seek(0, os.SEEK_END)
+    logging.info(f"{name} payload of {snapshot_date} archived, {sum(chunk[3] for chunk in chunks)} records, "
+                 f"{sum(chunk[1] for chunk in chunks)} bytes compressed from {size}")
+
+
+# The payload of name did not change since the last archived snapshot. Only
+# the first call of a process reads the index to find that snapshot.
+def archive_unchanged(name, snapshot_date, archive_dir=ARCHIVE_DIR):
+    previous = last_archived.get((archive_dir, name))
+    if previous is None:
+        reader = ArchiveReader(name, archive_dir)
+        entries = reader.entries()
+        if not entries:
+            return False
+        previous = reader.resolve(max(entries), entries)['Snapshot']
+        last_archived[(archive_dir, name)] = previous
+    _, index_path = segment_paths(name, snapshot_date, archive_dir)
+    os.makedirs(archive_dir, exist_ok=True)
+    append_index(index_path, {'Snapshot': snapshot_date, 'Same': previous})
+    return True
+
+
+# Archive what one collection downloaded: (name, raw body, key field) per
+# endpoint that answered, the raw bodies being the binary files fluxapi
+# spooled them to. An empty body means the response came from the response
+# cache, the payload is the previous one.
+def archive_downloads(snapshot_date, downloads, archive_dir=ARCHIVE_DIR):
+    for name, raw, key_field in downloads:
+        try:
+            if raw.seek(0, os.SEEK_END):
+                raw.seek(0)
+                archive_payload(name, snapshot_date, raw, key_field, archive_dir)
+            else:
+                archive_unchanged(name, snapshot_date, archive_dir)
+        except (OSError, ValueError, ijson.JSONError) as e:
+            # The snapshot itself is written already, only the archive misses it
+            print(f"Archiving the {name} payload failed: {str(e)}")
+            logging.exception(f"Archiving the {name} payload of {snapshot_date} failed")
+
+
+# Reads an endpoint's archive through read-only memory maps of the segments;
+# only the frames asked for are decompressed
+class ArchiveReader:
+    def __init__(self, name, archive_dir=ARCHIVE_DIR):
+        self.name = name
+        self.archive_dir = archive_dir
+        self.maps = {}
+        self.decompressor = zstandard.ZstdDecompressor()
+
+    def index_paths(self):
+        if not os.path.isdir(self.archive_dir):
+            return []
+        suffix = '.idx.jsonl'
+        return sorted(os.path.join(self.archive_dir, file) for file in os.listdir(self.archive_dir)
+                      if file.startswith(self.name + '_') and file.endswith(suffix)
+                      and len(file) == len(self.name) + 1 + 7 + len(suffix))
+
+    # Index entries by snapshot, read again when a collector appended
+    def entries(self):
+        entries = {}
+        for index_path in self.index_paths():
+            with open(index_path) as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        entry['Segment'] = index_path[:-len('.idx.jsonl')] + '.zst'
+                        entries[entry['Snapshot']] = entry
+        return entries
+
+    def snapshots(self):
+        return sorted(self.entries())
+
+    # The entry holding the frames of snapshot_date
+    def resolve(self, snapshot_date, entries=None):
+        entries = entries if entries is not None else self.entries()
+        entry = entries.get(snapshot_date)
+        while entry is not None and 'Same' in entry:
+            entry = entries.get(entry['Same'])
+        if entry is None:
+            raise KeyError(f"No {self.name} payload archived for {snapshot_date}")
+        return entry
+
+    def segment_map(self, segment_path):
+        mapped = self.maps.get(segment_path)
+        if mapped is None or len(mapped) < os.path.getsize(segment_path):
+            # Grown since it was mapped, map it again
+            with open(segment_path, 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[segment_path] = mapped
+        return mapped
+
+    def read_chunk(self, segment_path, chunk):
+        offset, length = chunk[0], chunk[1]
+        data = self.decompressor.decompress(self.segment_map(segment_path)[offset:offset + length])
+        return [json.loads(line) for line in data.split(b'\n')]
+
+    # The payload of one snapshot as downloaded, records sorted by node key
+    def read_snapshot(self, snapshot_date):
+        entry = self.resolve(snapshot_date)
+        records = [record for chunk in entry['Chunks'] for record in self.read_chunk(entry['Segment'], chunk)]
+        if entry['Meta'].get('Whole'):
+            return records[0]
+        return dict(entry['Meta'], data=records)
+
+    # One node's record in one snapshot, None when it is not there
+    def read_node_record(self, snapshot_date, key, entry=None):
+        entry = entry or self.resolve(snapshot_date)
+        if not entry.get('Key'):
+            raise ValueError(f"{self.name} payloads are not keyed by node")
+        first_keys = [chunk[2] or '' for chunk in entry['Chunks']]
+        position = bisect.bisect_right(first_keys, key) - 1
+        if position < 0:
+            return None
+        for record in self.read_chunk(entry['Segment'], entry['Chunks'][position]):
+            if record_key(record, entry['Key']) == key:
+                return record
+        return None
+
+    # [(snapshot, record)] of one node over the snapshots between since and
+    # until (snapshot date strings, both optional)
+    def read_node(self, key, since=None, until=None):
+        entries = self.entries()
+        history = []
+        for snapshot_date in sorted(entries):
+            if (since is not None and snapshot_date < since) or (until is not None and snapshot_date > until):
+                continue
+            record = self.read_node_record(snapshot_date, key, self.resolve(snapshot_date, entries))
+            if record is not None:
+                history.append((snapshot_date, record))
+        return history
+
+    def close(self):
+        for mapped in self.maps.values():
+            mapped.close()
+        self.maps = {}
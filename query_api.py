@@ -0,0 +1,291 @@
+import json
+import logging
+import pandas as pd
+from flask import Response, jsonify
+import data_snapshot
+
+# Query API over the published data snapshot, the same in-memory history the
+# dashboard draws from. The routes are in app.py:
+#
+#   GET /api/utilization?metric=totalnodes&start=2024-01-01&end=2024-02-01&resample=1D&agg=mean
+#   GET /api/docker?image=nginx:latest&prefix=runonflux/&resample=1h
+#   GET /api/docker/total?start=2024-01-01
+#   GET /api/docker/top?n=20&start=2024-01-01
+#   GET /api/utilization/metrics, GET /api/docker/images?prefix=runonflux/
+#
+# Every row query takes start/end (ISO dates, inclusive), resample (a pandas
+# offset alias such as 1h or 1D) with agg, limit/offset for pagination and
+# format=json|csv. Rows are serialized and sent CHUNK_ROWS at a time.
+DEFAULT_LIMIT = 1000
+MAX_LIMIT = 100000
+CHUNK_ROWS = 1000
+AGGREGATIONS = ('mean', 'min', 'max', 'first', 'last', 'sum', 'count')
+FORMATS = ('json', 'csv')
+
+
+# A bad query parameter, answered with 400
+class QueryError(ValueError):
+    pass
+
+
+def parse_time(args, name):
+    value = args.get(name)
+    if not value:
+        return None
+    try:
+        timestamp = pd.Timestamp(value)
+    except ValueError:
+        raise QueryError(f"{name} is not a date: {value!r}")
+    if timestamp.tzinfo is not None:
+        # Snapshot times are naive, in the collector's local time
+        raise QueryError(f"{name} must not carry a time zone: {value!r}")
+    return timestamp
+
+
+def parse_int(args, name, default, maximum=None, minimum=0):
+    value = args.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        raise QueryError(f"{name} is not a number: {value!r}")
+    if number < minimum or (maximum is not None and number > maximum):
+        raise QueryError(f"{name} must be between {minimum} and {maximum}" if maximum else f"{name} must be at least {minimum}")
+    return number
+
+
+# Values of a parameter given repeatedly and/or comma separated
+def parse_list(args, name):
+    return [value for values in args.getlist(name) for value in values.split(',') if value]
+
+
+def parse_choice(args, name, choices, default):
+    value = args.get(name) or default
+    if value not in choices:
+        raise QueryError(f"{name} must be one of {', '.join(choices)}")
+    return value
+
+
+def parse_rule(args):
+    rule = args.get('resample')
+    if not rule:
+        return None
+    try:
+        pd.tseries.frequencies.to_offset(rule)
+    except ValueError:
+        raise QueryError(f"resample is not a pandas offset alias: {rule!r}")
+    return rule
+
+
+# (df sorted by time_column, first, last): df.iloc[first:last] are the rows
+# between start and end, found by binary search instead of a mask over the
+# whole history. Runs once per image of a docker query, so it searches the
+# NumPy array rather than the Series.
+def time_bounds(df, time_column, start, end):
+    if start is None and end is None:
+        return df, 0, len(df)
+    times = df[time_column].to_numpy()
+    if (times[1:] < times[:-1]).any():
+        df = df.sort_values(time_column, kind='stable')
+        times = df[time_column].to_numpy()
+    first = 0 if start is None else int(times.searchsorted(start.to_datetime64(), side='left'))
+    last = len(df) if end is None else int(times.searchsorted(end.to_datetime64(), side='right'))
+    return df, first, max(first, last)
+
+
+def time_slice(df, time_column, start, end):
+    df, first, last = time_bounds(df, time_column, start, end)
+    return df.iloc[first:last]
+
+
+# Aggregate value per key and rule-sized time bucket; empty buckets are dropped
+def resample_rows(df, key, time_column, value, rule, agg):
+    if df.empty:
+        return df
+    grouped = df.set_index(time_column).groupby(key, observed=True, sort=False)[value].resample(rule)
+    resampled = getattr(grouped, agg)().dropna().reset_index()
+    return resampled[[time_column, key, value]] if key else resampled
+
+
+# (offset, limit) of the page asked for. A limit of 0 would hand back
+# next_offset == offset forever.
+def page_bounds(args):
+    limit = parse_int(args, 'limit', DEFAULT_LIMIT, MAX_LIMIT, minimum=1)
+    offset = parse_int(args, 'offset', 0)
+    return offset, limit
+
+
+def page_of(df, args):
+    offset, limit = page_bounds(args)
+    return df.iloc[offset:offset + limit], offset, limit
+
+
+# Stream a page of rows as JSON ({"version", "total", "offset", "limit",
+# "next_offset", "rows": [...]}) or CSV, CHUNK_ROWS rows at a time
+def stream_rows(df, total, offset, limit, fmt, version):
+    next_offset = offset + limit if offset + limit < total else None
+
+    def json_chunks():
+        yield json.dumps({'version': version, 'total': total, 'offset': offset, 'limit': limit,
+                          'next_offset': next_offset})[:-1] + ', "rows": ['
+        for start in range(0, len(df), CHUNK_ROWS):
+            rows = df.iloc[start:start + CHUNK_ROWS].to_json(orient='records', date_format='iso')[1:-1]
+            yield (',' if start else '') + rows
+        yield ']}'
+
+    def csv_chunks():
+        yield ','.join(df.columns) + '\n'
+        for start in range(0, len(df), CHUNK_ROWS):
+            yield df.iloc[start:start + CHUNK_ROWS].to_csv(header=False, index=False, date_format='%Y-%m-%dT%H:%M:%S')
+
+    headers = {'X-Total-Count': str(total), 'X-Data-Version': str(version)}
+    if next_offset is not None:
+        headers['X-Next-Offset'] = str(next_offset)
+    if fmt == 'csv':
+        return Response(csv_chunks(), mimetype='text/csv', headers=headers)
+    return Response(json_chunks(), mimetype='application/json', headers=headers)
+
+
+def respond(df, args, version):
+    fmt = parse_choice(args, 'format', FORMATS, 'json')
+    page, offset, limit = page_of(df, args)
+    return stream_rows(page, len(df), offset, limit, fmt, version)
+
+
+def query_utilization(data, args):
+    metrics = parse_list(args, 'metric')
+    unknown = [metric for metric in metrics if metric not in data.metrics]
+    if unknown:
+        raise QueryError(f"Unknown metric: {', '.join(unknown)}")
+    start, end = parse_time(args, 'start'), parse_time(args, 'end')
+    rule, agg = parse_rule(args), parse_choice(args, 'agg', AGGREGATIONS, 'mean')
+
+    df = data.utilization_df
+    if metrics:
+        df = df[df['Metric'].isin(metrics)]
+    df = time_slice(df, 'Snapshot', start, end)
+    df = df[['Snapshot', 'Metric', 'Value']]
+    if rule:
+        df = resample_rows(df, 'Metric', 'Snapshot', 'Value', rule, agg)
+    df = df.sort_values(['Metric', 'Snapshot'], kind='stable')
+    df.columns = ['snapshot', 'metric', 'value']
+    return respond(df, args, data.version)
+
+
+# Image names matching the image and prefix parameters (all without either)
+def select_images(data, args):
+    images = parse_list(args, 'image')
+    prefixes = parse_list(args, 'prefix')
+    if not images and not prefixes:
+        return list(data.docker_names)
+    names = set(data.docker_names)
+    selected = [image for image in images if image in names]
+    selected.extend(name for name in data.docker_names
+                    if name not in selected and any(name.startswith(prefix) for prefix in prefixes))
+    return selected
+
+
+# Snapshot/Image/Quantity rows of the (name, series) slices, one after the other
+def docker_rows(slices):
+    frames = [series.assign(Image=name) for name, series in slices if not series.empty]
+    if frames:
+        return pd.concat(frames, ignore_index=True)[['Snapshot', 'Image', 'Quantity']]
+    return pd.DataFrame({'Snapshot': pd.Series(dtype='datetime64[ns]'), 'Image': pd.Series(dtype=object),
+                         'Quantity': pd.Series(dtype='int64')})
+
+
+# The rows offset to offset + limit of the (name, series, first, last) time
+# bounds laid end to end, sliced out of only the series overlapping the page
+def page_of_bounds(bounds, offset, limit):
+    page = []
+    position = 0
+    for name, series, first, last in bounds:
+        start, stop = max(offset - position, 0), min(offset + limit - position, last - first)
+        if start < stop:
+            page.append((name, series.iloc[first + start:first + stop]))
+        position += last - first
+        if position >= offset + limit:
+            break
+    return docker_rows(page)
+
+
+def query_docker(data, args):
+    start, end = parse_time(args, 'start'), parse_time(args, 'end')
+    rule, agg = parse_rule(args), parse_choice(args, 'agg', AGGREGATIONS, 'mean')
+    # The per-image series of the dashboard are already sorted by time. Only
+    # the bounds of every series are looked up, the total comes from them and
+    # a page only slices and concatenates the series it overlaps.
+    bounds = [(name,) + time_bounds(data.image_series.get(name), 'Snapshot', start, end)
+              for name in sorted(select_images(data, args))]
+    if rule:
+        # Resampled lengths are only known once resampled
+        df = docker_rows((name, series.iloc[first:last]) for name, series, first, last in bounds)
+        df = resample_rows(df, 'Image', 'Snapshot', 'Quantity', rule, agg)
+        df.columns = ['snapshot', 'image', 'quantity']
+        return respond(df, args, data.version)
+    fmt = parse_choice(args, 'format', FORMATS, 'json')
+    offset, limit = page_bounds(args)
+    page = page_of_bounds(bounds, offset, limit)
+    page.columns = ['snapshot', 'image', 'quantity']
+    total = sum(last - first for _, _, first, last in bounds)
+    return stream_rows(page, total, offset, limit, fmt, data.version)
+
+
+def query_docker_total(data, args):
+    start, end = parse_time(args, 'start'), parse_time(args, 'end')
+    rule, agg = parse_rule(args), parse_choice(args, 'agg', AGGREGATIONS, 'mean')
+    df = time_slice(data.dockertotal_df, 'Snapshot Date', start, end)[['Snapshot Date', 'Total Docker Count']]
+    if rule and not df.empty:
+        df = getattr(df.set_index('Snapshot Date')['Total Docker Count'].resample(rule), agg)().dropna().reset_index()
+    df.columns = ['snapshot', 'total']
+    return respond(df, args, data.version)
+
+
+# The n images with the most containers, at the newest snapshot in range or
+# on average over it (by=mean)
+def query_top_images(data, args):
+    start, end = parse_time(args, 'start'), parse_time(args, 'end')
+    n = parse_int(args, 'n', 10, MAX_LIMIT)
+    by = parse_choice(args, 'by', ('latest', 'mean', 'max'), 'latest')
+    images = set(select_images(data, args))
+    df = data.docker_df
+    if start is not None:
+        df = df[df['Snapshot'] >= start]
+    if end is not None:
+        df = df[df['Snapshot'] <= end]
+    if len(images) < len(data.docker_names):
+        df = df[df['Docker Name'].isin(images)]
+    if by == 'latest':
+        df = df[df['Snapshot'] == df['Snapshot'].max()]
+        quantities = df.groupby('Docker Name', observed=True)['Quantity'].sum()
+    else:
+        quantities = getattr(df.groupby('Docker Name', observed=True)['Quantity'], by)()
+    top = quantities.nlargest(n).reset_index()
+    top.columns = ['image', 'quantity']
+    top.insert(0, 'rank', range(1, len(top) + 1))
+    return respond(top, args, data.version)
+
+
+def list_metrics(data, args):
+    return jsonify(version=data.version, metrics=list(data.metrics))
+
+
+def list_images(data, args):
+    prefixes = parse_list(args, 'prefix')
+    names = sorted(name for name in data.docker_names if not prefixes or any(name.startswith(prefix) for prefix in prefixes))
+    df = pd.DataFrame({'image': names})
+    return respond(df, args, data.version)
+
+
+# Run query against the published snapshot: 503 until the first one is in,
+# 400 for bad parameters
+def handle(query, args):
+    data = data_snapshot.current()
+    if data is None:
+        return jsonify(error="No data loaded yet"), 503
+    try:
+        return query(data, args)
+    except QueryError as e:
+        logging.info(f"Bad query {dict(args)}: {str(e)}")
+        return jsonify(error=str(e)), 400
@@ -0,0 +1,112 @@
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+# Upper bound on the points a chart sends to the browser. Longer ranges are
+# aggregated server-side into the smallest time bucket that fits.
+MAX_POINTS = 500
+
+BUCKETS = [
+    ('hourly', pd.Timedelta(hours=1)),
+    ('daily', pd.Timedelta(days=1)),
+    ('weekly', pd.Timedelta(weeks=1)),
+    ('monthly', pd.Timedelta(days=30)),
+]
+
+# Values of the history range control (labelled in app.py) -> how far back to look
+HISTORY_RANGES = {
+    '7d': pd.Timedelta(days=7),
+    '30d': pd.Timedelta(days=30),
+    '90d': pd.Timedelta(days=90),
+    '1y': pd.Timedelta(days=365),
+    'all': None,
+}
+
+
+# Visible x range of a graph from its relayoutData, None when not zoomed
+def zoom_range(relayout_data):
+    if not relayout_data or relayout_data.get('xaxis.autorange'):
+        return None
+    if 'xaxis.range[0]' in relayout_data and 'xaxis.range[1]' in relayout_data:
+        return pd.Timestamp(relayout_data['xaxis.range[0]']), pd.Timestamp(relayout_data['xaxis.range[1]'])
+    if 'xaxis.range' in relayout_data:
+        start, end = relayout_data['xaxis.range']
+        return pd.Timestamp(start), pd.Timestamp(end)
+    return None
+
+
+# Window to show: the zoomed range if there is one, otherwise the chosen
+# history range ending at the newest snapshot. None bounds mean open ended.
+def visible_range(history_range, relayout_data, latest):
+    zoomed = zoom_range(relayout_data)
+    if zoomed:
+        return zoomed
+    lookback = HISTORY_RANGES.get(history_range)
+    if lookback is None or latest is None or pd.isna(latest):
+        return None, None
+    return latest - lookback, None
+
+
+# Smallest bucket keeping the span under max_points, None for raw points
+def choose_bucket(span, points, max_points=MAX_POINTS):
+    if points <= max_points:
+        return None
+    for name, bucket in BUCKETS:
+        if span / bucket <= max_points:
+            return name, bucket
+    return BUCKETS[-1]
+
+
+# Cut df to [start, end] on column x and aggregate y into time buckets when
+# there are too many points. Returns (frame, bucket name or None); the frame
+# has x, y (bucket mean) and, when aggregated, y min/max columns.
+def resample(df, x, y, start=None, end=None, max_points=MAX_POINTS):
+    if start is not None:
+        df = df[df[x] >= start]
+    if end is not None:
+        df = df[df[x] <= end]
+    if df.empty:
+        return df[[x, y]], None
+
+    chosen = choose_bucket(df[x].iloc[-1] - df[x].iloc[0], len(df), max_points)
+    if chosen is None:
+        return df[[x, y]], None
+    name, bucket = chosen
+    grouped = df.groupby(pd.Grouper(key=x, freq=bucket))[y]
+    aggregated = pd.DataFrame({y: grouped.mean(), f'{y} min': grouped.min(), f'{y} max': grouped.max()})
+    aggregated = aggregated.dropna(subset=[y]).reset_index()
+    return aggregated, name
+
+
+# Buckets the rollups hold, finer ones come from the raw rows
+ROLLUP_BUCKETS = ('daily', 'weekly', 'monthly')
+
+
+# Like resample, but reading the precomputed rollups of one series instead of
+# grouping raw rows. read_rollup(period, start, end) returns rollups.read_rollup
+# buckets. Returns (frame, bucket name) in the columns of resample, or None
+# when the range is short enough for raw points or an hourly bucket, or when
+# there are no rollups to read.
+def resample_rollups(read_rollup, x, y, start=None, end=None, max_points=MAX_POINTS):
+    daily = read_rollup('daily', start, end)
+    if daily.empty:
+        return None
+    span = daily['Bucket'].iloc[-1] - daily['Bucket'].iloc[0] + pd.Timedelta(days=1)
+    chosen = choose_bucket(span, daily['Count'].sum(), max_points)
+    if chosen is None or chosen[0] not in ROLLUP_BUCKETS:
+        return None
+    name = chosen[0]
+    buckets = daily if name == 'daily' else read_rollup(name, start, end)
+    return pd.DataFrame({x: buckets['Bucket'], y: buckets['Mean'], f'{y} min': buckets['Min'], f'{y} max': buckets['Max']}), name
+
+
+# Line chart of a resampled series, drawing the bucket min/max as a band
+def line_figure(df, x, y, bucket, **layout):
+    fig = px.line(df, x=x, y=y, markers=bucket is None, template='plotly_dark')
+    if bucket is not None:
+        for column, fill in ((f'{y} max', None), (f'{y} min', 'tonexty')):
+            fig.add_trace(go.Scatter(x=df[x], y=df[column], name=column, mode='lines', line=dict(width=0),
+                                     fill=fill, fillcolor='rgba(99, 110, 250, 0.2)', showlegend=False))
+        layout['title'] = f"{layout.get('title', '')} ({bucket} mean, min-max band)"
+    fig.update_layout(**layout)
+    return fig
@@ -0,0 +1,69 @@
+import time
+import logging
+import metrics
+from fluxapi import NOT_MODIFIED
+
+# Parsed responses of slow-changing endpoints, such as the benchmark
+# projection of fluxinfo and the node list behind the wallet count. A body is
+# reused as is for ttl seconds after it was fetched; after that the request
+# carries If-None-Match/If-Modified-Since from the last response and a 304
+# keeps the parsed body, so it is neither downloaded nor parsed again. Lives
+# in memory, so it pays off in the long-running app.py process.
+
+
+class CachedResponse:
+    def __init__(self, value, validators, fetched):
+        self.value = value
+        self.validators = validators
+        self.fetched = fetched
+
+
+class ResponseCache:
+    def __init__(self):
+        self.entries = {}
+        # Fresh hits, 304 revalidations and full downloads so far
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def conditional_headers(self, entry):
+        headers = {}
+        if 'ETag' in entry.validators:
+            headers['If-None-Match'] = entry.validators['ETag']
+        if 'Last-Modified' in entry.validators:
+            headers['If-Modified-Since'] = entry.validators['Last-Modified']
+        return headers
+
+    # fetch(headers, validators) makes the request, e.g.
+    # lambda headers, validators: fetch_columns(session, url, fields, headers=headers, validators=validators)
+    # Errors of fetch are raised as usual and leave the entry alone.
+    async def get(self, url, fetch, ttl):
+        entry = self.entries.get(url)
+        now = time.monotonic()
+        if entry is not None and now - entry.fetched < ttl:
+            self.hits += 1
+            metrics.add('response_cache', 1, endpoint=url, result='hit')
+            logging.info(f"Reusing the response of {url} from {now - entry.fetched:.0f} s ago")
+            return entry.value
+
+        headers = self.conditional_headers(entry) if entry is not None else {}
+        validators = {}
+        value = await fetch(headers or None, validators)
+        if value is NOT_MODIFIED:
+            self.revalidated += 1
+            metrics.add('response_cache', 1, endpoint=url, result='not_modified')
+            entry.validators.update(validators)
+            entry.fetched = now
+            logging.info(f"{url} not modified, reusing the parsed response")
+            return entry.value
+
+        self.misses += 1
+        metrics.add('response_cache', 1, endpoint=url, result='miss')
+        if validators:
+            self.entries[url] = CachedResponse(value, validators, now)
+        elif ttl > 0:
+            # Nothing to revalidate with, the TTL alone decides
+            self.entries[url] = CachedResponse(value, {}, now)
+        else:
+            self.entries.pop(url, None)
+        return value
@@ -0,0 +1,321 @@
+import os
+import json
+import sqlite3
+import logging
+import tempfile
+import numpy as np
+import pandas as pd
+import history_store
+
+# Aggregates of the snapshot history kept up to date on every write, so the
+# dashboard reads O(buckets) rows instead of grouping every raw snapshot:
+#
+#   rollup     daily/weekly/monthly count, sum, min, max and last value per
+#              utilization metric, per docker image and of the docker total
+#   top_image  the TOP_IMAGES images with the most containers per snapshot
+#   churn      images that appeared (+1) or disappeared (-1) per snapshot
+#
+# The file is built in one go from the full history (python3 rollups.py, or
+# by the dashboard once the history is loaded) and from then on updated by
+# apidata.py and count_docker.py with every snapshot they write.
+ROLLUP_FILE = os.path.join('data', 'rollups.db')
+
+PERIODS = ('daily', 'weekly', 'monthly')
+TOP_IMAGES = 50
+TOTAL_KEY = 'Total Docker Count'
+
+DAY = 24 * 60 * 60
+WEEK = 7 * DAY
+# 1970-01-05, the first Monday after the epoch, so weeks start on Monday
+MONDAY = 4 * DAY
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rollup (
+    period TEXT NOT NULL,
+    series TEXT NOT NULL,
+    key TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    sum REAL NOT NULL,
+    min REAL NOT NULL,
+    max REAL NOT NULL,
+    last REAL NOT NULL,
+    last_snapshot INTEGER NOT NULL,
+    PRIMARY KEY (period, series, key, bucket)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rolled_up (
+    series TEXT NOT NULL,
+    snapshot INTEGER NOT NULL,
+    PRIMARY KEY (series, snapshot)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS top_image (
+    snapshot INTEGER NOT NULL,
+    rank INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    PRIMARY KEY (snapshot, rank)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS churn (
+    snapshot INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    change INTEGER NOT NULL,
+    PRIMARY KEY (snapshot, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS live_image (
+    name TEXT PRIMARY KEY
+) WITHOUT ROWID;
+"""
+
+# Fold one snapshot's value into its bucket
+UPSERT = """
+INSERT INTO rollup VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?, ?)
+ON CONFLICT (period, series, key, bucket) DO UPDATE SET
+    count = count + 1,
+    sum = sum + excluded.sum,
+    min = MIN(min, excluded.min),
+    max = MAX(max, excluded.max),
+    last = CASE WHEN excluded.last_snapshot >= last_snapshot THEN excluded.last ELSE last END,
+    last_snapshot = MAX(last_snapshot, excluded.last_snapshot)
+"""
+
+
+def exists(path=ROLLUP_FILE):
+    return os.path.exists(path)
+
+
+def connect(path=ROLLUP_FILE):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+# Start of the period bucket holding each snapshot (seconds since the epoch)
+def bucket_starts(period, snapshots):
+    snapshots = np.asarray(snapshots, dtype='int64')
+    if period == 'daily':
+        return snapshots - snapshots % DAY
+    if period == 'weekly':
+        return snapshots - (snapshots - MONDAY) % WEEK
+    months = snapshots.astype('datetime64[s]').astype('datetime64[M]')
+    return months.astype('datetime64[s]').astype('int64')
+
+
+def to_epoch(timestamps):
+    return (pd.to_datetime(timestamps) - pd.Timestamp(0)) // pd.Timedelta(seconds=1)
+
+
+# Roll one snapshot of a series up into every period. Returns False when the
+# snapshot was already rolled up, so a repeated write is not counted twice.
+def apply_snapshot(conn, series, snapshot, values):
+    if conn.execute("SELECT 1 FROM rolled_up WHERE series = ? AND snapshot = ?", (series, snapshot)).fetchone():
+        return False
+    conn.execute("INSERT INTO rolled_up VALUES (?, ?)", (series, snapshot))
+    for period in PERIODS:
+        bucket = int(bucket_starts(period, snapshot))
+        conn.executemany(UPSERT, ((period, series, key, bucket, value, value, value, value, snapshot)
+                                  for key, value in values.items()))
+    return True
+
+
+def insert_top_images(conn, snapshot, image_counts):
+    ranking = sorted(image_counts.items(), key=lambda item: item[1], reverse=True)[:TOP_IMAGES]
+    conn.executemany("INSERT OR REPLACE INTO top_image VALUES (?, ?, ?, ?)",
+                     ((snapshot, rank, name, quantity) for rank, (name, quantity) in enumerate(ranking, start=1)))
+
+
+# Writers used by apidata.py and count_docker.py after each snapshot
+def update_utilization(jsondata, path=ROLLUP_FILE):
+    snapshot = history_store.snapshot_to_epoch(jsondata['Snapshot'])
+    values = {metric: float(value) for metric, value in jsondata.items() if metric != 'Snapshot' and value is not None}
+    conn = connect(path)
+    try:
+        with conn:
+            apply_snapshot(conn, 'utilization', snapshot, values)
+    finally:
+        conn.close()
+    logging.info(f"Utilization snapshot {jsondata['Snapshot']} rolled up in {path}")
+
+
+def update_docker_count(snapshot_date, total_count, image_counts, path=ROLLUP_FILE):
+    snapshot = history_store.snapshot_to_epoch(snapshot_date)
+    conn = connect(path)
+    try:
+        with conn:
+            if not apply_snapshot(conn, 'docker', snapshot, image_counts):
+                return
+            apply_snapshot(conn, 'docker_total', snapshot, {TOTAL_KEY: total_count})
+            insert_top_images(conn, snapshot, image_counts)
+
+            # Churn against the images of the newest snapshot so far
+            latest = conn.execute("SELECT MAX(snapshot) FROM rolled_up WHERE series = 'docker'").fetchone()[0]
+            if snapshot == latest:
+                live = {name for (name,) in conn.execute("SELECT name FROM live_image")}
+                if live:
+                    changes = [(snapshot, name, 1) for name in image_counts if name not in live]
+                    changes += [(snapshot, name, -1) for name in live if name not in image_counts]
+                    conn.executemany("INSERT OR REPLACE INTO churn VALUES (?, ?, ?)", changes)
+                conn.execute("DELETE FROM live_image")
+                conn.executemany("INSERT INTO live_image VALUES (?)", ((name,) for name in image_counts))
+    finally:
+        conn.close()
+    logging.info(f"Docker count snapshot {snapshot_date} rolled up in {path}")
+
+
+# Rollup rows of a whole series: snapshots, keys and values are equal-length columns
+def rollup_rows(series, snapshots, keys, values):
+    df = pd.DataFrame({'snapshot': snapshots, 'key': keys, 'value': values}).dropna(subset=['value'])
+    df = df.sort_values('snapshot', kind='stable')
+    rows = []
+    for period in PERIODS:
+        df['bucket'] = bucket_starts(period, df['snapshot'].to_numpy())
+        grouped = df.groupby(['key', 'bucket'], observed=True, sort=False)
+        aggregated = grouped['value'].agg(['count', 'sum', 'min', 'max', 'last'])
+        aggregated['last_snapshot'] = grouped['snapshot'].max()
+        aggregated = aggregated.reset_index()
+        aggregated['key'] = aggregated['key'].astype(str)
+        aggregated.insert(0, 'series', series)
+        aggregated.insert(0, 'period', period)
+        rows.extend(aggregated.itertuples(index=False, name=None))
+    return rows
+
+
+# Build the rollup file from the full history frames of dataframes.py. The
+# file is written under a temporary name of this process and moved into place
+# when complete, unless another process put a rollup file there meanwhile.
+# replace=True rebuilds an existing file as well (python3 rollups.py).
+def build(docker_df, dockertotal_df, utilization_df, path=ROLLUP_FILE, replace=False):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=os.path.basename(path) + '.', suffix='.tmp')
+    os.close(fd)
+    try:
+        build_file(tmp_path, docker_df, dockertotal_df, utilization_df)
+        if exists(path) and not replace:
+            # The collector updates that one from here on, keep it
+            os.remove(tmp_path)
+            logging.info(f"Rollups in {path} were built by another process meanwhile")
+            return
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    print(f"Rollups built in {path}")
+    logging.info(f"Rollups built in {path}")
+
+
+def build_file(tmp_path, docker_df, dockertotal_df, utilization_df):
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.executescript(SCHEMA)
+        with conn:
+            util_snapshots = to_epoch(utilization_df['Snapshot']).to_numpy()
+            docker_snapshots = to_epoch(docker_df['Snapshot']).to_numpy()
+            total_snapshots = to_epoch(dockertotal_df['Snapshot Date']).to_numpy()
+
+            conn.executemany("INSERT INTO rollup VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rollup_rows(
+                'utilization', util_snapshots, utilization_df['Metric'].array, utilization_df['Value'].to_numpy()))
+            conn.executemany("INSERT INTO rollup VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rollup_rows(
+                'docker', docker_snapshots, docker_df['Docker Name'].array, docker_df['Quantity'].to_numpy()))
+            conn.executemany("INSERT INTO rollup VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rollup_rows(
+                'docker_total', total_snapshots, np.full(len(total_snapshots), TOTAL_KEY), dockertotal_df['Total Docker Count'].to_numpy()))
+            for series, snapshots in (('utilization', util_snapshots), ('docker', docker_snapshots), ('docker_total', total_snapshots)):
+                conn.executemany("INSERT INTO rolled_up VALUES (?, ?)", ((series, int(snapshot)) for snapshot in np.unique(snapshots)))
+
+            # Top images of every snapshot
+            counts = pd.DataFrame({'snapshot': docker_snapshots, 'name': docker_df['Docker Name'].astype(str).to_numpy(),
+                                   'quantity': docker_df['Quantity'].to_numpy()})
+            top = counts.sort_values(['snapshot', 'quantity'], ascending=[True, False], kind='stable')
+            top = top.groupby('snapshot', sort=False).head(TOP_IMAGES)
+            top.insert(1, 'rank', top.groupby('snapshot', sort=False).cumcount() + 1)
+            conn.executemany("INSERT INTO top_image VALUES (?, ?, ?, ?)", top.itertuples(index=False, name=None))
+
+            # An image appeared in a snapshot if it was missing from the one
+            # before, and disappeared in the snapshot after its last one
+            snapshots = np.unique(docker_snapshots)
+            position = np.searchsorted(snapshots, docker_snapshots)
+            codes = docker_df['Docker Name'].cat.codes.to_numpy()
+            present = pd.MultiIndex.from_arrays([codes, position])
+            appeared = (position > 0) & ~pd.MultiIndex.from_arrays([codes, position - 1]).isin(present)
+            disappeared = (position < len(snapshots) - 1) & ~pd.MultiIndex.from_arrays([codes, position + 1]).isin(present)
+            names = counts['name'].to_numpy()
+            conn.executemany("INSERT INTO churn VALUES (?, ?, 1)",
+                             zip(docker_snapshots[appeared].tolist(), names[appeared]))
+            conn.executemany("INSERT INTO churn VALUES (?, ?, -1)",
+                             zip(snapshots[position[disappeared] + 1].tolist(), names[disappeared]))
+            if len(snapshots):
+                conn.executemany("INSERT INTO live_image VALUES (?)",
+                                 ((name,) for name in names[docker_snapshots == snapshots[-1]]))
+    finally:
+        conn.close()
+
+
+def read_query(query, params, path):
+    conn = sqlite3.connect(path)
+    try:
+        return pd.read_sql_query(query, conn, params=params)
+    finally:
+        conn.close()
+
+
+# Buckets of one period for one or more keys of a series, between start and
+# end (datetimes, None for open ended). Several keys are combined per bucket.
+# Returns Bucket, Count, Mean, Min, Max and Last columns, empty without rollups.
+def read_rollup(series, keys, period, start=None, end=None, path=ROLLUP_FILE):
+    if isinstance(keys, str):
+        keys = [keys]
+    if not exists(path) or not keys:
+        return pd.DataFrame({'Bucket': pd.Series(dtype='datetime64[ns]'), 'Count': pd.Series(dtype='int64'),
+                             'Mean': [], 'Min': [], 'Max': [], 'Last': []})
+    # Keys go in as one JSON array, a selection can hold every image
+    query = ("SELECT bucket, SUM(count) AS count, SUM(sum) / SUM(count) AS mean, MIN(min) AS min, MAX(max) AS max,"
+             " SUM(last) AS last FROM rollup WHERE period = ? AND series = ?"
+             " AND key IN (SELECT value FROM json_each(?))")
+    params = [period, series, json.dumps(list(keys))]
+    if start is not None:
+        query += " AND bucket >= ?"
+        params.append(int(bucket_starts(period, to_epoch(pd.Timestamp(start)))))
+    if end is not None:
+        query += " AND bucket <= ?"
+        params.append(int(to_epoch(pd.Timestamp(end))))
+    df = read_query(query + " GROUP BY bucket ORDER BY bucket", params, path)
+    return pd.DataFrame({
+        'Bucket': pd.to_datetime(df['bucket'], unit='s'),
+        'Count': df['count'].astype('int64'),
+        'Mean': df['mean'].astype('float64'),
+        'Min': df['min'].astype('float64'),
+        'Max': df['max'].astype('float64'),
+        'Last': df['last'].astype('float64'),
+    })
+
+
+# Ranking of the newest snapshot: Rank, Docker Name and Quantity
+def read_top_images(limit=10, path=ROLLUP_FILE):
+    if not exists(path):
+        return pd.DataFrame(columns=['Rank', 'Docker Name', 'Quantity'])
+    df = read_query("SELECT rank, name, quantity FROM top_image WHERE snapshot = (SELECT MAX(snapshot) FROM top_image)"
+                    " AND rank <= ? ORDER BY rank", (limit,), path)
+    return df.rename(columns={'rank': 'Rank', 'name': 'Docker Name', 'quantity': 'Quantity'})
+
+
+# Images that appeared and disappeared per period bucket since start
+def read_churn(period='daily', start=None, path=ROLLUP_FILE):
+    if not exists(path):
+        return pd.DataFrame({'Bucket': pd.Series(dtype='datetime64[ns]'), 'Appeared': [], 'Disappeared': []})
+    query = "SELECT snapshot, SUM(change > 0) AS appeared, SUM(change < 0) AS disappeared FROM churn"
+    params = []
+    if start is not None:
+        query += " WHERE snapshot >= ?"
+        params.append(int(to_epoch(pd.Timestamp(start))))
+    df = read_query(query + " GROUP BY snapshot ORDER BY snapshot", params, path)
+    df['bucket'] = bucket_starts(period, df['snapshot'].to_numpy())
+    df = df.groupby('bucket', sort=True)[['appeared', 'disappeared']].sum().reset_index()
+    return pd.DataFrame({
+        'Bucket': pd.to_datetime(df['bucket'], unit='s'),
+        'Appeared': df['appeared'].astype('int64'),
+        'Disappeared': df['disappeared'].astype('int64'),
+    })
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    from dataframes import generate_docker_dataframe, generate_dockertotal_dataframe, generate_utilization_dataframe
+    build(generate_docker_dataframe(), generate_dockertotal_dataframe(), generate_utilization_dataframe(), replace=True)
@@ -0,0 +1,91 @@
+import asyncio
+import random
+import logging
+import datetime
+
+# Seconds between two looks at the jobs
+TICK_SECONDS = 5
+
+# Every run is pushed back by up to this fraction of its interval, so the
+# workers of several deployments do not all hit the Flux API at once
+JITTER = 0.1
+MAX_JITTER_SECONDS = 5 * 60
+
+# A failed run is tried again after this many seconds (or the job's interval
+# when that is shorter) instead of a whole interval later
+RETRY_SECONDS = 60 * 60
+
+
+# One periodic task: run() is awaited every interval seconds after the last
+# run, or sooner when it returned False or raised. last_run starts out as the
+# time of the newest snapshot already on disk, so a restart does not collect
+# again what it has just collected.
+class Job:
+    def __init__(self, name, interval, run, jitter=JITTER, last_run=None, retry=RETRY_SECONDS):
+        self.name = name
+        self.interval = datetime.timedelta(seconds=interval)
+        self.retry_interval = min(self.interval, datetime.timedelta(seconds=retry))
+        self.run = run
+        self.jitter = jitter
+        self.task = None
+        self.schedule(last_run)
+
+    def schedule(self, last_run, interval=None):
+        self.last_run = last_run
+        if last_run is None:
+            self.next_run = datetime.datetime.now()
+            return
+        interval = self.interval if interval is None else interval
+        jitter = min(interval.total_seconds() * self.jitter, MAX_JITTER_SECONDS)
+        self.next_run = last_run + interval + datetime.timedelta(seconds=random.uniform(0, jitter))
+
+    def retry(self, last_run):
+        self.schedule(last_run, self.retry_interval)
+
+    @property
+    def running(self):
+        return self.task is not None and not self.task.done()
+
+
+# Runs each job as its own task once it is due. A job whose previous run is
+# still going is skipped until that run is over, the other jobs go on.
+class Scheduler:
+    def __init__(self, jobs, tick=TICK_SECONDS):
+        self.jobs = jobs
+        self.tick = tick
+
+    async def execute(self, job):
+        started = datetime.datetime.now()
+        print(f"Running {job.name} job...")
+        logging.info(f"Running {job.name} job...")
+        succeeded = False
+        try:
+            succeeded = await job.run() is not False
+        except Exception:
+            # A failed run must not take the scheduler down with it
+            logging.exception(f"{job.name} job failed")
+        finally:
+            if succeeded:
+                job.schedule(started)
+            else:
+                job.retry(started)
+            logging.info(f"{job.name} job done in {(datetime.datetime.now() - started).total_seconds():.1f} s, "
+                         f"next run at {job.next_run:%Y-%m-%d %H:%M:%S}")
+
+    def run_due(self):
+        now = datetime.datetime.now()
+        for job in self.jobs:
+            if job.next_run > now:
+                continue
+            if job.running:
+                logging.info(f"{job.name} job is still running, skipping this run")
+                job.schedule(now)
+                continue
+            job.task = asyncio.ensure_future(self.execute(job))
+
+    async def run(self):
+        for job in self.jobs:
+            logging.info(f"{job.name} job every {job.interval}, next run at {job.next_run:%Y-%m-%d %H:%M:%S}")
+        while True:
+            self.run_due()
+            await asyncio.sleep(self.tick)
@@ -0,0 +1,101 @@
+import json, os
+import shutil
+import time
+import logging
+import numpy as np
+import pandas as pd
+
+# History shared between the dashboard workers. The collector exports every
+# data snapshot it publishes as plain .npy columns; the other workers map
+# them read-only instead of parsing data/ themselves, so the pages behind
+# the arrays sit once in the page cache for all workers.
+SHARED_DIR = os.path.join('data', 'shared')
+MANIFEST = 'manifest.json'
+
+# Exports kept around for workers that are still mapping an older one
+KEEP_EXPORTS = 2
+
+
+def save_category(export_dir, name, values):
+    categorical = pd.Categorical(values)
+    np.save(os.path.join(export_dir, f'{name}_codes.npy'), categorical.codes)
+    np.save(os.path.join(export_dir, f'{name}_categories.npy'), np.asarray(categorical.categories, dtype='U'))
+
+
+def load_category(export_dir, name):
+    codes = np.load(os.path.join(export_dir, f'{name}_codes.npy'), mmap_mode='r')
+    categories = np.load(os.path.join(export_dir, f'{name}_categories.npy'))
+    return pd.Categorical.from_codes(codes, categories=categories)
+
+
+def save_column(export_dir, name, values):
+    np.save(os.path.join(export_dir, f'{name}.npy'), np.asarray(values))
+
+
+def load_column(export_dir, name):
+    return np.load(os.path.join(export_dir, f'{name}.npy'), mmap_mode='r')
+
+
+# Write snapshot's frames to a new export and point the manifest at it
+def export_snapshot(snapshot, shared_dir=SHARED_DIR):
+    export_id = f'{time.time_ns()}-{os.getpid()}'
+    export_dir = os.path.join(shared_dir, export_id)
+    os.makedirs(export_dir)
+
+    # Docker rows in image order, so the ImageSeriesIndex of every worker is
+    # a set of views over the mapped columns
+    from dataframes import image_order
+    docker_df = snapshot.docker_df.take(image_order(snapshot.docker_df))
+    save_column(export_dir, 'docker_snapshot', docker_df['Snapshot'].to_numpy('datetime64[ns]'))
+    save_category(export_dir, 'docker_name', docker_df['Docker Name'])
+    save_column(export_dir, 'docker_quantity', docker_df['Quantity'].to_numpy('int64'))
+
+    dockertotal_df = snapshot.dockertotal_df
+    save_column(export_dir, 'total_snapshot', dockertotal_df['Snapshot Date'].to_numpy('datetime64[ns]'))
+    save_column(export_dir, 'total_count', dockertotal_df['Total Docker Count'].to_numpy('int64'))
+
+    utilization_df = snapshot.utilization_df
+    save_column(export_dir, 'util_snapshot', utilization_df['Snapshot'].to_numpy('datetime64[ns]'))
+    save_category(export_dir, 'util_metric', utilization_df['Metric'])
+    save_column(export_dir, 'util_value', utilization_df['Value'].to_numpy('float64'))
+
+    # The manifest is replaced atomically, readers see the old or the new export
+    manifest_path = os.path.join(shared_dir, MANIFEST)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump({'id': export_id, 'version': snapshot.version}, f)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    logging.info(f"Data snapshot version {snapshot.version} exported to {export_dir}")
+
+    exports = sorted(name for name in os.listdir(shared_dir) if name != MANIFEST and not name.endswith('.tmp'))
+    for name in exports[:-KEEP_EXPORTS]:
+        shutil.rmtree(os.path.join(shared_dir, name), ignore_errors=True)
+    return export_id
+
+
+def latest_export_id(shared_dir=SHARED_DIR):
+    try:
+        with open(os.path.join(shared_dir, MANIFEST)) as f:
+            return json.load(f)['id']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+# Map an export back into (docker_df, dockertotal_df, utilization_df)
+def load_export(export_id, shared_dir=SHARED_DIR):
+    export_dir = os.path.join(shared_dir, export_id)
+    docker_df = pd.DataFrame({
+        'Snapshot': load_column(export_dir, 'docker_snapshot'),
+        'Docker Name': load_category(export_dir, 'docker_name'),
+        'Quantity': load_column(export_dir, 'docker_quantity'),
+    }, copy=False)
+    dockertotal_df = pd.DataFrame({
+        'Snapshot Date': load_column(export_dir, 'total_snapshot'),
+        'Total Docker Count': load_column(export_dir, 'total_count'),
+    }, copy=False)
+    utilization_df = pd.DataFrame({
+        'Snapshot': load_column(export_dir, 'util_snapshot'),
+        'Metric': load_category(export_dir, 'util_metric'),
+        'Value': load_column(export_dir, 'util_value'),
+    }, copy=False)
+    logging.info(f"Shared history export {export_id} loaded")
+    return docker_df, dockertotal_df, utilization_df
@@ -0,0 +1,146 @@
+import json, glob, os
+import fnmatch
+import pickle
+import logging
+import tempfile
+import threading
+
+INDEX_FILE = os.path.join('data', 'snapshot_index.pkl')
+ROWS_DIR = os.path.join('data', 'snapshot_rows')
+
+# Layout of the index file, an index of another layout is rebuilt
+INDEX_FORMAT = 2
+
+
+# Write under a temporary name of this process and move it into place, so
+# processes writing the same file never see each other's half-written copy
+def write_pickle(path, value):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+# Persistent index of the snapshot files in data/
+# Every entry keeps only the file mtime and size; the parsed JSON document of
+# every file is pickled on its own under rows_dir. A refresh only opens the
+# files that are new or changed since last time and writes just their rows,
+# and documents are read back from the pickles when a consumer asks for them
+# instead of being held in memory next to the dataframes.
+class SnapshotIndex:
+    def __init__(self, path=INDEX_FILE, rows_dir=ROWS_DIR):
+        self.path = path
+        self.rows_dir = rows_dir
+        self.lock = threading.Lock()
+        self.entries = self.load()
+        # Files (and their mtime) each consumer has already been handed
+        self.consumers = {}
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'rb') as f:
+                index = pickle.load(f)
+            if not isinstance(index, dict) or index.get('format') != INDEX_FORMAT:
+                logging.info("Snapshot index has an old layout, rebuilding")
+                return {}
+            logging.info(f"Snapshot index loaded: {len(index['entries'])} files")
+            return index['entries']
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            # A broken index is only a cache, start again from the JSON files
+            logging.info(f"Snapshot index could not be read, rebuilding: {str(e)}")
+            return {}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        write_pickle(self.path, {'format': INDEX_FORMAT, 'entries': self.entries})
+
+    def rows_path(self, file):
+        return os.path.join(self.rows_dir, os.path.basename(file) + '.pkl')
+
+    def parse(self, file):
+        with open(file) as f:
+            data = json.load(f)
+        os.makedirs(self.rows_dir, exist_ok=True)
+        write_pickle(self.rows_path(file), data)
+        return data
+
+    # Bring the entries matching pattern up to date with the files on disk.
+    # Each consumer (one per dataframe) gets the changes since its own last
+    # refresh as (new_files, changed_files, removed_files), sorted by name.
+    # accept(file) limits the refresh to some of the files, the others are
+    # left to a later refresh without it.
+    def refresh(self, pattern, consumer, accept=None):
+        with self.lock:
+            all_files = set(glob.glob(pattern))
+            files = all_files if accept is None else {file for file in all_files if accept(file)}
+            parsed = 0
+
+            for file in sorted(files):
+                stat = os.stat(file)
+                entry = self.entries.get(file)
+                if entry and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+                    continue
+                try:
+                    self.parse(file)
+                except (OSError, ValueError) as e:
+                    print(f"Skipping unreadable snapshot file {file}: {str(e)}")
+                    logging.info(f"Skipping unreadable snapshot file {file}: {str(e)}")
+                    continue
+                self.entries[file] = {'mtime': stat.st_mtime, 'size': stat.st_size}
+                parsed += 1
+
+            stale = [file for file in self.entries if file not in all_files and fnmatch.fnmatch(file, pattern)]
+            for file in stale:
+                del self.entries[file]
+                try:
+                    os.remove(self.rows_path(file))
+                except OSError:
+                    pass
+
+            if parsed or stale:
+                self.save()
+
+            # Compare against what this consumer has already loaded
+            seen = self.consumers.setdefault(consumer, {})
+            current = {file: entry['mtime'] for file, entry in self.entries.items()
+                       if fnmatch.fnmatch(file, pattern) and (accept is None or accept(file))}
+            new_files = sorted(file for file in current if file not in seen)
+            changed_files = sorted(file for file in current if file in seen and seen[file] != current[file])
+            removed_files = sorted(file for file in seen if file not in current)
+            self.consumers[consumer] = current
+
+            logging.info(f"Snapshot index refreshed for {consumer}: {parsed} files parsed, {len(new_files)} new, "
+                         f"{len(changed_files)} changed, {len(removed_files)} removed")
+            return new_files, changed_files, removed_files
+
+    # The parsed document of one indexed file, from its pickled rows. Rows
+    # that went missing are parsed again from the JSON file.
+    def document(self, file):
+        try:
+            with open(self.rows_path(file), 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            logging.info(f"Rows of {file} missing from {self.rows_dir}, parsing it again")
+            return self.parse(file)
+
+    # Parsed documents for the files matching pattern, in file name order
+    def documents(self, pattern, files=None):
+        with self.lock:
+            if files is None:
+                files = [file for file in sorted(self.entries) if fnmatch.fnmatch(file, pattern)]
+            documents = []
+            for file in files:
+                if file not in self.entries:
+                    continue
+                try:
+                    documents.append(self.document(file))
+                except (OSError, ValueError) as e:
+                    # Gone or broken since the refresh, the next refresh drops or re-reads it
+                    logging.info(f"Skipping unreadable snapshot file {file}: {str(e)}")
+            return documents
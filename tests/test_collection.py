@@ -0,0 +1,190 @@
+import asyncio
+import json
+import os
+import sys
+import time
+
+import pytest
+from aiohttp import web
+
+# Collection timings go to the registry only, not to a metrics.log
+os.environ.setdefault('FLUXUTILMON_METRICS_LOG', '')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+import apidata
+import fixtures
+import fluxapi
+from fluxapi import create_session, fetch_columns, fetch_json, FluxApiError
+from stub_server import StubServer
+
+# Retries, backoff and timeouts of fluxapi.py against a local stub server,
+# and the concurrent, partial collection of apidata.py on top of them.
+
+BENCH_PATH = '/fluxinfo?projection=benchmark,ip'
+UTIL_PATH = '/fluxinfo?projection=apps.resources,ip'
+NODE_COUNT_PATH = '/daemon/getzelnodecount'
+NODE_LIST_PATH = '/daemon/viewdeterministiczelnodelist'
+
+INTERNAL_ERROR = {'status': 'error', 'data': {'message': 'Internal error. Try again later'}}
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    # Read by fluxapi at call time, so no test waits for the real backoff
+    monkeypatch.setattr(fluxapi, 'BACKOFF_SECONDS', 0)
+    monkeypatch.setattr(fluxapi, 'RETRIES', 3)
+
+
+# Handler answering with the given (status, body) per request in turn and
+# repeating the last one; body None is a payload of OK
+def scripted(*answers, delay=0):
+    answers = list(answers)
+
+    async def handle(request):
+        status, body = answers.pop(0) if len(answers) > 1 else answers[0]
+        if delay:
+            await asyncio.sleep(delay)
+        return web.Response(status=status, body=json.dumps(body if body is not None else OK), content_type='application/json')
+    return handle
+
+
+OK = {'status': 'success', 'data': [{'ip': '10.0.0.1:16127', 'benchmark': {'bench': {'cores': 4, 'ram': 32.0, 'ssd': 440.0}}}]}
+
+
+def run_fetch(handlers, fetch):
+    async def run():
+        async with StubServer(handlers=handlers) as server, create_session() as session:
+            result = await fetch(session, server.url)
+            return result, server.hits
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize('status', [500, 502, 503, 429])
+def test_server_errors_are_retried(status):
+    data, hits = run_fetch({BENCH_PATH: scripted((status, {}), (status, {}), (200, None))},
+                           lambda session, url: fetch_json(session, url + BENCH_PATH))
+    assert data == OK
+    assert hits[BENCH_PATH] == 3
+
+
+@pytest.mark.parametrize('status', [400, 403, 404])
+def test_client_errors_are_not_retried(status):
+    with pytest.raises(FluxApiError) as raised:
+        run_fetch({BENCH_PATH: scripted((status, {}), (200, None))},
+                  lambda session, url: fetch_json(session, url + BENCH_PATH))
+    assert not raised.value.retryable
+
+
+def test_client_error_is_requested_once():
+    async def run():
+        async with StubServer(handlers={BENCH_PATH: scripted((404, {}))}) as server, create_session() as session:
+            with pytest.raises(FluxApiError):
+                await fetch_json(session, server.url + BENCH_PATH)
+            return server.hits[BENCH_PATH]
+    assert asyncio.run(run()) == 1
+
+
+def test_retries_give_up():
+    async def run():
+        async with StubServer(handlers={BENCH_PATH: scripted((503, {}))}) as server, create_session() as session:
+            with pytest.raises(FluxApiError):
+                await fetch_json(session, server.url + BENCH_PATH)
+            return server.hits[BENCH_PATH]
+    assert asyncio.run(run()) == fluxapi.RETRIES
+
+
+def test_internal_error_payload_is_retried():
+    data, hits = run_fetch({BENCH_PATH: scripted((200, INTERNAL_ERROR), (200, None))},
+                           lambda session, url: fetch_json(session, url + BENCH_PATH))
+    assert data == OK
+    assert hits[BENCH_PATH] == 2
+
+
+def test_internal_error_payload_is_retried_when_streamed():
+    columns, hits = run_fetch({BENCH_PATH: scripted((200, INTERNAL_ERROR), (200, None))},
+                              lambda session, url: fetch_columns(session, url + BENCH_PATH, apidata.BENCH_FIELDS))
+    assert columns['cores'] == [4]
+    assert hits[BENCH_PATH] == 2
+
+
+def test_timeout_is_retried(monkeypatch):
+    monkeypatch.setattr(fluxapi, 'REQUEST_TIMEOUT_SECONDS', 0.2)
+    slow = scripted((200, None), delay=1)
+    fast = scripted((200, None))
+    answers = [slow, fast]
+
+    async def handle(request):
+        return await (answers.pop(0) if len(answers) > 1 else answers[0])(request)
+
+    data, hits = run_fetch({BENCH_PATH: handle}, lambda session, url: fetch_json(session, url + BENCH_PATH))
+    assert data == OK
+    assert hits[BENCH_PATH] == 2
+
+
+# Stub network for collect_utilization: every endpoint answers with the
+# fixture payload after its delay, unless overridden
+def network_handlers(delays=None, overrides=None):
+    payloads = fixtures.network_payloads(fixtures.make_nodes(50))
+
+    def answer(path, delay):
+        async def handle(request):
+            await asyncio.sleep(delay)
+            return web.Response(body=payloads[path], content_type='application/json')
+        return handle
+
+    delays = delays or {}
+    handlers = {path: answer(path, delays.get(path, 0)) for path in (BENCH_PATH, UTIL_PATH, NODE_COUNT_PATH, NODE_LIST_PATH)}
+    handlers.update(overrides or {})
+    return handlers
+
+
+def collect(monkeypatch, handlers):
+    async def run():
+        async with StubServer(handlers=handlers) as server, create_session() as session:
+            monkeypatch.setattr(apidata, 'benchurl', server.url + BENCH_PATH)
+            monkeypatch.setattr(apidata, 'utilurl', server.url + UTIL_PATH)
+            monkeypatch.setattr(apidata, 'totalnodeurl', server.url + NODE_COUNT_PATH)
+            monkeypatch.setattr(apidata, 'walleturl', server.url + NODE_LIST_PATH)
+            started = time.perf_counter()
+            jsondata = await apidata.collect_utilization(session, capture_nodes=False, archive=False)
+            return jsondata, time.perf_counter() - started
+    return asyncio.run(run())
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    apidata.response_cache.entries.clear()
+    return tmp_path
+
+
+def test_failing_endpoint_gives_partial_snapshot(workdir, monkeypatch):
+    jsondata, _ = collect(monkeypatch, network_handlers(overrides={UTIL_PATH: scripted((500, {}))}))
+    assert jsondata is not None
+    assert jsondata['totalnodes'] == 50
+    assert 'totalbenchmarkcores' in jsondata and 'unique_wallet_count' in jsondata
+    assert 'totalutilcores' not in jsondata and 'utilization_percentage_cores' not in jsondata
+    # Whole-number totals are written as integers, like the sum over the JSON values
+    assert isinstance(jsondata['totalbenchmarkcores'], int)
+    with open(os.path.join('data', f"utilization_{jsondata['Snapshot']}.json")) as f:
+        assert json.load(f) == jsondata
+
+
+def test_no_snapshot_when_every_endpoint_fails(workdir, monkeypatch):
+    failing = scripted((500, {}))
+    handlers = {path: failing for path in (BENCH_PATH, UTIL_PATH, NODE_COUNT_PATH, NODE_LIST_PATH)}
+    jsondata, _ = collect(monkeypatch, handlers)
+    assert jsondata is None
+    assert not os.path.exists('data') or not os.listdir('data')
+
+
+def test_collection_takes_as_long_as_the_slowest_endpoint(workdir, monkeypatch):
+    delays = {BENCH_PATH: 0.1, UTIL_PATH: 0.2, NODE_COUNT_PATH: 0.3, NODE_LIST_PATH: 0.5}
+    jsondata, elapsed = collect(monkeypatch, network_handlers(delays))
+    assert 'utilization_percentage_cores' in jsondata
+    assert isinstance(jsondata['totalutilssd'], int) and isinstance(jsondata['totalutilcores'], float)
+    # Serial requests would take the sum, 1.1 s; the margin keeps a loaded
+    # machine from failing the test while still catching serial requests
+    assert max(delays.values()) <= elapsed < sum(delays.values()) * 0.8
@@ -0,0 +1,94 @@
+import datetime
+import os
+import random
+import sys
+import threading
+
+import numpy as np
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+import bench_loaders
+import data_snapshot
+import dataframes
+from snapshot_index import SnapshotIndex
+
+IMAGES = [f'example{i}/image:latest' for i in range(5)]
+START = datetime.datetime(2024, 1, 1)
+
+
+# data/ with snapshots hours apart, read through a fresh snapshot index
+@pytest.fixture
+def history(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('data')
+    rng = random.Random(0)
+    for hour in range(3):
+        bench_loaders.write_snapshot('data', START + datetime.timedelta(hours=hour), IMAGES, rng)
+    monkeypatch.setattr(dataframes, 'snapshot_index', SnapshotIndex())
+    monkeypatch.setattr(data_snapshot, 'current_snapshot', None)
+    return rng
+
+
+def snapshot_count(snapshot):
+    return snapshot.utilization_df['Snapshot'].nunique()
+
+
+def test_concurrent_refreshes_keep_every_snapshot(history):
+    data_snapshot.publish(data_snapshot.build_snapshot())
+    bench_loaders.write_snapshot('data', START + datetime.timedelta(hours=3), IMAGES, history)
+
+    # Both jobs finish their collection at once and refresh
+    start = threading.Barrier(2)
+
+    def refresh():
+        start.wait()
+        data_snapshot.refresh_snapshot()
+    threads = [threading.Thread(target=refresh) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert snapshot_count(data_snapshot.current()) == 4
+    assert data_snapshot.current().dockertotal_df['Snapshot Date'].nunique() == 4
+    data_snapshot.refresh_snapshot()
+    assert snapshot_count(data_snapshot.current()) == 4
+
+
+def image_series(docker_df, name):
+    series = docker_df[docker_df['Docker Name'] == name][['Snapshot', 'Quantity']]
+    return series.sort_values('Snapshot', kind='stable', ignore_index=True)
+
+
+def test_image_series_index(history):
+    snapshot = data_snapshot.build_snapshot()
+    for name in IMAGES + ['missing:latest']:
+        assert snapshot.image_series.get(name).reset_index(drop=True).equals(image_series(snapshot.docker_df, name))
+
+    # A refresh merges the new rows into a new index and leaves the old one alone
+    bench_loaders.write_snapshot('data', START + datetime.timedelta(hours=3), IMAGES, history)
+    before = {name: snapshot.image_series.get(name) for name in IMAGES}
+    refreshed = data_snapshot.build_snapshot(snapshot)
+    for name in IMAGES:
+        assert refreshed.image_series.get(name).equals(image_series(refreshed.docker_df, name))
+        assert snapshot.image_series.get(name).equals(before[name])
+        assert len(before[name]) == (snapshot.docker_df['Docker Name'] == name).sum()
+
+
+def test_shared_export_is_indexed_without_copies(history):
+    import shared_history
+    snapshot = data_snapshot.build_snapshot()
+    export_id = shared_history.export_snapshot(snapshot)
+    docker_df, dockertotal_df, utilization_df = shared_history.load_export(export_id)
+    shared = data_snapshot.snapshot_from_frames(docker_df, dockertotal_df, utilization_df)
+
+    quantities = docker_df['Quantity'].to_numpy()
+    for name in IMAGES:
+        series = shared.image_series.get(name)
+        assert series.reset_index(drop=True).equals(image_series(snapshot.docker_df, name))
+        # A view of the mapped column
+        assert np.shares_memory(series['Quantity'].to_numpy(), quantities)
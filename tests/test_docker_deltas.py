@@ -0,0 +1,70 @@
+import datetime
+import json
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import docker_deltas
+import history_store
+
+# Snapshots with counts that change, images that appear and disappear, and
+# more of them than fit in one segment
+SNAPSHOTS = [
+    (f'2024-01-{day:02d}_00-00-00', {
+        'nginx:latest': 10 + day % 3,
+        **({'redis:7': day} if day % 5 else {}),
+        **({f'app-{day}:latest': 1} if day > 20 else {}),
+    })
+    for day in range(1, 31)
+]
+
+
+@pytest.fixture
+def delta_dir(tmp_path):
+    delta_dir = str(tmp_path / 'docker_deltas')
+    for snapshot_date, image_counts in SNAPSHOTS:
+        assert docker_deltas.append(snapshot_date, sum(image_counts.values()), image_counts, delta_dir)
+    return delta_dir
+
+
+def expected_counts(snapshots):
+    rows = [(pd.Timestamp(datetime.datetime.strptime(snapshot_date, '%Y-%m-%d_%H-%M-%S')), name, count)
+            for snapshot_date, image_counts in snapshots for name, count in image_counts.items()]
+    return sorted(rows)
+
+
+def rows(df):
+    return sorted(zip(df['Snapshot'], df['Docker Name'].astype(str), df['Quantity']))
+
+
+def test_deltas_round_trip(delta_dir):
+    assert len(docker_deltas.segments(delta_dir)) == 2
+    assert rows(docker_deltas.read_docker_counts(delta_dir=delta_dir)) == expected_counts(SNAPSHOTS)
+    for snapshot_date, image_counts in SNAPSHOTS:
+        assert docker_deltas.read_snapshot(snapshot_date, delta_dir) == (sum(image_counts.values()), image_counts)
+    since = pd.Timestamp('2024-01-25')
+    assert rows(docker_deltas.read_docker_counts(since=since, delta_dir=delta_dir)) == expected_counts(SNAPSHOTS[25:])
+    totals = docker_deltas.read_docker_totals(delta_dir=delta_dir)
+    assert list(totals['Total Docker Count']) == [sum(image_counts.values()) for _, image_counts in SNAPSHOTS]
+
+
+def test_older_snapshot_is_not_appended(delta_dir):
+    assert not docker_deltas.append('2024-01-15_00-00-00', 1, {'nginx:latest': 1}, delta_dir)
+
+
+def test_history_store_migration_keeps_delta_snapshots(tmp_path, delta_dir):
+    # Older snapshots as docker_count files, the later ones only as deltas
+    data_dir = str(tmp_path)
+    for snapshot_date, image_counts in SNAPSHOTS[:3]:
+        with open(os.path.join(data_dir, f'docker_count_{snapshot_date}.json'), 'w') as f:
+            json.dump({'Snapshot': snapshot_date, 'Total Docker Count': sum(image_counts.values()),
+                       'ImageCounts': image_counts}, f)
+    path = str(tmp_path / 'history.db')
+    history_store.import_json_files(data_dir, path, delta_dir)
+
+    assert rows(history_store.read_docker_counts(path=path)) == expected_counts(SNAPSHOTS)
+    assert len(history_store.read_docker_totals(path=path)) == len(SNAPSHOTS)
@@ -0,0 +1,28 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import node_store
+
+# Joining the benchmark and apps.resources payloads per node
+
+
+def test_join_matches_nodes_by_key_not_position():
+    bench = {'node': ['a', 'b', 'c'], 'cores': [2, 4, 8], 'ram': [8, 32, 64], 'ssd': [220, 440, 880]}
+    util = {'node': ['c', 'a'], 'cpus': [7.5, 1.5], 'ram': [60000, 1000], 'hdd': [800, 20]}
+    columns = node_store.join_nodes(bench, util)
+    assert list(columns['node']) == ['a', 'b', 'c']
+    assert list(columns['bench_cores']) == [2, 4, 8]
+    np.testing.assert_array_equal(columns['apps_cpus'], [1.5, np.nan, 7.5])
+
+
+def test_records_without_key_are_left_out():
+    bench = {'node': [None, 'b'], 'cores': [2, 4], 'ram': [8, 32], 'ssd': [220, 440]}
+    util = {'node': [None, None], 'cpus': [1.0, 2.0], 'ram': [100, 200], 'hdd': [1, 2]}
+    columns = node_store.join_nodes(bench, util)
+    assert list(columns['node']) == ['b']
+    assert list(columns['bench_cores']) == [4]
+    assert np.isnan(columns['apps_cpus']).all()
@@ -0,0 +1,68 @@
+import json
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+import fixtures
+import payload_archive
+from payload_archive import ArchiveReader
+
+RESOURCES_PATH = '/fluxinfo?projection=apps.resources,ip'
+IMAGES_PATH = '/fluxinfo?projection=apps.runningapps.Image,ip'
+NODE_COUNT_PATH = '/daemon/getzelnodecount'
+
+
+def spooled(body):
+    raw = tempfile.TemporaryFile()
+    raw.write(body)
+    return raw
+
+
+def test_streamed_payload_is_sorted_across_runs(tmp_path, monkeypatch):
+    # Small runs, so the records are spilled and merged
+    monkeypatch.setattr(payload_archive, 'RUN_RECORDS', 70)
+    monkeypatch.setattr(payload_archive, 'CHUNK_RECORDS', 50)
+    nodes = fixtures.make_nodes(400)
+    random.Random(0).shuffle(nodes)
+    body = fixtures.network_payloads(nodes)[RESOURCES_PATH]
+    payload_archive.archive_downloads('2024-01-01_00-00-00', [('resources', spooled(body), 'ip')], str(tmp_path))
+
+    reader = ArchiveReader('resources', str(tmp_path))
+    payload = reader.read_snapshot('2024-01-01_00-00-00')
+    expected = json.loads(body)
+    expected['data'].sort(key=lambda record: record['ip'])
+    assert payload == expected
+    node = nodes[123]['ip']
+    assert reader.read_node_record('2024-01-01_00-00-00', node)['ip'] == node
+    reader.close()
+
+
+def test_running_apps_by_node(tmp_path):
+    nodes = fixtures.make_nodes(50)
+    body = fixtures.network_payloads(nodes)[IMAGES_PATH]
+    for snapshot_date in ('2024-01-01_00-00-00', '2024-01-01_01-00-00'):
+        payload_archive.archive_downloads(snapshot_date, [('runningapps', spooled(body), 'ip')], str(tmp_path))
+
+    reader = ArchiveReader('runningapps', str(tmp_path))
+    node = nodes[7]
+    history = reader.read_node(node['ip'])
+    assert [snapshot_date for snapshot_date, _ in history] == ['2024-01-01_00-00-00', '2024-01-01_01-00-00']
+    assert [app['Image'] for app in history[0][1]['apps']['runningapps']] == node['images']
+    reader.close()
+
+
+def test_whole_payload_and_unchanged(tmp_path):
+    body = fixtures.network_payloads(fixtures.make_nodes(10))[NODE_COUNT_PATH]
+    downloads = [('nodecount', spooled(body), None)]
+    payload_archive.archive_downloads('2024-01-01_00-00-00', downloads, str(tmp_path))
+    # An empty body, the response cache answered
+    payload_archive.archive_downloads('2024-01-01_01-00-00', [('nodecount', tempfile.TemporaryFile(), None)], str(tmp_path))
+
+    reader = ArchiveReader('nodecount', str(tmp_path))
+    assert reader.snapshots() == ['2024-01-01_00-00-00', '2024-01-01_01-00-00']
+    assert reader.read_snapshot('2024-01-01_01-00-00') == json.loads(body)
+    reader.close()
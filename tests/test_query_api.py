@@ -0,0 +1,129 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import data_snapshot
+
+IMAGES = ['nginx:latest', 'redis:7', 'runonflux/website:latest']
+SNAPSHOTS = pd.date_range('2024-01-01', periods=48, freq='h')
+
+
+@pytest.fixture(scope='module')
+def client(tmp_path_factory):
+    # app.py logs to app.log in the working directory
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('app'))
+    try:
+        import app
+    finally:
+        os.chdir(cwd)
+    return app.app.server.test_client()
+
+
+# A published snapshot of 48 hourly snapshots; redis only shows up in the second day
+@pytest.fixture
+def data(monkeypatch):
+    rows = [(snapshot, image, hour * 10 + i) for hour, snapshot in enumerate(SNAPSHOTS)
+            for i, image in enumerate(IMAGES) if image != 'redis:7' or hour >= 24]
+    docker_df = pd.DataFrame({
+        'Snapshot': [row[0] for row in rows],
+        'Docker Name': pd.Categorical([row[1] for row in rows]),
+        'Quantity': pd.Series([row[2] for row in rows], dtype='int64'),
+    })
+    dockertotal_df = docker_df.groupby('Snapshot', as_index=False)['Quantity'].sum()
+    dockertotal_df.columns = ['Snapshot Date', 'Total Docker Count']
+    utilization_df = pd.DataFrame({
+        'Snapshot': SNAPSHOTS.repeat(2),
+        'Metric': pd.Categorical(['totalnodes', 'totalutilcores'] * len(SNAPSHOTS)),
+        'Value': [float(value) for value in range(2 * len(SNAPSHOTS))],
+    })
+    snapshot = data_snapshot.snapshot_from_frames(docker_df, dockertotal_df, utilization_df)
+    monkeypatch.setattr(data_snapshot, 'current_snapshot', snapshot)
+    return snapshot
+
+
+def test_503_until_data_is_loaded(client, monkeypatch):
+    monkeypatch.setattr(data_snapshot, 'current_snapshot', None)
+    response = client.get('/api/utilization')
+    assert response.status_code == 503
+    assert response.get_json() == {'error': 'No data loaded yet'}
+
+
+def test_utilization_rows(client, data):
+    body = client.get('/api/utilization?metric=totalnodes&start=2024-01-01T10:00&end=2024-01-01T12:00').get_json()
+    assert body['version'] == data.version and body['total'] == 3 and body['next_offset'] is None
+    assert [row['value'] for row in body['rows']] == [20.0, 22.0, 24.0]
+
+
+def test_utilization_resampled_csv(client, data):
+    response = client.get('/api/utilization?metric=totalnodes&resample=1D&agg=max&format=csv')
+    assert response.mimetype == 'text/csv'
+    assert response.get_data(as_text=True).splitlines() == [
+        'snapshot,metric,value', '2024-01-01T00:00:00,totalnodes,46.0', '2024-01-02T00:00:00,totalnodes,94.0']
+
+
+def test_docker_pages_add_up_to_every_row(client, data):
+    everything = client.get('/api/docker?limit=100000').get_json()
+    assert everything['total'] == len(data.docker_df) == len(everything['rows'])
+    assert [row['image'] for row in everything['rows']] == sorted(row['image'] for row in everything['rows'])
+
+    rows, offset = [], 0
+    while offset is not None:
+        response = client.get(f'/api/docker?limit=7&offset={offset}')
+        body = response.get_json()
+        assert body['total'] == everything['total']
+        assert response.headers['X-Total-Count'] == str(everything['total'])
+        rows.extend(body['rows'])
+        offset = body['next_offset']
+    assert rows == everything['rows']
+
+
+def test_docker_filtered_and_resampled(client, data):
+    body = client.get('/api/docker?image=redis:7&start=2024-01-02T05:00').get_json()
+    assert body['total'] == 19 and {row['image'] for row in body['rows']} == {'redis:7'}
+    body = client.get('/api/docker?prefix=runonflux/&resample=1D&agg=first').get_json()
+    assert [(row['snapshot'][:10], row['quantity']) for row in body['rows']] == [('2024-01-01', 2), ('2024-01-02', 242)]
+    assert client.get('/api/docker?image=missing:latest').get_json()['total'] == 0
+
+
+def test_docker_total_top_and_lists(client, data):
+    body = client.get('/api/docker/total?start=2024-01-02T23:00').get_json()
+    assert body['rows'] == [{'snapshot': '2024-01-02T23:00:00.000', 'total': 470 + 471 + 472}]
+    top = client.get('/api/docker/top?n=2').get_json()['rows']
+    assert [row['image'] for row in top] == ['runonflux/website:latest', 'redis:7']
+    assert client.get('/api/docker/images?prefix=redis').get_json()['rows'] == [{'image': 'redis:7'}]
+    assert client.get('/api/utilization/metrics').get_json()['metrics'] == ['totalnodes', 'totalutilcores']
+
+
+@pytest.mark.parametrize('query', [
+    '/api/docker?limit=0',
+    '/api/docker?limit=100001',
+    '/api/docker?offset=-1',
+    '/api/docker?start=yesterday-ish',
+    '/api/docker?start=2024-01-01T00:00%2B02:00',
+    '/api/docker?resample=fortnightly',
+    '/api/docker?format=xml',
+    '/api/utilization?metric=nosuchmetric',
+    '/api/utilization?agg=median',
+])
+def test_bad_parameters_are_400(client, data, query):
+    response = client.get(query)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+# Only a gunicorn worker that is not the collector merges the exported timings
+@pytest.mark.parametrize('shared, merged', [(False, False), (True, True)])
+def test_metrics_merge_the_collector_export_when_shared(client, monkeypatch, shared, merged):
+    import app
+    import metrics
+    reads = []
+    monkeypatch.setattr(metrics, 'read_state', lambda: reads.append(True) or {'timings': [], 'counters': []})
+    monkeypatch.setattr(app, 'shared_workers', shared)
+    response = client.get('/metrics')
+    assert response.status_code == 200 and response.mimetype == 'text/plain'
+    assert bool(reads) == merged
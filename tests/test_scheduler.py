@@ -0,0 +1,50 @@
+import asyncio
+import datetime
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scheduler import Job, Scheduler
+
+INTERVAL = 23 * 60 * 60
+
+
+def run_once(job):
+    asyncio.run(Scheduler([job]).execute(job))
+    return (job.next_run - job.last_run).total_seconds()
+
+
+def job_returning(result):
+    async def run():
+        if isinstance(result, Exception):
+            raise result
+        return result
+    return Job('test', INTERVAL, run, jitter=0)
+
+
+def test_successful_run_waits_the_interval():
+    assert run_once(job_returning(True)) == INTERVAL
+    # Jobs that do not report a result count as successful
+    assert run_once(job_returning(None)) == INTERVAL
+
+
+def test_failed_run_is_retried_sooner():
+    assert run_once(job_returning(False)) == 60 * 60
+    assert run_once(job_returning(RuntimeError('network down'))) == 60 * 60
+
+
+def test_retry_is_not_later_than_the_interval():
+    async def run():
+        return False
+    job = Job('test', 60, run, jitter=0)
+    assert run_once(job) == 60
+
+
+def test_retry_is_jittered():
+    async def run():
+        return False
+    job = Job('test', INTERVAL, run)
+    delay = run_once(job)
+    assert 60 * 60 <= delay <= 60 * 60 + 6 * 60
+    assert job.next_run > datetime.datetime.now()
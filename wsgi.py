@@ -0,0 +1,7 @@
+# Entry point for gunicorn: gunicorn -c gunicorn.conf.py wsgi:server
+from app import app, start
+
+# Every worker serves the dashboard; one of them is elected to collect
+start(shared=True)
+
+server = app.server